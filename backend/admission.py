@@ -0,0 +1,466 @@
+import collections
+import io
+import math
+import os
+import threading
+import time
+import weakref
+import cancellation
+import tracing
+from image_converter import BATCH_MEMORY_BUDGET, estimate_conversion_memory
+from large_image import LARGE_IMAGE_PIXELS, TILE_BUDGET
+from metrics import Counter, Gauge, Histogram, call_when_sent
+from resource_guard import GUARD_MAX_PAGE_PIXELS, GUARD_MAX_RENDER_PIXELS, ResourceLimitError, check_image
+
+try:
+    import fitz  # PyMuPDF
+    from slide_render import PPT_SLIDE_DPI
+except ImportError:
+    fitz = None
+    PPT_SLIDE_DPI = 150
+
+# Admission control for upload endpoints; set ADMISSION=0 to turn it off
+ADMISSION = os.environ.get('ADMISSION', '1') != '0'
+
+# Per-process budget: estimated peak memory of the requests running at once,
+# and how many expensive requests run at once (roughly one per core)
+ADMISSION_MEMORY_MB = int(os.environ.get('ADMISSION_MEMORY_MB', 1024))
+ADMISSION_SLOTS = int(os.environ.get('ADMISSION_SLOTS', os.cpu_count() or 2))
+
+# Cheap requests (info, split, small conversions) take a fast-lane slot
+# instead, so they are not queued behind heavy renders
+ADMISSION_FAST_SLOTS = int(os.environ.get('ADMISSION_FAST_SLOTS', 4))
+ADMISSION_FAST_MB = int(os.environ.get('ADMISSION_FAST_MB', 32))
+ADMISSION_FAST_MEGAPIXELS = float(os.environ.get('ADMISSION_FAST_MEGAPIXELS', 8))
+
+# Requests that do not fit wait in a FIFO queue; beyond ADMISSION_MAX_QUEUE
+# waiting requests, or after ADMISSION_QUEUE_TIMEOUT seconds, they get 429
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 32))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 30))
+
+# Renders that can never fit the memory budget are run at a lower DPI, down
+# to ADMISSION_MIN_DPI. With ADMISSION_DOWNGRADE_UNDER_LOAD=1 renders that
+# would have to queue are downgraded to fit the memory that is free instead.
+ADMISSION_MIN_DPI = int(os.environ.get('ADMISSION_MIN_DPI', 72))
+ADMISSION_DOWNGRADE_UNDER_LOAD = os.environ.get('ADMISSION_DOWNGRADE_UNDER_LOAD', '0') == '1'
+
+# Costs are estimated without reading whole uploads: images from their first
+# ADMISSION_SNIFF_KB (where the header is), PDFs from their page boxes up to
+# ADMISSION_PARSE_MAX_MB and from their size beyond that
+ADMISSION_SNIFF_KB = int(os.environ.get('ADMISSION_SNIFF_KB', 256))
+ADMISSION_PARSE_MAX_MB = int(os.environ.get('ADMISSION_PARSE_MAX_MB', 16))
+
+# Cost model. Renders hold the upload and the parsed document, a couple of
+# copies of the largest page raster, and whatever encoded output the
+# converter keeps until it returns (bytes per rendered pixel).
+_INPUT_COPIES = 3
+_RASTER_COPIES = 2
+_DOCUMENT_PAGE_MEGAPIXELS = 0.1
+_OCR_DPI = 300
+_OCR_WORK_FACTOR = 10
+_SLIDE_INCHES = (10, 7.5)
+# PDFs too large to parse count as Letter pages of this many bytes each; the
+# render budgets cap what an overestimate can cost
+_UNPARSED_PAGE_BYTES = 100 * 1024
+_UNPARSED_PAGE_SIZE = (612, 792)
+
+# route: (kind, dpi form field, default DPI, bytes per pixel, held output bytes per pixel)
+ROUTE_COSTS = {
+    '/pdf/to-images': ('render', 'dpi', 200, 3, 0.5),
+    '/pdf/compress': ('render', 'dpi', 150, 3, 0.1),
+    '/pdf/to-ppt': ('slides', 'dpi', PPT_SLIDE_DPI, 3, 0.2),
+    '/pdf/ocr': ('ocr', None, _OCR_DPI, 1, 0),
+    '/convert': ('image', None, None, None, None),
+    '/convert/batch': ('images', None, None, None, None),
+    '/pdf/from-images': ('images', None, None, None, None),
+    '/ocr/extract': ('image', None, None, None, None),
+}
+
+LANE_FAST = 'fast'
+LANE_HEAVY = 'heavy'
+
+DECISIONS = Counter('admission_decisions_total', 'Admission decisions for upload requests', ['route', 'decision'])
+QUEUE_WAIT = Histogram('admission_queue_wait_seconds', 'Time admitted requests waited for budget', ['lane'])
+QUEUE_LENGTH = Gauge('admission_queue_length', 'Requests waiting for admission')
+MEMORY_RESERVED = Gauge('admission_memory_reserved_bytes', 'Estimated memory of the admitted heavy requests')
+RUNNING = Gauge('admission_running', 'Admitted requests still running or streaming', ['lane'])
+
+
+class Rejected(Exception):
+    """Request refused by admission control; carries the HTTP status and details"""
+
+    def __init__(self, message, status=429, retry_after=None, **details):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.details = details
+
+
+class Cost:
+    """Estimated peak memory (bytes) and work (megapixels rendered or decoded) of a request"""
+
+    def __init__(self, memory, work, dpi=None, rescale=None):
+        self.memory = int(memory)
+        self.work = work
+        self.dpi = dpi
+        # rescale(dpi) -> Cost of the same request at another DPI, for renders
+        self.rescale = rescale
+
+    def is_fast(self):
+        return self.memory <= ADMISSION_FAST_MB * 1024 * 1024 and self.work <= ADMISSION_FAST_MEGAPIXELS
+
+
+def _page_sizes(pdf_bytes):
+    # Page sizes in points, from the page tree only; no page is rendered
+    doc = fitz.open(stream=pdf_bytes, filetype='pdf')
+    try:
+        if doc.needs_pass:
+            return []
+        return [(rect.width, rect.height) for rect in (doc.page_cropbox(i) for i in range(doc.page_count))]
+    finally:
+        doc.close()
+
+
+def _render_cost(input_bytes, page_inches, dpi, bytes_per_pixel, held_per_pixel, work_factor=1):
+    pixels = [area * dpi * dpi for area in page_inches]
+    # resource_guard lowers the DPI of requests over its budgets and renders
+    # oversized pages at a lower DPI or in strips
+    total = min(sum(pixels), GUARD_MAX_RENDER_PIXELS)
+    largest = min(max(pixels, default=0), GUARD_MAX_PAGE_PIXELS)
+    memory = (input_bytes * _INPUT_COPIES + largest * bytes_per_pixel * _RASTER_COPIES + total * held_per_pixel)
+    return Cost(memory, total / 1e6 * work_factor, dpi)
+
+
+def _document_cost(input_bytes, pages):
+    return Cost(input_bytes * (_INPUT_COPIES + 1), pages * _DOCUMENT_PAGE_MEGAPIXELS)
+
+
+def _image_cost(head, input_bytes):
+    # head: the first bytes of the upload, enough for its header
+    try:
+        width, height = check_image(head, streamed=True)
+        pixels = width * height
+        memory = estimate_conversion_memory(head, input_bytes)
+    except ResourceLimitError:
+        # The endpoint refuses it from the same header before decoding
+        return Cost(input_bytes * _INPUT_COPIES, 0)
+    except Exception:
+        # Not an image, or its header lies past the bytes read (some TIFFs)
+        return Cost(input_bytes * _INPUT_COPIES, 0)
+    if pixels > LARGE_IMAGE_PIXELS:
+        # Converted in strips of TILE_BUDGET bytes
+        memory = min(memory, TILE_BUDGET * _RASTER_COPIES + input_bytes * 2)
+    return Cost(memory, pixels / 1e6)
+
+
+def _upload_size(storage):
+    stream = storage.stream
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def _read_head(storage, limit):
+    data = storage.stream.read(limit)
+    storage.stream.seek(0)
+    return data
+
+
+def _upload_page_sizes(storage, size):
+    if size > ADMISSION_PARSE_MAX_MB * 1024 * 1024:
+        return [_UNPARSED_PAGE_SIZE] * max(1, size // _UNPARSED_PAGE_BYTES)
+    return _page_sizes(_read_head(storage, size))
+
+
+def estimate_cost(route, files, form):
+    """Cost of an upload request from its files' sizes, headers and page boxes, before any work"""
+    kind, dpi_field, default_dpi, bytes_per_pixel, held = ROUTE_COSTS.get(route, ('document',) + (None,) * 4)
+    lengths = [_upload_size(storage) for storage in files]
+    input_bytes = sum(lengths)
+
+    if kind in ('image', 'images'):
+        head = ADMISSION_SNIFF_KB * 1024
+        costs = [_image_cost(_read_head(storage, head), length) for storage, length in zip(files, lengths)]
+        if kind == 'image':
+            return costs[0] if costs else Cost(0, 0)
+        memory = sum(cost.memory for cost in costs)
+        if len(costs) > 1:
+            # Batches hold one request-wide budget of their own
+            memory = min(memory, BATCH_MEMORY_BUDGET + input_bytes)
+        return Cost(memory, sum(cost.work for cost in costs))
+
+    if fitz is None or not files:
+        return _document_cost(input_bytes, 1)
+    try:
+        sizes = [size for storage, length in zip(files, lengths) for size in _upload_page_sizes(storage, length)]
+    except Exception:
+        # Not a readable PDF; the endpoint reports that itself
+        return _document_cost(input_bytes, 1)
+    if kind == 'document' or (kind == 'slides' and form.get('mode', 'raster').lower() == 'vector'):
+        return _document_cost(input_bytes, len(sizes))
+
+    if kind == 'slides':
+        areas = [_SLIDE_INCHES[0] * _SLIDE_INCHES[1]] * len(sizes)
+    else:
+        areas = [width / 72 * height / 72 for width, height in sizes]
+    work_factor = _OCR_WORK_FACTOR if kind == 'ocr' else 1
+    dpi = default_dpi
+    if dpi_field:
+        try:
+            dpi = int(form.get(dpi_field, default_dpi))
+        except ValueError:
+            pass
+
+    def at_dpi(value):
+        cost = _render_cost(input_bytes, areas, value, bytes_per_pixel, held, work_factor)
+        cost.rescale = at_dpi if dpi_field else None
+        return cost
+    return at_dpi(dpi)
+
+
+def _fitting_dpi(cost, memory):
+    """Highest DPI at or above ADMISSION_MIN_DPI whose cost fits in memory, or None"""
+    if cost.rescale is None or cost.dpi is None:
+        return None
+    low, high = ADMISSION_MIN_DPI, cost.dpi - 1
+    if high < low or cost.rescale(low).memory > memory:
+        return None
+    while low < high:
+        middle = (low + high + 1) // 2
+        if cost.rescale(middle).memory <= memory:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class Ticket:
+    def __init__(self, lane, memory):
+        self.lane = lane
+        self.memory = memory
+        self.start = time.perf_counter()
+        self.released = False
+
+
+class AdmissionController:
+    """Memory and slot budget of one process, with a FIFO queue and a fast lane"""
+
+    def __init__(self, memory_budget, slots, fast_slots, max_queue):
+        self.memory_budget = memory_budget
+        self.slots = slots
+        self.fast_slots = fast_slots
+        self.max_queue = max_queue
+        self.memory_used = 0
+        self.running = 0
+        self.fast_running = 0
+        self._waiting = collections.deque()
+        self._cond = threading.Condition()
+        # Moving average of how long heavy requests hold their slot
+        self._hold_seconds = 5.0
+
+    def _fits(self, memory):
+        return self.running < self.slots and self.memory_used + memory <= self.memory_budget
+
+    def free_memory(self):
+        with self._cond:
+            return self.memory_budget - self.memory_used
+
+    def try_fast(self):
+        with self._cond:
+            if self.fast_running < self.fast_slots:
+                self.fast_running += 1
+                return Ticket(LANE_FAST, 0)
+        return None
+
+    def acquire(self, memory, timeout, wait=True, token=None):
+        """
+        Reserve memory and a slot, waiting in FIFO order; returns a Ticket or raises Rejected
+
+        A waiting request also stops, with Cancelled, when its cancel token fires.
+        """
+        with self._cond:
+            if not self._waiting and self._fits(memory):
+                return self._grant(memory)
+            if not wait:
+                return None
+            if len(self._waiting) >= self.max_queue:
+                raise Rejected('Server is busy, try again later', retry_after=self._retry_after_locked(),
+                               reason='queue_full')
+            marker = object()
+            self._waiting.append(marker)
+            QUEUE_LENGTH.inc()
+            deadline = time.monotonic() + timeout
+            try:
+                while not (self._waiting[0] is marker and self._fits(memory)):
+                    if token is not None:
+                        token.check()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Rejected('Server is busy, try again later', retry_after=self._retry_after_locked(),
+                                       reason='queue_timeout')
+                    if token is not None:
+                        remaining = min(remaining, cancellation.CANCEL_POLL_INTERVAL)
+                    self._cond.wait(remaining)
+                return self._grant(memory)
+            finally:
+                self._waiting.remove(marker)
+                QUEUE_LENGTH.dec()
+                # The next request in line may fit now
+                self._cond.notify_all()
+
+    def _retry_after_locked(self):
+        # Seconds until a new heavy request could expect to start
+        rounds = (len(self._waiting) + self.running) / max(self.slots, 1)
+        return int(min(max(math.ceil(self._hold_seconds * rounds), 1), 120))
+
+    def _grant(self, memory):
+        self.memory_used += memory
+        self.running += 1
+        MEMORY_RESERVED.inc(memory)
+        return Ticket(LANE_HEAVY, memory)
+
+    def release(self, ticket):
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.lane == LANE_FAST:
+                self.fast_running -= 1
+            else:
+                self.memory_used -= ticket.memory
+                self.running -= 1
+                MEMORY_RESERVED.dec(ticket.memory)
+                held = time.perf_counter() - ticket.start
+                self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held
+            self._cond.notify_all()
+        RUNNING.dec(lane=ticket.lane)
+
+
+controller = AdmissionController(ADMISSION_MEMORY_MB * 1024 * 1024, ADMISSION_SLOTS, ADMISSION_FAST_SLOTS,
+                                 ADMISSION_MAX_QUEUE)
+
+
+def admit(cost, route):
+    """Ticket for a request of the given cost, and the DPI it may render at
+
+    Cheap requests take a fast-lane slot when one is free. Others reserve
+    their memory estimate; a render too big for the whole budget is
+    downgraded to a DPI that fits, and anything else waits its turn.
+    Raises Rejected when the request cannot fit or the queue is full.
+    """
+    if cost.is_fast():
+        ticket = controller.try_fast()
+        if ticket:
+            DECISIONS.inc(route=route, decision='fast')
+            return ticket, None
+
+    dpi = None
+    if cost.memory > controller.memory_budget:
+        dpi = _fitting_dpi(cost, controller.memory_budget)
+        if dpi is None:
+            raise _too_large(cost.memory, route)
+        cost = cost.rescale(dpi)
+    elif ADMISSION_DOWNGRADE_UNDER_LOAD and cost.rescale:
+        ticket = controller.acquire(cost.memory, 0, wait=False)
+        if ticket:
+            DECISIONS.inc(route=route, decision='admitted')
+            return ticket, None
+        dpi = _fitting_dpi(cost, controller.free_memory())
+        if dpi is not None:
+            cost = cost.rescale(dpi)
+
+    try:
+        ticket = controller.acquire(cost.memory, ADMISSION_QUEUE_TIMEOUT, token=cancellation.current_token())
+    except Rejected as e:
+        DECISIONS.inc(route=route, decision=e.details.get('reason', 'rejected'))
+        raise
+    DECISIONS.inc(route=route, decision='downgraded' if dpi else 'admitted')
+    return ticket, dpi
+
+
+def _too_large(memory, route):
+    DECISIONS.inc(route=route, decision='too_large')
+    return Rejected(
+        f'Request needs ~{memory // (1024 * 1024)} MB, above the '
+        f'{controller.memory_budget // (1024 * 1024)} MB budget of this server',
+        status=413, reason='too_large', estimated_mb=memory // (1024 * 1024),
+        budget_mb=controller.memory_budget // (1024 * 1024))
+
+
+def granted_dpi(dpi):
+    """The DPI a render endpoint should use: the requested one unless admission lowered it"""
+    from flask import g
+    return g.get('admission_dpi') or dpi
+
+
+def install(app):
+    """Gate upload requests (POST with files) on the process's admission budget"""
+    from flask import g, jsonify, request
+
+    if not ADMISSION:
+        return
+
+    def rejected(e):
+        body = {'error': str(e), **e.details}
+        if e.retry_after:
+            body['retry_after'] = e.retry_after
+        response = jsonify(body)
+        response.status_code = e.status
+        if e.retry_after:
+            response.headers['Retry-After'] = str(e.retry_after)
+        return response
+
+    @app.before_request
+    def _admit_request():
+        if request.method != 'POST' or request.mimetype != 'multipart/form-data':
+            return None
+        route = request.url_rule.rule if request.url_rule else request.path
+        # Every request holds its upload a few times over; refuse those that
+        # never fit before the body is read
+        if request.content_length and request.content_length * _INPUT_COPIES > controller.memory_budget:
+            return rejected(_too_large(request.content_length * _INPUT_COPIES, route))
+        if not request.files:
+            return None
+        files = [storage for name in request.files for storage in request.files.getlist(name) if storage.filename]
+        cost = estimate_cost(route, files, request.form)
+        start = time.perf_counter()
+        try:
+            ticket, dpi = admit(cost, route)
+        except Rejected as e:
+            return rejected(e)
+        except cancellation.Cancelled as e:
+            # Deadline, cancel call or disconnect while queued
+            return jsonify(e.to_dict()), e.status
+        waited = time.perf_counter() - start
+        QUEUE_WAIT.observe(waited, lane=ticket.lane)
+        RUNNING.inc(lane=ticket.lane)
+        tracing.record_span('queue', waited)
+        tracing.annotate(admission_lane=ticket.lane, estimated_mb=round(cost.memory / 1024 / 1024, 1))
+        g.admission_ticket = ticket
+        g.admission_dpi = dpi
+        if dpi:
+            tracing.annotate(admission_dpi=dpi)
+
+    @app.after_request
+    def _release_when_sent(response):
+        ticket = g.get('admission_ticket')
+        if ticket is None:
+            return response
+        if g.get('admission_dpi'):
+            response.headers['X-Admission-Downgraded'] = f"dpi={g.admission_dpi}"
+        if response.is_streamed:
+            # Streamed bodies keep working until they are sent. One that is
+            # dropped without being closed frees the slot when collected.
+            g.pop('admission_ticket')
+            call_when_sent(response, lambda sent: controller.release(ticket))
+            weakref.finalize(response.response, controller.release, ticket)
+        return response
+
+    @app.teardown_request
+    def _release_held(error):
+        # Errors, buffered responses (complete by now) and responses a later
+        # hook replaced; releasing twice is harmless
+        ticket = g.pop('admission_ticket', None)
+        if ticket is not None:
+            controller.release(ticket)
@@ -1,10 +1,21 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, request, send_file, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from PIL import Image
 import io
 import os
 import zipfile
 from werkzeug.utils import secure_filename
+from image_converter import (
+    SUPPORTED_FORMATS, FRAME_MODES, run_conversion, batch_convert_images, iter_frames,
+    output_filename, get_extension
+)
+from zip_stream import stream_zip
+from encoding_profiles import ENCODING_PROFILES, DEFAULT_PROFILE
+from metrics import instrument_app, render_metrics
+import admission
+import cancellation
+import profiling
+import tracing
+from resource_guard import ResourceLimitError
 
 # Import with error handling
 PDF_AVAILABLE = True
@@ -12,7 +23,9 @@ try:
     from pdf_converter import (
         pdf_to_images, images_to_pdf, merge_pdfs, split_pdf,
         compress_pdf, get_pdf_info, delete_pdf_pages, pdf_to_ppt, rotate_pdf_pages,
-        pdf_to_word, pdf_to_text, pdf_to_excel, excel_to_pdf, ocr_pdf, encrypt_pdf, decrypt_pdf, add_watermark, extract_images
+        pdf_to_word, pdf_to_text, iter_pdf_text, pdf_to_excel, excel_to_pdf, ocr_pdf, ocr_pdf_pages, ocr_pdf_searchable, OCR_MODES, OCR_OUTPUTS, encrypt_pdf, decrypt_pdf, add_watermark, extract_images,
+        iter_extracted_images, EXTRACT_MIN_IMAGE_SIZE, PPT_MODES, PPT_IMAGE_FORMATS,
+        PPT_SLIDE_DPI, PPT_JPEG_QUALITY
     )
 except Exception as e:
     print(f"Warning: Could not import pdf_converter: {e}")
@@ -31,19 +44,38 @@ except Exception as e:
     rotate_pdf_pages = _pdf_unavailable
     pdf_to_word = _pdf_unavailable
     pdf_to_text = _pdf_unavailable
+    iter_pdf_text = _pdf_unavailable
     pdf_to_excel = _pdf_unavailable
     excel_to_pdf = _pdf_unavailable
     ocr_pdf = _pdf_unavailable
+    ocr_pdf_pages = _pdf_unavailable
+    ocr_pdf_searchable = _pdf_unavailable
+    OCR_MODES = ['hybrid', 'full']
+    OCR_OUTPUTS = ['json', 'pdf']
     encrypt_pdf = _pdf_unavailable
     decrypt_pdf = _pdf_unavailable
     add_watermark = _pdf_unavailable
     extract_images = _pdf_unavailable
+    iter_extracted_images = _pdf_unavailable
+    EXTRACT_MIN_IMAGE_SIZE = 16
+    PPT_MODES = ['raster', 'vector']
+    PPT_IMAGE_FORMATS = ['JPEG', 'PNG']
+    PPT_SLIDE_DPI = 150
+    PPT_JPEG_QUALITY = 85
 
 try:
     from ocr_converter import (
-        extract_text_from_image, create_text_file, create_word_file, get_supported_languages
+        extract_text_from_image, create_text_file, create_word_file, get_supported_languages,
+        get_language_report, resolve_language, discover_languages, extract_layout_from_images,
+        LanguageError, TesseractNotInstalledError
+    )
+    from ocr_results import (
+        OCR_OUTPUT_FORMATS, load_images, load_result, mean_confidence, result_text,
+        save_result, to_hocr, to_layout, to_searchable_pdf
     )
     OCR_AVAILABLE = True
+    # Discover installed language packs once at startup
+    discover_languages()
 except ImportError as e:
     print(f"Warning: Could not import ocr_converter: {e}")
     OCR_AVAILABLE = False
@@ -56,17 +88,62 @@ except ImportError as e:
         raise Exception("OCR module not available.")
     def get_supported_languages():
         return ['english']
+    def get_language_report(*args, **kwargs):
+        return {'languages': ['english']}
+    def resolve_language(*args, **kwargs):
+        raise Exception("OCR module not available.")
+    class LanguageError(ValueError):
+        pass
+    class TesseractNotInstalledError(Exception):
+        pass
 
 app = Flask(__name__)
-CORS(app)
-
-# Supported formats
-SUPPORTED_FORMATS = ['PNG', 'JPEG', 'JPG', 'WEBP', 'BMP', 'GIF', 'TIFF', 'ICO']
+# Let the frontend read the headers that describe how a result was produced
+CORS(app, expose_headers=['X-Conversion-Path', 'X-Conversion-Reason', 'Server-Timing', 'X-Trace-Id', 'X-Profile-Id',
+                          'Retry-After', 'X-Admission-Downgraded', 'X-Job-Id', 'X-Render-DPI'])
+instrument_app(app)
+profiling.install(app)
+cancellation.install(app)
+admission.install(app)
 
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({'status': 'ok', 'message': 'Server is running', 'pdf_available': PDF_AVAILABLE, 'ocr_available': OCR_AVAILABLE}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request, byte, page and conversion stage metrics in Prometheus text format"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job_endpoint(job_id):
+    """Stop a running conversion at its next page boundary"""
+    if not cancellation.cancel_job(job_id):
+        return jsonify({'error': 'Job not found or already finished'}), 404
+    return jsonify({'job_id': job_id, 'status': 'cancelling'}), 202
+
+@app.route('/debug/profiles', methods=['GET'])
+def list_profiles_endpoint():
+    """List captured request profiles (admin token required)"""
+    if not profiling.is_admin(request):
+        return jsonify({'error': 'Profiling is disabled or the admin token is missing'}), 403
+    return jsonify({'profiles': profiling.list_profiles()})
+
+@app.route('/debug/profiles/<profile_id>', methods=['GET'])
+def download_profile_endpoint(profile_id):
+    """Download one captured profile as a ZIP (admin token required)"""
+    if not profiling.is_admin(request):
+        return jsonify({'error': 'Profiling is disabled or the admin token is missing'}), 403
+    try:
+        files = profiling.iter_profile_files(profile_id)
+    except KeyError:
+        return jsonify({'error': 'Profile not found'}), 404
+    return Response(
+        stream_with_context(stream_zip(files)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=profile_{profile_id}.zip'}
+    )
+
 @app.route('/convert', methods=['POST'])
 def convert_image():
     try:
@@ -76,6 +153,12 @@ def convert_image():
 
         file = request.files['file']
         target_format = request.form.get('format', 'PNG').upper()
+        frames = request.form.get('frames', 'all').lower()
+        max_width = int(request.form.get('maxWidth') or 0)
+        max_height = int(request.form.get('maxHeight') or 0)
+        max_size = (max_width, max_height) if max_width or max_height else None
+        strip_metadata = request.form.get('stripMetadata', 'false').lower() == 'true'
+        profile = request.form.get('profile', DEFAULT_PROFILE).lower()
 
         # Validate file
         if file.filename == '':
@@ -85,40 +168,71 @@ def convert_image():
         if target_format not in SUPPORTED_FORMATS:
             return jsonify({'error': f'Unsupported format. Supported formats: {", ".join(SUPPORTED_FORMATS)}'}), 400
 
-        # Read the image
-        image_data = file.read()
-        img = Image.open(io.BytesIO(image_data))
+        if frames not in FRAME_MODES:
+            return jsonify({'error': f'Unsupported frames mode. Supported modes: {", ".join(FRAME_MODES)}'}), 400
 
-        # Convert RGBA to RGB if saving as JPEG
-        if target_format in ['JPEG', 'JPG'] and img.mode in ('RGBA', 'LA', 'P'):
-            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = rgb_img
+        if profile not in ENCODING_PROFILES:
+            return jsonify({'error': f'Unsupported profile. Supported profiles: {", ".join(ENCODING_PROFILES)}'}), 400
 
-        # Create output buffer
-        output = io.BytesIO()
+        image_data = file.read()
+
+        # Explode every frame into a ZIP streamed as frames are encoded
+        if frames == 'zip':
+            original_name = os.path.splitext(secure_filename(file.filename))[0]
+            return Response(
+                stream_with_context(stream_zip(iter_frames(image_data, target_format, file.filename, profile), compression=zipfile.ZIP_STORED)),
+                mimetype='application/zip',
+                headers={'Content-Disposition': f'attachment; filename={original_name}_frames.zip'}
+            )
 
-        # Save image in target format
-        save_format = 'JPEG' if target_format == 'JPG' else target_format
-        img.save(output, format=save_format, quality=95)
-        output.seek(0)
+        # Convert the image, skipping the decode when nothing needs to change
+        data, plan = run_conversion(image_data, target_format, frames, max_size, strip_metadata, profile)
+        output = io.BytesIO(data)
 
         # Generate filename
-        original_name = os.path.splitext(secure_filename(file.filename))[0]
-        extension = target_format.lower()
-        if extension == 'jpeg':
-            extension = 'jpg'
-        new_filename = f"{original_name}.{extension}"
+        extension = get_extension(target_format)
+        new_filename = output_filename(file.filename, target_format)
 
         # Return the converted image
-        return send_file(
+        response = send_file(
             output,
             mimetype=f'image/{extension}',
             as_attachment=True,
             download_name=new_filename
         )
+        response.headers['X-Conversion-Path'] = plan['path']
+        response.headers['X-Conversion-Reason'] = plan['reason']
+        return response
+
+    except ResourceLimitError as e:
+        return jsonify(e.to_dict()), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/convert/batch', methods=['POST'])
+def convert_batch_endpoint():
+    """Convert many images at once and stream them back as a ZIP"""
+    try:
+        files = [f for f in request.files.getlist('files') if f.filename]
+        target_format = request.form.get('format', 'PNG').upper()
+        profile = request.form.get('profile', DEFAULT_PROFILE).lower()
+
+        if not files:
+            return jsonify({'error': 'No files provided'}), 400
+
+        if target_format not in SUPPORTED_FORMATS:
+            return jsonify({'error': f'Unsupported format. Supported formats: {", ".join(SUPPORTED_FORMATS)}'}), 400
+
+        if profile not in ENCODING_PROFILES:
+            return jsonify({'error': f'Unsupported profile. Supported profiles: {", ".join(ENCODING_PROFILES)}'}), 400
+
+        # Encoded images are already compressed, deflating them again only costs CPU
+        results = batch_convert_images(files, target_format, profile=profile)
+        return Response(
+            stream_with_context(stream_zip(results, compression=zipfile.ZIP_STORED)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename=converted_{get_extension(target_format)}.zip'}
+        )
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -129,6 +243,13 @@ def get_formats():
 
 # ============= PDF CONVERTER ENDPOINTS =============
 
+def with_render_dpi(response):
+    """Report the lowest DPI a page was rendered at, which the page pixel budgets can lower"""
+    dpi = tracing.lowest('page_dpi')
+    if dpi is not None:
+        response.headers['X-Render-DPI'] = f'{dpi:g}'
+    return response
+
 @app.route('/pdf/to-images', methods=['POST'])
 def pdf_to_images_endpoint():
     """Convert PDF to images"""
@@ -139,21 +260,25 @@ def pdf_to_images_endpoint():
         file = request.files['file']
         output_format = request.form.get('format', 'PNG').upper()
         dpi = int(request.form.get('dpi', 200))
+        profile = request.form.get('profile', DEFAULT_PROFILE).lower()
 
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
+        if profile not in ENCODING_PROFILES:
+            return jsonify({'error': f'Unsupported profile. Supported profiles: {", ".join(ENCODING_PROFILES)}'}), 400
+
         # Convert PDF to images
-        output_files = pdf_to_images(file, output_format, dpi)
+        output_files = pdf_to_images(file, output_format, admission.granted_dpi(dpi), profile)
 
         # If single page, return single file
         if len(output_files) == 1:
-            return send_file(
+            return with_render_dpi(send_file(
                 io.BytesIO(output_files[0]['data']),
                 mimetype=f'image/{output_format.lower()}',
                 as_attachment=True,
                 download_name=output_files[0]['filename']
-            )
+            ))
 
         # Multiple pages - create ZIP
         zip_buffer = io.BytesIO()
@@ -164,13 +289,15 @@ def pdf_to_images_endpoint():
         zip_buffer.seek(0)
         original_name = os.path.splitext(secure_filename(file.filename))[0]
 
-        return send_file(
+        return with_render_dpi(send_file(
             zip_buffer,
             mimetype='application/zip',
             as_attachment=True,
             download_name=f'{original_name}_images.zip'
-        )
+        ))
 
+    except ResourceLimitError as e:
+        return jsonify(e.to_dict()), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -194,6 +321,8 @@ def images_to_pdf_endpoint():
             download_name='converted.pdf'
         )
 
+    except ResourceLimitError as e:
+        return jsonify(e.to_dict()), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -279,17 +408,19 @@ def compress_pdf_endpoint():
             return jsonify({'error': 'No file selected'}), 400
 
         # Compress PDF
-        output = compress_pdf(file, quality=quality, dpi=dpi)
+        output = compress_pdf(file, quality=quality, dpi=admission.granted_dpi(dpi))
 
         original_name = os.path.splitext(secure_filename(file.filename))[0]
 
-        return send_file(
+        return with_render_dpi(send_file(
             output,
             mimetype='application/pdf',
             as_attachment=True,
             download_name=f'{original_name}_compressed.pdf'
-        )
+        ))
 
+    except ResourceLimitError as e:
+        return jsonify(e.to_dict()), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -354,21 +485,39 @@ def pdf_to_ppt_endpoint():
             return jsonify({'error': 'No file provided'}), 400
 
         file = request.files['file']
+        mode = request.form.get('mode', 'raster').lower()
+        image_format = request.form.get('format', 'JPEG').upper()
+        dpi = int(request.form.get('dpi', PPT_SLIDE_DPI))
+        quality = int(request.form.get('quality', PPT_JPEG_QUALITY))
 
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
+        if mode not in PPT_MODES:
+            return jsonify({'error': f'Unsupported mode. Supported modes: {", ".join(PPT_MODES)}'}), 400
+
+        if image_format == 'JPG':
+            image_format = 'JPEG'
+        if image_format not in PPT_IMAGE_FORMATS:
+            return jsonify({'error': f'Unsupported format. Supported formats: {", ".join(PPT_IMAGE_FORMATS)}'}), 400
+
+        if not 36 <= dpi <= 600:
+            return jsonify({'error': 'dpi must be between 36 and 600'}), 400
+
+        if not 1 <= quality <= 100:
+            return jsonify({'error': 'quality must be between 1 and 100'}), 400
+
         # Convert to PPT
-        output = pdf_to_ppt(file)
+        output = pdf_to_ppt(file, mode=mode, image_format=image_format, dpi=admission.granted_dpi(dpi), quality=quality)
 
         original_name = os.path.splitext(secure_filename(file.filename))[0]
 
-        return send_file(
+        return with_render_dpi(send_file(
             output,
             mimetype='application/vnd.openxmlformats-officedocument.presentationml.presentation',
             as_attachment=True,
             download_name=f'{original_name}.pptx'
-        )
+        ))
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -451,9 +600,14 @@ def convert_pdf_to_text_route():
         return jsonify({'error': 'No selected file'}), 400
 
     try:
-        text_content = pdf_to_text(pdf_file)
+        # Pages stream to the client as they are extracted
+        chunks = iter_pdf_text(pdf_file)
         original_name = os.path.splitext(secure_filename(pdf_file.filename))[0]
-        return text_content, 200, {'Content-Type': 'text/plain', 'Content-Disposition': f'attachment; filename={original_name}.txt'}
+        return Response(
+            stream_with_context(chunk.encode('utf-8') for chunk in chunks),
+            200,
+            {'Content-Type': 'text/plain; charset=utf-8', 'Content-Disposition': f'attachment; filename={original_name}.txt'}
+        )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -531,6 +685,81 @@ def watermark_pdf_endpoint():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/pdf/extract-images', methods=['POST'])
+def extract_images_endpoint():
+    """Extract the images embedded in a PDF and stream them back as a ZIP"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file provided'}), 400
+
+        file = request.files['file']
+        output_format = request.form.get('format', 'PNG').upper()
+        min_size = int(request.form.get('minSize', EXTRACT_MIN_IMAGE_SIZE))
+        profile = request.form.get('profile', DEFAULT_PROFILE).lower()
+
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+
+        formats = SUPPORTED_FORMATS + ['NATIVE']
+        if output_format not in formats:
+            return jsonify({'error': f'Unsupported format. Supported formats: {", ".join(formats)}'}), 400
+
+        if profile not in ENCODING_PROFILES:
+            return jsonify({'error': f'Unsupported profile. Supported profiles: {", ".join(ENCODING_PROFILES)}'}), 400
+
+        images = iter_extracted_images(file, output_format, min_size=min_size, profile=profile)
+        original_name = os.path.splitext(secure_filename(file.filename))[0]
+        return Response(
+            stream_with_context(stream_zip(images, compression=zipfile.ZIP_STORED)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename={original_name}_images.zip'}
+        )
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/pdf/ocr', methods=['POST'])
+def ocr_pdf_endpoint():
+    """Extract text from a PDF, OCRing only the pages that need it"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file provided'}), 400
+
+        file = request.files['file']
+        mode = request.form.get('mode', 'hybrid').lower()
+        output = request.form.get('output', 'json').lower()
+        language = request.form.get('language', 'english')
+
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        if mode not in OCR_MODES:
+            return jsonify({'error': f'Unsupported mode. Supported modes: {", ".join(OCR_MODES)}'}), 400
+        if output not in OCR_OUTPUTS:
+            return jsonify({'error': f'Unsupported output. Supported outputs: {", ".join(OCR_OUTPUTS)}'}), 400
+
+        # The language is only checked if some page needs OCR, so digital
+        # PDFs work without tesseract
+        if output == 'pdf':
+            original_name = os.path.splitext(secure_filename(file.filename))[0]
+            searchable_pdf = ocr_pdf_searchable(file, mode, language)
+            return send_file(searchable_pdf, mimetype='application/pdf', as_attachment=True, download_name=f'{original_name}_searchable.pdf')
+
+        pages = ocr_pdf_pages(file, mode, language)
+        text = "\n".join(page['text'] for page in pages)
+
+        return jsonify({
+            'text': text,
+            'character_count': len(text),
+            'pages': [{'page': p['page'], 'method': p['method'], 'character_count': len(p['text'])} for p in pages]
+        }), 200
+
+    except LanguageError as e:
+        return jsonify({'error': str(e)}), 400
+    except TesseractNotInstalledError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ============= OCR ENDPOINTS =============
 
 # @app.route('/ocr/extract', methods=['POST'])
@@ -636,8 +865,26 @@ def ocr_extract_endpoint():
         language = request.form.get('language', 'english')
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
-        text = extract_text_from_image(file, language)
-        return jsonify({'text': text, 'language': language, 'character_count': len(text)}), 200
+        # Check the language pack before spending time on OCR
+        try:
+            resolve_language(language)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except TesseractNotInstalledError as e:
+            return jsonify({'error': str(e)}), 503
+        # One OCR pass keeps word boxes; downloads are derived from the stored result
+        result = extract_layout_from_images([file], language)
+        result_id = save_result(result, [file.read()])
+        text = result_text(result)
+        return jsonify({
+            'text': text,
+            'language': language,
+            'character_count': len(text),
+            'confidence': mean_confidence(result),
+            'result_id': result_id,
+        }), 200
+    except ResourceLimitError as e:
+        return jsonify(e.to_dict()), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -648,6 +895,11 @@ def ocr_download_txt_endpoint():
     try:
         text = request.form.get('text', '')
         filename = request.form.get('filename', 'extracted_text.txt')
+        if not text and request.form.get('result_id'):
+            try:
+                text = result_text(load_result(request.form['result_id']))
+            except KeyError:
+                return jsonify({'error': 'OCR result not found or expired'}), 404
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         text_file = create_text_file(text)
@@ -662,6 +914,11 @@ def ocr_download_docx_endpoint():
     try:
         text = request.form.get('text', '')
         filename = request.form.get('filename', 'extracted_text.docx')
+        if not text and request.form.get('result_id'):
+            try:
+                text = result_text(load_result(request.form['result_id']))
+            except KeyError:
+                return jsonify({'error': 'OCR result not found or expired'}), 404
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         docx_file = create_word_file(text)
@@ -669,13 +926,42 @@ def ocr_download_docx_endpoint():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/ocr/results/<result_id>', methods=['GET'])
+def ocr_result_endpoint(result_id):
+    """Download a stored OCR result as txt, docx, searchable pdf, hOCR or layout JSON"""
+    if not OCR_AVAILABLE:
+        return jsonify({'error': 'OCR module not available.'}), 500
+    try:
+        output_format = request.args.get('format', 'json').lower()
+        if output_format not in OCR_OUTPUT_FORMATS:
+            return jsonify({'error': f'Unsupported format. Supported formats: {", ".join(OCR_OUTPUT_FORMATS)}'}), 400
+        try:
+            result = load_result(result_id)
+        except KeyError:
+            return jsonify({'error': 'OCR result not found or expired'}), 404
+
+        if output_format == 'json':
+            return jsonify(to_layout(result)), 200
+        if output_format == 'txt':
+            return send_file(create_text_file(result_text(result)), mimetype='text/plain', as_attachment=True, download_name='extracted_text.txt')
+        if output_format == 'docx':
+            return send_file(create_word_file(result_text(result)), mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document', as_attachment=True, download_name='extracted_text.docx')
+        if output_format == 'hocr':
+            return send_file(create_text_file(to_hocr(result)), mimetype='text/html', as_attachment=True, download_name='extracted_text.hocr')
+        pdf_file = to_searchable_pdf(result, load_images(result_id))
+        return send_file(pdf_file, mimetype='application/pdf', as_attachment=True, download_name='searchable.pdf')
+    except ResourceLimitError as e:
+        return jsonify(e.to_dict()), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/ocr/languages', methods=['GET'])
 def ocr_languages_endpoint():
     if not OCR_AVAILABLE:
         return jsonify({'languages': ['english']}), 200
     try:
-        languages = get_supported_languages()
-        return jsonify({'languages': languages}), 200
+        refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+        return jsonify(get_language_report(refresh)), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -687,6 +973,10 @@ if __name__ == '__main__':
     print(f"OCR Available: {OCR_AVAILABLE}")
     if not OCR_AVAILABLE:
         print("WARNING: OCR features will not work. Install pytesseract and python-docx.")
+    else:
+        report = get_language_report()
+        print(f"Tesseract: {report['tesseract_version'] or 'not found'}")
+        print(f"OCR Languages: {', '.join(report['languages']) or 'none'}")
     print("=" * 50)
     print("\nPress Ctrl+C to stop the server\n")
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Measure encode time and output size of each encoding profile.
+
+Run from the backend directory:
+    python benchmarks/bench_encoding_profiles.py [--repeat 5]
+
+Prints a Markdown table (the one in PERFORMANCE.md comes from this script).
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image, ImageDraw
+import fitz  # PyMuPDF
+from encoding_profiles import ENCODING_PROFILES, encode
+
+FORMATS = ['JPEG', 'PNG', 'WEBP', 'TIFF']
+
+
+def make_photo(size=(1600, 1200)):
+    """Smooth gradients with sensor-like noise, similar to a camera photo"""
+    width, height = size
+    red = Image.radial_gradient('L').resize(size)
+    green = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 24)
+    blue = Image.blend(green.transpose(Image.FLIP_LEFT_RIGHT), noise, 0.5)
+    return Image.merge('RGB', (Image.blend(red, noise, 0.2), green, blue))
+
+
+def make_screenshot(size=(1600, 1000)):
+    """Flat UI colours and text, well under 256 distinct colours"""
+    img = Image.new('RGB', size, (245, 246, 250))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, size[0], 60], fill=(40, 60, 120))
+    for row in range(12):
+        y = 90 + row * 70
+        draw.rectangle([40, y, size[0] - 40, y + 50], fill=(255, 255, 255), outline=(210, 214, 222))
+        draw.text((60, y + 18), f"Row {row + 1}: quarterly report, status OK", fill=(30, 30, 30))
+    return img
+
+
+def make_pdf_page(dpi=150):
+    """A rendered text page, as produced by /pdf/to-images"""
+    doc = fitz.open()
+    page = doc.new_page()
+    text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40
+    page.insert_textbox(fitz.Rect(50, 50, 545, 790), text, fontsize=11)
+    pix = page.get_pixmap(dpi=dpi)
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    doc.close()
+    return img
+
+
+def measure(img, save_format, profile, repeat):
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        output = io.BytesIO()
+        start = time.perf_counter()
+        encode(img, output, save_format, profile)
+        timings.append(time.perf_counter() - start)
+        size = output.tell()
+    return statistics.median(timings), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='encodes per cell; the median time is reported')
+    args = parser.parse_args()
+
+    samples = {
+        'photo 1600x1200': make_photo(),
+        'screenshot 1600x1000': make_screenshot(),
+        'PDF page @150dpi': make_pdf_page(),
+    }
+
+    print('| Image | Format | ' + ' | '.join(f'{p} ms | {p} KB' for p in ENCODING_PROFILES) + ' |')
+    print('|---|---|' + '---:|---:|' * len(ENCODING_PROFILES))
+    for name, img in samples.items():
+        for save_format in FORMATS:
+            cells = []
+            for profile in ENCODING_PROFILES:
+                seconds, size = measure(img, save_format, profile, args.repeat)
+                cells.append(f'{seconds * 1000:.0f} | {size / 1024:.0f}')
+            print(f'| {name} | {save_format} | ' + ' | '.join(cells) + ' |')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Measure OCR time and character accuracy with and without preprocessing.
+
+Builds a synthetic corpus of text images (like create_test_image.py, but with
+known ground truth): several font sizes, scanner noise, small skews, uneven
+lighting and dark scan borders. Each image is OCR'd raw and after
+ocr_preprocess.preprocess_for_ocr.
+
+Also reports the render DPI ocr_preprocess.choose_dpi picks for PDF pages of
+several text sizes, plain and with a frame and a column rule; the DPI should
+not depend on the decoration.
+
+Run from the backend directory:
+    python benchmarks/bench_ocr_preprocess.py [--method otsu|sauvola]
+
+Without tesseract installed only the preprocessing time is reported.
+"""
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image, ImageDraw, ImageFont
+import fitz  # PyMuPDF
+import pytesseract
+from ocr_converter import DEFAULT_CONFIG
+from ocr_preprocess import BINARIZE_METHODS, TARGET_LINE_HEIGHT, choose_dpi, preprocess_for_ocr
+
+WORDS = ('invoice total amount due payment received balance account number '
+         'customer address shipping order date quantity price description '
+         'reference tax subtotal remittance statement period').split()
+
+FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/Library/Fonts/Arial.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf',
+]
+
+
+def load_font(size):
+    for path in FONT_CANDIDATES:
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size)
+
+
+def make_sample(rng, font_size, skew, noise, border, shade):
+    """Render a page of random words and return (image, ground truth)"""
+    lines = [' '.join(rng.choice(WORDS) for _ in range(6)) for _ in range(8)]
+    font = load_font(font_size)
+    line_height = int(font_size * 1.6)
+    size = (font_size * 36, line_height * (len(lines) + 4))
+
+    img = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(lines):
+        draw.text((font_size * 2, line_height * (i + 2)), line, fill=0, font=font)
+
+    if skew:
+        img = img.rotate(skew, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    if shade:
+        # Lighting falls off towards one side, as with a phone photo
+        gradient = Image.linear_gradient('L').rotate(90).resize(img.size)
+        img = Image.blend(img, Image.eval(gradient, lambda v: 255 - v // 2), 0.35)
+    if noise:
+        img = Image.blend(img, Image.effect_noise(img.size, 64), noise)
+    if border:
+        framed = Image.new('L', (img.width + 2 * border, img.height + 2 * border), 20)
+        framed.paste(img, (border, border))
+        img = framed
+    return img.convert('RGB'), '\n'.join(lines)
+
+
+def build_corpus(seed=0):
+    rng = random.Random(seed)
+    corpus = []
+    for font_size in (9, 14, 28, 56):
+        for skew, noise, border, shade in ((0, 0, 0, False), (2.5, 0.15, 0, False),
+                                           (-1.5, 0.1, 40, True)):
+            name = f'{font_size}px skew={skew} noise={noise} border={border} shade={shade}'
+            corpus.append((name, *make_sample(rng, font_size, skew, noise, border, shade)))
+    return corpus
+
+
+def make_pdf_page(rng, font_size, frame, rule):
+    """A Letter PDF page of random words at font_size points, optionally framed and split by a rule"""
+    doc = fitz.open()
+    page = doc.new_page(width=612, height=792)
+    y = 72 + font_size
+    while y < 720:
+        page.insert_text((72, y), ' '.join(rng.choice(WORDS) for _ in range(60 // font_size + 2)), fontsize=font_size)
+        y += font_size * 1.4
+    if frame:
+        page.draw_rect(fitz.Rect(36, 36, 576, 756), width=4)
+    if rule:
+        page.draw_line((306, 60), (306, 732), width=1)
+    return doc, page
+
+
+def bench_choose_dpi(seed=0):
+    rng = random.Random(seed)
+    print('| Text size | Decoration | choose_dpi | Line pitch at that DPI | ms |')
+    print('|---|---|---:|---:|---:|')
+    for font_size in (8, 10, 14, 24):
+        for frame, rule in ((False, False), (True, False), (False, True), (True, True)):
+            doc, page = make_pdf_page(rng, font_size, frame, rule)
+            start = time.perf_counter()
+            dpi = choose_dpi(page)
+            seconds = time.perf_counter() - start
+            decoration = ' + '.join(name for name, on in (('frame', frame), ('rule', rule)) if on) or 'none'
+            # Line pitch in pixels at the chosen DPI; choose_dpi aims for TARGET_LINE_HEIGHT
+            line_pixels = font_size * 1.4 * dpi / 72
+            print(f'| {font_size} pt | {decoration} | {dpi} | {line_pixels:.0f} px | {seconds * 1000:.1f} |')
+            doc.close()
+    print(f'\nTarget line height: {TARGET_LINE_HEIGHT} px of ink\n')
+
+
+def accuracy(text, truth):
+    """Character accuracy: 1 - normalized edit distance, whitespace-insensitive"""
+    a = ' '.join(text.split()).lower()
+    b = ' '.join(truth.split()).lower()
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def ocr(img):
+    start = time.perf_counter()
+    text = pytesseract.image_to_string(img, lang='eng', config=DEFAULT_CONFIG)
+    return text, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--method', choices=BINARIZE_METHODS, default='otsu', help='binarization method')
+    args = parser.parse_args()
+
+    try:
+        pytesseract.get_tesseract_version()
+        have_tesseract = True
+    except Exception:
+        have_tesseract = False
+        print('tesseract not found; reporting preprocessing time only\n')
+
+    bench_choose_dpi()
+
+    header = '| Sample | Pixels | Prep ms | Prepped pixels |'
+    if have_tesseract:
+        header += ' Raw OCR ms | Raw acc | Prepped OCR ms | Prepped acc |'
+    print(header)
+    print('|---|' + '---:|' * (header.count('|') - 2))
+
+    totals = {'raw_time': 0.0, 'prep_time': 0.0, 'raw_acc': 0.0, 'prep_acc': 0.0}
+    corpus = build_corpus()
+    for name, img, truth in corpus:
+        start = time.perf_counter()
+        prepped = preprocess_for_ocr(img, method=args.method)
+        prep_seconds = time.perf_counter() - start
+        row = f'| {name} | {img.width * img.height} | {prep_seconds * 1000:.0f} | {prepped.width * prepped.height} |'
+        if have_tesseract:
+            raw_text, raw_seconds = ocr(img)
+            prep_text, ocr_seconds = ocr(prepped)
+            raw_acc, prep_acc = accuracy(raw_text, truth), accuracy(prep_text, truth)
+            totals['raw_time'] += raw_seconds
+            totals['prep_time'] += prep_seconds + ocr_seconds
+            totals['raw_acc'] += raw_acc
+            totals['prep_acc'] += prep_acc
+            row += f' {raw_seconds * 1000:.0f} | {raw_acc:.1%} | {ocr_seconds * 1000:.0f} | {prep_acc:.1%} |'
+        print(row)
+
+    if have_tesseract:
+        count = len(corpus)
+        print(f'\nRaw:          {totals["raw_time"]:.2f} s total, {totals["raw_acc"] / count:.1%} mean accuracy')
+        print(f'Preprocessed: {totals["prep_time"]:.2f} s total (incl. preprocessing), '
+              f'{totals["prep_acc"] / count:.1%} mean accuracy')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Measure pdf_to_ppt time and output size per slide for each slide setting.
+
+Builds a synthetic deck: text pages with a heading, body text and a small
+chart-like drawing, plus a photo on every fourth page. Each configuration
+converts the same document and reports seconds per slide and PPTX bytes per
+slide. The first row reproduces the old behaviour (PNG at 200 dpi of page,
+rendered serially).
+
+Run from the backend directory:
+    python benchmarks/bench_pdf_to_ppt.py [--pages 40] [--workers N]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+from pdf_converter import pdf_to_ppt
+
+
+def build_pdf(pages, seed=0):
+    rng = np.random.default_rng(seed)
+    photo = io.BytesIO()
+    noise = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    Image.fromarray(noise).resize((1280, 960), Image.BICUBIC).save(photo, format='JPEG', quality=90)
+
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page(width=792, height=612)
+        page.insert_text((54, 80), f'Quarterly review, section {number + 1}', fontsize=28)
+        for line in range(24):
+            words = ' '.join(f'item{(line * 7 + i) % 50}' for i in range(8))
+            page.insert_text((54, 130 + line * 17), f'{line + 1}. {words}', fontsize=12)
+        for bar in range(8):
+            height = float(rng.integers(40, 260))
+            page.draw_rect(fitz.Rect(460 + bar * 36, 540 - height, 488 + bar * 36, 540),
+                           color=(0, 0, 0), fill=(0.2, 0.4, 0.8))
+        if number % 4 == 0:
+            page.insert_image(fitz.Rect(440, 110, 740, 335), stream=photo.getvalue())
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def run(pdf_bytes, pages, **options):
+    start = time.perf_counter()
+    output = pdf_to_ppt(io.BytesIO(pdf_bytes), **options)
+    seconds = time.perf_counter() - start
+    return seconds / pages, len(output.getvalue()) / pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=40, help='pages in the synthetic document')
+    parser.add_argument('--workers', type=int, default=None, help='render processes (default TEXT_WORKERS)')
+    args = parser.parse_args()
+
+    pdf_bytes = build_pdf(args.pages)
+    # Roughly the old fixed 200 dpi render: a 11 in wide page fitted into a
+    # 9.5 in wide slide area is 200 * 11 / 9.5 pixels per slide inch
+    old_dpi = round(200 * 11 / 9.5)
+    configs = [
+        ('PNG, 200 dpi of page, serial', dict(image_format='PNG', dpi=old_dpi, max_workers=1)),
+        ('PNG, 150 dpi of slide', dict(image_format='PNG', dpi=150, max_workers=args.workers)),
+        ('JPEG q85, 150 dpi of slide, serial', dict(image_format='JPEG', dpi=150, max_workers=1)),
+        ('JPEG q85, 150 dpi of slide', dict(image_format='JPEG', dpi=150, max_workers=args.workers)),
+        ('JPEG q85, 96 dpi of slide', dict(image_format='JPEG', dpi=96, max_workers=args.workers)),
+        ('vector', dict(mode='vector', max_workers=args.workers)),
+    ]
+
+    # Start the worker processes before timing
+    run(pdf_bytes, args.pages, max_workers=args.workers)
+
+    print(f'{args.pages} pages\n')
+    print('| Setting | s/slide | KB/slide |')
+    print('|---|---:|---:|')
+    for name, options in configs:
+        seconds, size = run(pdf_bytes, args.pages, **options)
+        print(f'| {name} | {seconds:.3f} | {size / 1024:.0f} |')
+
+
+if __name__ == '__main__':
+    main()
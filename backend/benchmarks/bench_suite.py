@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+"""
+Time and memory benchmarks for every converter function and endpoint.
+
+Cases run on the deterministic corpus from corpus.py: the functions of
+pdf_converter.py and ocr_converter.py are called directly, the endpoints
+of app.py go through the Flask test client. Each case runs in a fresh
+interpreter, so caches, pools and the allocator start cold every time and
+one case's memory does not inflate the next one's peak.
+
+Per case the suite reports the first (cold) call, the median and minimum
+of the repeated calls, output bytes and the peak RSS the call added on
+top of the loaded inputs. Child processes (worker pools, tesseract) are
+not counted in the peak; the largest of them is reported separately.
+
+Run from the backend directory:
+    python benchmarks/bench_suite.py run [--quick] [-k PATTERN] [--save results.json] [--compare baseline.json]
+    python benchmarks/bench_suite.py compare baseline.json results.json [--threshold 0.15]
+    python benchmarks/bench_suite.py list [--quick]
+
+compare (and run --compare) exits with status 1 when a case got slower or
+used more memory than the threshold allows, or newly fails. OCR cases are
+skipped when tesseract is not installed, and only run on documents of up
+to 50 pages.
+"""
+import argparse
+import datetime
+import fnmatch
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from corpus import CORPUS_DIR, IMAGE_SIZES, PAGE_COUNTS, ROW_COUNTS, corpus_files, ensure_corpus
+
+RESULTS_VERSION = 1
+
+# OCR on hundreds of scanned pages takes minutes per call
+OCR_PAGE_COUNTS = [1, 50]
+
+# Timed calls per case: at least MIN_REPEATS, more while the case has run
+# for under MIN_TIME seconds, and none past MAX_TIME seconds
+MIN_REPEATS = 3
+MIN_TIME = 1.0
+MAX_TIME = 30.0
+CASE_TIMEOUT = 1800
+
+# A case regresses when it is THRESHOLD slower (or uses THRESHOLD more peak
+# memory) than the baseline and by at least the absolute minimum, so noise
+# on millisecond cases does not fail a comparison
+THRESHOLD = 0.15
+MIN_TIME_DELTA = 0.01
+MIN_MEMORY_DELTA_MB = 5.0
+
+PASSWORD = 'bench'
+WORD_TEXT = '\n\n'.join(f'Paragraph {n}: ' + 'quarterly revenue summary ' * 40 for n in range(200))
+
+
+class File:
+    """A corpus file passed to a case, as a fresh BytesIO on every call"""
+
+    def __init__(self, name, encrypt=False):
+        self.name = name
+        self.encrypt = encrypt
+
+    @property
+    def key(self):
+        return f'{self.name}#encrypted' if self.encrypt else self.name
+
+
+def _call(module, function, *args, **kwargs):
+    return {'kind': 'function', 'module': module, 'function': function, 'args': args, 'kwargs': kwargs}
+
+
+def _post(path, files, field='file', **form):
+    return {'kind': 'endpoint', 'path': path, 'field': field, 'files': files, 'form': form}
+
+
+def _stem(name):
+    return name.rsplit('.', 1)[0]
+
+
+def build_cases(quick=False):
+    """Ordered {name: case} for the corpus files of the chosen size"""
+    available = corpus_files(quick)
+    pages = [count for count in PAGE_COUNTS if f'text-{count}.pdf' in available]
+    photos = [f'photo-{size}.jpg' for size in IMAGE_SIZES if f'photo-{size}.jpg' in available]
+    workbooks = [f'rows-{count}.xlsx' for count in ROW_COUNTS if f'rows-{count}.xlsx' in available]
+    cases = {}
+
+    def add(label, spec, ocr=False):
+        target = spec['function'] if spec['kind'] == 'function' else f"POST {spec['path']}"
+        spec['ocr'] = ocr
+        spec['group'] = spec['kind']
+        cases[f'{target}[{label}]'] = spec
+
+    for count in pages:
+        text, scanned = f'text-{count}.pdf', f'scanned-{count}.pdf'
+        pdf, scan = File(text), File(scanned)
+        label = _stem(text)
+        add(label, _call('pdf_converter', 'pdf_to_images', pdf, 'PNG', 150))
+        add(f'{label},jpeg', _call('pdf_converter', 'pdf_to_images', pdf, 'JPEG', 150))
+        add(label, _call('pdf_converter', 'merge_pdfs', [pdf, pdf]))
+        add(label, _call('pdf_converter', 'split_pdf', pdf, 'all'))
+        add(label, _call('pdf_converter', 'compress_pdf', pdf))
+        add(_stem(scanned), _call('pdf_converter', 'compress_pdf', scan))
+        add(label, _call('pdf_converter', 'extract_images', pdf))
+        add(_stem(scanned), _call('pdf_converter', 'extract_images', scan, 'JPEG'))
+        add(label, _call('pdf_converter', 'get_pdf_info', pdf))
+        if count > 1:
+            add(label, _call('pdf_converter', 'delete_pdf_pages', pdf, '1'))
+        add(label, _call('pdf_converter', 'pdf_to_word', pdf))
+        add(label, _call('pdf_converter', 'pdf_to_text', pdf))
+        add(label, _call('pdf_converter', 'pdf_to_excel', pdf))
+        add(label, _call('pdf_converter', 'encrypt_pdf', pdf, PASSWORD))
+        add(label, _call('pdf_converter', 'decrypt_pdf', File(text, encrypt=True), PASSWORD))
+        add(label, _call('pdf_converter', 'pdf_to_ppt', pdf))
+        add(f'{label},vector', _call('pdf_converter', 'pdf_to_ppt', pdf, mode='vector'))
+        add(label, _call('pdf_converter', 'rotate_pdf_pages', pdf, 90, 'all'))
+        add(label, _call('pdf_converter', 'add_watermark', pdf, 'CONFIDENTIAL'))
+
+        add(label, _post('/pdf/to-images', [pdf], dpi='150'))
+        add(label, _post('/pdf/merge', [pdf, pdf], field='files'))
+        add(label, _post('/pdf/split', [pdf], splitType='all'))
+        add(_stem(scanned), _post('/pdf/compress', [scan]))
+        add(label, _post('/pdf/info', [pdf]))
+        if count > 1:
+            add(label, _post('/pdf/delete-pages', [pdf], pages='1'))
+        add(label, _post('/pdf/to-ppt', [pdf]))
+        add(label, _post('/pdf/encrypt', [pdf], password=PASSWORD))
+        add(label, _post('/pdf/decrypt', [File(text, encrypt=True)], password=PASSWORD))
+        add(label, _post('/pdf/to-excel', [pdf]))
+        add(label, _post('/pdf/to-text', [pdf]))
+        add(label, _post('/pdf/to-word', [pdf]))
+        add(label, _post('/pdf/rotate', [pdf], rotation='90'))
+        add(label, _post('/pdf/watermark', [pdf], text='CONFIDENTIAL'))
+        add(label, _post('/pdf/extract-images', [pdf]))
+        add(label, _post('/pdf/ocr', [pdf]), ocr=True)
+
+        if count in OCR_PAGE_COUNTS:
+            add(_stem(scanned), _call('pdf_converter', 'ocr_pdf_pages', scan), ocr=True)
+            add(_stem(scanned), _call('pdf_converter', 'ocr_pdf_searchable', scan), ocr=True)
+            add(_stem(scanned), _post('/pdf/ocr', [scan]), ocr=True)
+            add(f'{_stem(scanned)},searchable', _post('/pdf/ocr', [scan], output='pdf'), ocr=True)
+
+    for photo in photos:
+        label = _stem(photo)
+        add(label, _call('pdf_converter', 'images_to_pdf', [File(photo)]))
+        add(f'{label},webp', _post('/convert', [File(photo)], format='WEBP'))
+        add(f'{label},png', _post('/convert', [File(photo)], format='PNG'))
+        add(label, _post('/pdf/from-images', [File(photo)], field='files'))
+    batch = [File(name) for name in photos[:2] + ['screenshot.png']]
+    add('photos', _post('/convert/batch', batch, field='files', format='WEBP'))
+    add('screenshot', _post('/convert', [File('screenshot.png')], format='WEBP'))
+
+    for workbook in workbooks:
+        add(_stem(workbook), _call('pdf_converter', 'excel_to_pdf', File(workbook)))
+        add(_stem(workbook), _post('/pdf/from-excel', [File(workbook)]))
+
+    page_image = File('text-page.png')
+    add('text-page', _call('ocr_converter', 'extract_text_from_image', page_image), ocr=True)
+    add('text-page', _call('ocr_converter', 'extract_layout_from_images', [page_image]), ocr=True)
+    add('text-page,x4', _call('ocr_converter', 'extract_text_from_images', [page_image] * 4), ocr=True)
+    add('text-page', _post('/ocr/extract', [page_image]), ocr=True)
+    add('200-paragraphs', _call('ocr_converter', 'create_word_file', WORD_TEXT))
+    add('200-paragraphs', _call('ocr_converter', 'create_text_file', WORD_TEXT))
+    return cases
+
+
+def _input_files(case):
+    values = list(case['args']) + list(case['kwargs'].values()) if case['kind'] == 'function' else case['files']
+    found = []
+    for value in values:
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, File):
+                found.append(item)
+    return found
+
+
+def _load_inputs(case, corpus_dir):
+    data = {}
+    for item in _input_files(case):
+        with open(os.path.join(corpus_dir, item.name), 'rb') as f:
+            content = f.read()
+        if item.encrypt:
+            from pdf_converter import encrypt_pdf
+            content = encrypt_pdf(io.BytesIO(content), PASSWORD).getvalue()
+        data[item.key] = content
+    return data
+
+
+def _resolve(value, data):
+    if isinstance(value, File):
+        return io.BytesIO(data[value.key])
+    if isinstance(value, list):
+        return [_resolve(item, data) for item in value]
+    return value
+
+
+def _consume(result):
+    """Drain a converter result, returning the bytes it produced"""
+    if result is None:
+        return 0
+    if isinstance(result, io.BytesIO):
+        return len(result.getvalue())
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if isinstance(result, str):
+        return len(result.encode('utf-8'))
+    if isinstance(result, dict):
+        return len(json.dumps(result, default=str))
+    if hasattr(result, 'read'):
+        return len(result.read())
+    if hasattr(result, '__iter__'):
+        return sum(_consume(item) for item in result)
+    return 0
+
+
+def _case_runner(case, data):
+    """Zero-argument function performing one call of the case"""
+    if case['kind'] == 'function':
+        import importlib
+        function = getattr(importlib.import_module(case['module']), case['function'])
+
+        def run():
+            args = [_resolve(arg, data) for arg in case['args']]
+            kwargs = {name: _resolve(value, data) for name, value in case['kwargs'].items()}
+            return _consume(function(*args, **kwargs))
+        return run
+
+    from app import app
+    client = app.test_client()
+
+    def run():
+        form = dict(case['form'])
+        uploads = [(io.BytesIO(data[item.key]), item.name) for item in case['files']]
+        form[case['field']] = uploads if case['field'] == 'files' else uploads[0]
+        response = client.post(case['path'], data=form, content_type='multipart/form-data')
+        body = response.get_data()
+        response.close()
+        if response.status_code != 200:
+            raise Exception(f'HTTP {response.status_code}: {body[:200].decode("utf-8", "replace")}')
+        return len(body)
+    return run
+
+
+def _max_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(who).ru_maxrss * scale / 1024 / 1024
+
+
+def _proc_status_mb(field):
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Current RSS in MB after resetting the peak, where Linux allows it; else the peak so far"""
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as f:
+            f.write('5')
+    except OSError:
+        return _max_rss_mb()
+    return _proc_status_mb('VmRSS')
+
+
+def _peak_rss_mb():
+    peak = _proc_status_mb('VmHWM')
+    return _max_rss_mb() if peak is None else peak
+
+
+def measure(name, corpus_dir, min_repeats, min_time, max_time, trace_python):
+    """Run one case in this process and return its measurements"""
+    case = build_cases()[name]
+    data = _load_inputs(case, corpus_dir)
+    run = _case_runner(case, data)
+    base_rss = _reset_peak_rss()
+
+    start = time.perf_counter()
+    output_bytes = run()
+    first = time.perf_counter() - start
+    peak_rss = _peak_rss_mb() - base_rss
+
+    times, total = [], 0.0
+    while len(times) < 1 or (total < max_time and (len(times) < min_repeats or total < min_time)):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+        total += times[-1]
+
+    result = {
+        'status': 'ok',
+        'first_s': round(first, 5),
+        'median_s': round(statistics.median(times), 5),
+        'min_s': round(min(times), 5),
+        'repeats': len(times),
+        'output_bytes': output_bytes,
+        'input_bytes': sum(len(content) for content in data.values()),
+        'peak_rss_mb': round(peak_rss, 2),
+        'child_peak_rss_mb': round(_max_rss_mb(resource.RUSAGE_CHILDREN), 2),
+    }
+    if trace_python:
+        import tracemalloc
+        tracemalloc.start()
+        run()
+        result['python_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        tracemalloc.stop()
+    return result
+
+
+def _run_case(name, args):
+    command = [sys.executable, os.path.abspath(__file__), 'measure', name, '--corpus', args.corpus,
+               '--repeat', str(args.repeat), '--min-time', str(args.min_time), '--max-time', str(args.max_time)]
+    if args.tracemalloc:
+        command.append('--tracemalloc')
+    env = dict(os.environ, TRACE_LOG='0')
+    try:
+        done = subprocess.run(command, capture_output=True, text=True, timeout=args.timeout, env=env)
+    except subprocess.TimeoutExpired:
+        return {'status': 'error', 'error': f'timed out after {args.timeout} s'}
+    lines = done.stdout.strip().splitlines()
+    if done.returncode != 0 or not lines:
+        return {'status': 'error', 'error': (done.stderr.strip().splitlines() or ['no output'])[-1][:300]}
+    return json.loads(lines[-1])
+
+
+def _cpu_model():
+    # platform.processor() is empty on most Linux builds
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+
+def _host_info():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu': _cpu_model(),
+        'cpus': os.cpu_count(),
+        'tesseract': shutil.which('tesseract') is not None,
+    }
+
+
+def _format_time(seconds):
+    return f'{seconds * 1000:.1f} ms' if seconds < 1 else f'{seconds:.2f} s'
+
+
+def run_suite(args):
+    cases = build_cases(args.quick)
+    names = [name for name in cases if not args.k or any(fnmatch.fnmatch(name, f'*{p}*') for p in args.k)]
+    ensure_corpus(args.quick, args.corpus, log=lambda message: print(message, file=sys.stderr))
+    has_tesseract = shutil.which('tesseract') is not None
+
+    results = {}
+    print('| Case | First | Median | Min | Peak RSS MB | Output KB |')
+    print('|---|---:|---:|---:|---:|---:|')
+    for name in names:
+        if cases[name]['ocr'] and not has_tesseract:
+            results[name] = {'status': 'skipped', 'error': 'tesseract not installed'}
+            continue
+        result = results[name] = _run_case(name, args)
+        if result['status'] == 'ok':
+            print(f"| {name} | {_format_time(result['first_s'])} | {_format_time(result['median_s'])} | "
+                  f"{_format_time(result['min_s'])} | {result['peak_rss_mb']:.1f} | {result['output_bytes'] / 1024:.0f} |",
+                  flush=True)
+        else:
+            print(f"| {name} | error: {result['error']} | | | | |", flush=True)
+
+    skipped = sum(1 for result in results.values() if result['status'] == 'skipped')
+    if skipped:
+        print(f'\n{skipped} OCR cases skipped: tesseract not installed')
+
+    report = {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'quick': args.quick,
+        'host': _host_info(),
+        'cases': results,
+    }
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'\nSaved {len(results)} cases to {args.save}')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        return compare_results(baseline, report, args.threshold)
+    return 0
+
+
+def compare_results(baseline, current, threshold=THRESHOLD):
+    """Print a comparison table; returns 1 if any case regressed, else 0"""
+    base_host, host = baseline.get('host', {}), current.get('host', {})
+    changed = [key for key in sorted(set(base_host) | set(host)) if base_host.get(key) != host.get(key)]
+    if changed:
+        print('Warning: baseline was recorded on a different host; timings may not be comparable')
+        for key in changed:
+            print(f'  {key}: {base_host.get(key)} (baseline) vs {host.get(key)}')
+        print()
+    regressions = 0
+    print('| Case | Baseline min | Current min | Change | Peak RSS MB | Result |')
+    print('|---|---:|---:|---:|---:|---|')
+    base_cases, cases = baseline['cases'], current['cases']
+    for name in [name for name in base_cases if name in cases]:
+        base, cur = base_cases[name], cases[name]
+        if cur['status'] == 'skipped' or base['status'] == 'skipped':
+            print(f'| {name} | | | | | skipped |')
+            continue
+        if cur['status'] != 'ok':
+            failed = base['status'] == 'ok'
+            regressions += failed
+            print(f"| {name} | | | | | {'REGRESSION: ' if failed else ''}error: {cur['error']} |")
+            continue
+        if base['status'] != 'ok':
+            print(f'| {name} | | {_format_time(cur["min_s"])} | | | fixed |')
+            continue
+
+        # The fastest call is the least disturbed by other load on the host
+        old, new = base['min_s'], cur['min_s']
+        change = (new - old) / old if old else 0.0
+        memory_delta = cur['peak_rss_mb'] - base['peak_rss_mb']
+        flags = []
+        if change > threshold and new - old >= MIN_TIME_DELTA:
+            flags.append('slower')
+        elif change < -threshold and old - new >= MIN_TIME_DELTA:
+            flags.append('faster')
+        if memory_delta > max(threshold * base['peak_rss_mb'], MIN_MEMORY_DELTA_MB):
+            flags.append('more memory')
+        elif -memory_delta > max(threshold * base['peak_rss_mb'], MIN_MEMORY_DELTA_MB):
+            flags.append('less memory')
+        regressed = 'slower' in flags or 'more memory' in flags
+        regressions += regressed
+        result = ', '.join(flags) or 'ok'
+        print(f"| {name} | {_format_time(old)} | {_format_time(new)} | {change:+.0%} | "
+              f"{base['peak_rss_mb']:.1f} → {cur['peak_rss_mb']:.1f} | {'REGRESSION: ' if regressed else ''}{result} |")
+
+    new_cases = [name for name in cases if name not in base_cases]
+    if new_cases:
+        print(f"\nNot in the baseline: {', '.join(new_cases)}")
+    print(f'\n{regressions} regression(s) at a {threshold:.0%} threshold, '
+          f'{sum(1 for name in base_cases if name not in cases)} baseline case(s) not run')
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the suite')
+    run.add_argument('--quick', action='store_true', help='skip the 500-page, 6000x4000 and 100k-row inputs')
+    run.add_argument('-k', action='append', help='only cases whose name contains this pattern (glob, repeatable)')
+    run.add_argument('--save', help='write the results as JSON to this path')
+    run.add_argument('--compare', help='compare against this baseline JSON after the run')
+    run.add_argument('--threshold', type=float, default=THRESHOLD, help='relative change flagged as a regression')
+    run.add_argument('--tracemalloc', action='store_true', help='also report peak Python allocations (one extra call)')
+    run.add_argument('--corpus', default=CORPUS_DIR, help='corpus directory')
+    run.add_argument('--repeat', type=int, default=MIN_REPEATS, help='minimum timed calls per case')
+    run.add_argument('--min-time', type=float, default=MIN_TIME, help='keep repeating until a case ran this long')
+    run.add_argument('--max-time', type=float, default=MAX_TIME, help='stop repeating once a case ran this long')
+    run.add_argument('--timeout', type=int, default=CASE_TIMEOUT, help='seconds before a case is abandoned')
+
+    compare = commands.add_parser('compare', help='compare two saved result files')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=THRESHOLD, help='relative change flagged as a regression')
+
+    listing = commands.add_parser('list', help='list the case names')
+    listing.add_argument('--quick', action='store_true')
+
+    # Used by run: measures one case in a fresh interpreter
+    single = commands.add_parser('measure')
+    single.add_argument('name')
+    single.add_argument('--corpus', default=CORPUS_DIR)
+    single.add_argument('--repeat', type=int, default=MIN_REPEATS)
+    single.add_argument('--min-time', type=float, default=MIN_TIME)
+    single.add_argument('--max-time', type=float, default=MAX_TIME)
+    single.add_argument('--tracemalloc', action='store_true')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        sys.exit(run_suite(args))
+    if args.command == 'compare':
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+        sys.exit(compare_results(baseline, current, args.threshold))
+    if args.command == 'list':
+        for name, case in build_cases(args.quick).items():
+            print(f"{case['group']:<9} {'ocr ' if case['ocr'] else '    '}{name}")
+        return
+    result = measure(args.name, args.corpus, args.repeat, args.min_time, args.max_time, args.tracemalloc)
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Deterministic benchmark corpus: PDFs, images and workbooks.
+
+Every file is generated from fixed seeds, so two machines benchmark the
+same documents. Files are written once to benchmarks/corpus/ (ignored by
+git) and regenerated when CORPUS_VERSION changes or a file is missing.
+
+    text-{1,50,500}.pdf     digital pages: heading, paragraphs, a ruled
+                            table on every third page, a photo every tenth
+    scanned-{1,50,500}.pdf  the same text as grayscale page scans (100 dpi,
+                            slight skew and noise) with no text layer
+    photo-{small,medium,large}.jpg   640x480, 2048x1536, 6000x4000
+    screenshot.png          1600x1000 flat UI image
+    text-page.png           one page of text at 300 dpi, for image OCR
+    rows-{100,10000,100000}.xlsx     8 mixed-type columns
+
+Run from the backend directory to (re)build it:
+    python benchmarks/corpus.py [--quick]
+"""
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+
+import fitz  # PyMuPDF
+import numpy as np
+from openpyxl import Workbook
+from PIL import Image, ImageDraw, ImageFilter
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+# Bump when the generated content changes so stale corpora are rebuilt
+CORPUS_VERSION = 1
+
+PAGE_COUNTS = [1, 50, 500]
+QUICK_PAGE_COUNTS = [1, 50]
+IMAGE_SIZES = {'small': (640, 480), 'medium': (2048, 1536), 'large': (6000, 4000)}
+QUICK_IMAGE_SIZES = ['small', 'medium']
+ROW_COUNTS = [100, 10000, 100000]
+QUICK_ROW_COUNTS = [100, 10000]
+
+WORDS = ('invoice total amount due payment received balance account number '
+         'customer address shipping order date quantity price description '
+         'reference tax subtotal remittance statement period quarterly review '
+         'revenue forecast region growth margin summary appendix').split()
+
+# Fixed metadata keeps the generated bytes identical between runs
+_FIXED_DATE = datetime.datetime(2024, 1, 1)
+
+
+def _sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _paragraphs(rng, count):
+    return [' '.join(_sentence(rng) for _ in range(rng.randint(3, 6))) for _ in range(count)]
+
+
+def make_photo(size, seed=0):
+    """Smooth gradients with sensor-like noise, similar to a camera photo"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (max(2, size[1] // 64), max(2, size[0] // 64), 3), dtype=np.uint8)
+    img = Image.fromarray(small).resize(size, Image.BICUBIC)
+    noise = rng.normal(0, 12, (size[1], size[0], 3))
+    pixels = np.clip(np.asarray(img, dtype=np.float64) + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels)
+
+
+def make_screenshot(size=(1600, 1000)):
+    """Flat UI colours and text, well under 256 distinct colours"""
+    img = Image.new('RGB', size, (245, 246, 250))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, size[0], 60], fill=(40, 60, 120))
+    for row in range(12):
+        y = 90 + row * 70
+        draw.rectangle([40, y, size[0] - 40, y + 50], fill=(255, 255, 255), outline=(210, 214, 222))
+        draw.text((60, y + 18), f"Row {row + 1}: quarterly report, status OK", fill=(30, 30, 30))
+    return img
+
+
+def _write_text_page(page, rng, number, photo):
+    page.insert_text((56, 72), f'Section {number + 1}: {_sentence(rng, 4)[:-1]}', fontsize=18)
+    rect = fitz.Rect(56, 96, 540, 470 if number % 3 == 0 else 780)
+    page.insert_textbox(rect, '\n\n'.join(_paragraphs(rng, 4)), fontsize=10)
+    if number % 3 == 0:
+        # Ruled table, picked up by pdf_to_excel's table detection
+        left, top, cols, rows, width, height = 56, 490, 5, 8, 96, 20
+        for r in range(rows):
+            for c in range(cols):
+                cell = fitz.Rect(left + c * width, top + r * height, left + (c + 1) * width, top + (r + 1) * height)
+                page.draw_rect(cell, color=(0, 0, 0), width=0.5)
+                text = f'Col {c + 1}' if r == 0 else f'{rng.randint(0, 99999)}'
+                page.insert_text((cell.x0 + 4, cell.y1 - 6), text, fontsize=8)
+    if number % 10 == 0:
+        page.insert_image(fitz.Rect(360, 660, 540, 795), stream=photo)
+
+
+def _save_pdf(doc, path):
+    doc.set_metadata({'producer': 'benchmark corpus', 'creationDate': 'D:20240101000000', 'modDate': 'D:20240101000000'})
+    doc.save(path, garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+
+
+def make_text_pdf(path, pages, seed=0):
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    make_photo((800, 600), seed).save(buffer, format='JPEG', quality=85)
+    doc = fitz.open()
+    for number in range(pages):
+        _write_text_page(doc.new_page(width=595, height=842), rng, number, buffer.getvalue())
+    _save_pdf(doc, path)
+
+
+def make_scanned_pdf(path, pages, seed=0, dpi=100):
+    """The text pages, rasterized and degraded like a desk scanner would"""
+    rng = random.Random(seed)
+    noise_rng = np.random.default_rng(seed)
+    photo = io.BytesIO()
+    make_photo((800, 600), seed).save(photo, format='JPEG', quality=85)
+    source = fitz.open()
+    doc = fitz.open()
+    for number in range(pages):
+        page = source.new_page(width=595, height=842)
+        _write_text_page(page, rng, number, photo.getvalue())
+        pix = page.get_pixmap(dpi=dpi, colorspace='gray')
+        img = Image.frombytes('L', [pix.width, pix.height], pix.samples)
+        img = img.rotate(rng.uniform(-1.5, 1.5), resample=Image.BICUBIC, fillcolor=255)
+        pixels = np.asarray(img, dtype=np.float64) + noise_rng.normal(0, 10, (img.height, img.width))
+        img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).filter(ImageFilter.SMOOTH)
+        scan = io.BytesIO()
+        img.save(scan, format='JPEG', quality=60)
+        out_page = doc.new_page(width=595, height=842)
+        out_page.insert_image(out_page.rect, stream=scan.getvalue())
+    source.close()
+    _save_pdf(doc, path)
+
+
+def make_text_image(path, seed=0, dpi=300):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    page.insert_text((56, 72), 'Quarterly statement', fontsize=18)
+    page.insert_textbox(fitz.Rect(56, 96, 540, 780), '\n\n'.join(_paragraphs(rng, 6)), fontsize=11)
+    pix = page.get_pixmap(dpi=dpi, colorspace='gray')
+    Image.frombytes('L', [pix.width, pix.height], pix.samples).save(path, format='PNG', dpi=(dpi, dpi))
+    doc.close()
+
+
+def make_workbook(path, rows, seed=0):
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    workbook.properties.created = _FIXED_DATE
+    workbook.properties.modified = _FIXED_DATE
+    sheet = workbook.create_sheet('Orders')
+    sheet.append(['Order', 'Date', 'Customer', 'Region', 'Quantity', 'Price', 'Total', 'Notes'])
+    for row in range(rows):
+        quantity, price = rng.randint(1, 500), round(rng.uniform(1, 900), 2)
+        sheet.append([
+            row + 1,
+            _FIXED_DATE.date() + datetime.timedelta(days=row % 365),
+            f'Customer {rng.randint(1, 5000)}',
+            rng.choice(['North', 'South', 'East', 'West']),
+            quantity,
+            price,
+            round(quantity * price, 2),
+            _sentence(rng, rng.randint(2, 10)),
+        ])
+    workbook.save(path)
+
+
+def corpus_files(quick=False):
+    """Map of corpus file name to a function writing it to a path"""
+    pages = QUICK_PAGE_COUNTS if quick else PAGE_COUNTS
+    sizes = QUICK_IMAGE_SIZES if quick else list(IMAGE_SIZES)
+    rows = QUICK_ROW_COUNTS if quick else ROW_COUNTS
+    files = {}
+    for count in pages:
+        files[f'text-{count}.pdf'] = lambda path, count=count: make_text_pdf(path, count, seed=count)
+        files[f'scanned-{count}.pdf'] = lambda path, count=count: make_scanned_pdf(path, count, seed=count)
+    for name in sizes:
+        files[f'photo-{name}.jpg'] = lambda path, name=name: make_photo(IMAGE_SIZES[name], seed=1).save(
+            path, format='JPEG', quality=90)
+    files['screenshot.png'] = lambda path: make_screenshot().save(path, format='PNG')
+    files['text-page.png'] = make_text_image
+    for count in rows:
+        files[f'rows-{count}.xlsx'] = lambda path, count=count: make_workbook(path, count, seed=count)
+    return files
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ensure_corpus(quick=False, corpus_dir=CORPUS_DIR, log=print):
+    """Generate any missing or outdated corpus files; returns the corpus directory"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    manifest_path = os.path.join(corpus_dir, 'manifest.json')
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get('version') != CORPUS_VERSION:
+        manifest = {'version': CORPUS_VERSION, 'files': {}}
+
+    for name, write in corpus_files(quick).items():
+        path = os.path.join(corpus_dir, name)
+        if name in manifest['files'] and os.path.exists(path):
+            continue
+        log(f'generating {name}')
+        write(path)
+        manifest['files'][name] = {'bytes': os.path.getsize(path), 'sha256': _sha256(path)}
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+    return corpus_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='skip the 500-page, 6000x4000 and 100k-row files')
+    args = parser.parse_args()
+    ensure_corpus(args.quick, log=lambda message: print(message, file=sys.stderr))
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        print(f'{os.path.getsize(os.path.join(CORPUS_DIR, name)):>12,}  {name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Load generator for the backend: many concurrent uploads against a live server.
+
+Starts app.py on a local port (or targets --url / a --server-cmd such as
+gunicorn), then sends a weighted mix of requests built from the benchmark
+corpus (corpus.py) for a fixed duration:
+
+    --concurrency N   closed loop: N clients, each sending its next request
+                      as soon as the previous one finishes
+    --rate R          open loop: Poisson arrivals at R requests/s. Latency is
+                      measured from the scheduled arrival, so a server that
+                      falls behind shows it in the percentiles
+
+Reports throughput, p50/p95/p99 latency and error rate per request type,
+plus completed requests and server RSS (the server process and its
+children) over time.
+
+Run from the backend directory:
+    python benchmarks/load_test.py --concurrency 50 --duration 60
+    python benchmarks/load_test.py --rate 5 --mix convert=3,compress=1,ocr=1
+    python benchmarks/load_test.py --server-cmd "gunicorn -w 4 -b 127.0.0.1:{port} app:app" --concurrency 20
+"""
+import argparse
+import collections
+import http.client
+import json
+import math
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, BACKEND_DIR)
+
+from corpus import CORPUS_DIR, ensure_corpus
+
+# name: (path, upload field, corpus file, form fields)
+REQUEST_TYPES = {
+    'convert': ('/convert', 'file', 'photo-medium.jpg', {'format': 'WEBP'}),
+    'convert-small': ('/convert', 'file', 'photo-small.jpg', {'format': 'WEBP'}),
+    'compress': ('/pdf/compress', 'file', 'scanned-1.pdf', {}),
+    'compress-50': ('/pdf/compress', 'file', 'scanned-50.pdf', {}),
+    'split': ('/pdf/split', 'file', 'text-50.pdf', {'splitType': 'all'}),
+    'to-images': ('/pdf/to-images', 'file', 'text-1.pdf', {'dpi': '150'}),
+    'info': ('/pdf/info', 'file', 'text-50.pdf', {}),
+    'ocr': ('/ocr/extract', 'file', 'text-page.png', {'language': 'english'}),
+    'pdf-ocr': ('/pdf/ocr', 'file', 'scanned-1.pdf', {}),
+}
+DEFAULT_MIX = 'convert=4,compress=2,split=2,ocr=1'
+
+SAMPLE_INTERVAL = 1.0
+REQUEST_TIMEOUT = 300
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in REQUEST_TYPES:
+            raise ValueError(f'Unsupported request type {name!r}. Supported types: {", ".join(REQUEST_TYPES)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def encode_multipart(field, filename, content, form):
+    """multipart/form-data body and content type for one upload plus form fields"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in form.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+    parts.append(content)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def build_requests(mix, corpus_dir):
+    """Pre-encoded (path, body, content type) per request type in the mix"""
+    requests = {}
+    for name in mix:
+        path, field, filename, form = REQUEST_TYPES[name]
+        with open(os.path.join(corpus_dir, filename), 'rb') as f:
+            requests[name] = (path,) + encode_multipart(field, filename, f.read(), form)
+    return requests
+
+
+def send(base_url, path, body, content_type, timeout=REQUEST_TIMEOUT):
+    """POST one request on a new connection; returns (status, response bytes)"""
+    url = urllib.parse.urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+    try:
+        connection.request('POST', url.path.rstrip('/') + path, body=body,
+                           headers={'Content-Type': content_type, 'Content-Length': str(len(body))})
+        response = connection.getresponse()
+        size = 0
+        while True:
+            chunk = response.read(65536)
+            if not chunk:
+                break
+            size += len(chunk)
+        return response.status, size
+    finally:
+        connection.close()
+
+
+def _process_tree_rss_mb(root_pid):
+    """RSS of a process and all its descendants, in MB (None once it has exited)"""
+    try:
+        output = subprocess.run(['ps', '-eo', 'pid=,ppid=,rss='], capture_output=True, text=True).stdout
+    except OSError:
+        return None
+    children, rss = collections.defaultdict(list), {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 3:
+            pid, ppid, kb = map(int, fields)
+            children[ppid].append(pid)
+            rss[pid] = kb
+    if root_pid not in rss:
+        return None
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, ()))
+    return total / 1024
+
+
+class Recorder:
+    """Completed requests and server RSS samples, relative to the run start"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.results = []  # (type, offset, latency, status, response bytes)
+        self.rss = []  # (offset, MB)
+        self._lock = threading.Lock()
+
+    def now(self):
+        return time.perf_counter() - self.start
+
+    def add(self, name, scheduled, status, size):
+        finished = self.now()
+        with self._lock:
+            self.results.append((name, finished, finished - scheduled, status, size))
+
+
+def _run_one(recorder, base_url, requests, name, scheduled):
+    path, body, content_type = requests[name]
+    try:
+        status, size = send(base_url, path, body, content_type)
+    except Exception as e:
+        status, size = type(e).__name__, 0
+    recorder.add(name, scheduled, status, size)
+
+
+def run_closed(recorder, base_url, requests, names, weights, concurrency, duration, seed):
+    def client(index):
+        rng = random.Random(seed + index)
+        while recorder.now() < duration:
+            _run_one(recorder, base_url, requests, rng.choices(names, weights)[0], recorder.now())
+
+    threads = [threading.Thread(target=client, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open(recorder, base_url, requests, names, weights, rate, duration, seed, max_in_flight):
+    rng = random.Random(seed)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        arrival = 0.0
+        while True:
+            arrival += rng.expovariate(rate)
+            if arrival >= duration:
+                break
+            delay = arrival - recorder.now()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(_run_one, recorder, base_url, requests, rng.choices(names, weights)[0], arrival)
+
+
+def sample_rss(recorder, pid, interval, stop):
+    while not stop.wait(interval):
+        rss = _process_tree_rss_mb(pid)
+        if rss is not None:
+            recorder.rss.append((recorder.now(), rss))
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def summarize(results, warmup, duration):
+    """Per-type and overall statistics of the requests finished after the warm-up"""
+    window = max(duration - warmup, 1e-9)
+    groups = collections.defaultdict(list)
+    for result in results:
+        if result[1] >= warmup:
+            groups[result[0]].append(result)
+            groups['all'].append(result)
+    summary = {}
+    for name, items in groups.items():
+        latencies = sorted(item[2] for item in items)
+        statuses = collections.Counter(str(item[3]) for item in items)
+        errors = sum(1 for item in items if not (isinstance(item[3], int) and item[3] < 400))
+        summary[name] = {
+            'requests': len(items),
+            'throughput_rps': round(len(items) / window, 3),
+            'p50_s': percentile(latencies, 0.50),
+            'p95_s': percentile(latencies, 0.95),
+            'p99_s': percentile(latencies, 0.99),
+            'max_s': latencies[-1],
+            'error_rate': round(errors / len(items), 4),
+            'statuses': dict(statuses),
+            'response_mb': round(sum(item[4] for item in items) / 1024 / 1024, 2),
+        }
+    return summary
+
+
+def timeline(results, rss, duration, rows=20):
+    """(start, end, completed, errors, RSS MB) per interval over the run"""
+    step = max(duration / rows, SAMPLE_INTERVAL)
+    lines = []
+    start = 0.0
+    while start < duration:
+        end = start + step
+        done = [r for r in results if start <= r[1] < end]
+        errors = sum(1 for r in done if not (isinstance(r[3], int) and r[3] < 400))
+        samples = [mb for offset, mb in rss if start <= offset < end]
+        lines.append((start, end, len(done), errors, max(samples) if samples else None))
+        start = end
+    return lines
+
+
+def _ms(seconds):
+    return '' if seconds is None else f'{seconds * 1000:.0f}'
+
+
+def print_report(summary, lines, rss, args):
+    load = f'{args.concurrency} concurrent clients' if args.rate is None else f'{args.rate} requests/s (open loop)'
+    print(f'\n{load}, {args.duration:.0f} s, first {args.warmup:.0f} s excluded\n')
+    print('| Type | Requests | req/s | p50 ms | p95 ms | p99 ms | max ms | Errors | Statuses |')
+    print('|---|---:|---:|---:|---:|---:|---:|---:|---|')
+    for name in sorted(summary, key=lambda name: (name == 'all', name)):
+        s = summary[name]
+        statuses = ', '.join(f'{status}: {count}' for status, count in sorted(s['statuses'].items()))
+        print(f"| {name} | {s['requests']} | {s['throughput_rps']:.2f} | {_ms(s['p50_s'])} | {_ms(s['p95_s'])} | "
+              f"{_ms(s['p99_s'])} | {_ms(s['max_s'])} | {s['error_rate']:.1%} | {statuses} |")
+
+    print('\n| Time s | Completed | Errors | Server RSS MB |')
+    print('|---|---:|---:|---:|')
+    for start, end, done, errors, mb in lines:
+        print(f"| {start:.0f}-{end:.0f} | {done} | {errors} | {'' if mb is None else f'{mb:.0f}'} |")
+    if rss:
+        values = [mb for _, mb in rss]
+        print(f'\nServer RSS: {values[0]:.0f} MB at start, {max(values):.0f} MB peak, {values[-1]:.0f} MB at end')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command, port, log):
+    """Start the server and wait until /health answers"""
+    if command:
+        argv = shlex.split(command.format(port=port))
+    else:
+        argv = [sys.executable, '-c',
+                f'from app import app; app.run(host="127.0.0.1", port={port}, threaded=True, debug=False)']
+    env = dict(os.environ, TRACE_LOG=os.environ.get('TRACE_LOG', '0'))
+    process = subprocess.Popen(argv, cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT, env=env)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise Exception(f'Server exited with status {process.returncode}; see {log.name}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise Exception(f'Server did not answer /health within 60 s; see {log.name}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--concurrency', type=int, default=10, help='clients in closed-loop mode (default 10)')
+    load.add_argument('--rate', type=float, help='open-loop arrival rate in requests/s')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f'weighted request types (default {DEFAULT_MIX}); types: {", ".join(REQUEST_TYPES)}')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load (default 30)')
+    parser.add_argument('--warmup', type=float, default=0, help='leading seconds left out of the statistics')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='open loop: most requests outstanding at once')
+    parser.add_argument('--url', help='target a running server instead of starting one, e.g. http://127.0.0.1:5001')
+    parser.add_argument('--server-cmd', help='command starting the server, with {port}; default: app.run, threaded')
+    parser.add_argument('--pid', type=int, help='with --url: server process whose RSS (with children) to sample')
+    parser.add_argument('--port', type=int, default=None, help='port for the started server (default: a free one)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--corpus', default=CORPUS_DIR, help='corpus directory')
+    parser.add_argument('--json', help='also write the summary, timeline and RSS samples to this file')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    ensure_corpus(quick=True, corpus_dir=args.corpus, log=lambda message: print(message, file=sys.stderr))
+    requests = build_requests(mix, args.corpus)
+    names, weights = list(mix), list(mix.values())
+
+    process, log = None, None
+    if args.url:
+        base_url, pid = args.url, args.pid
+    else:
+        port = args.port or _free_port()
+        log = tempfile.NamedTemporaryFile(prefix='load-test-server-', suffix='.log', delete=False)
+        print(f'Starting server on port {port} (log: {log.name})', file=sys.stderr)
+        process = start_server(args.server_cmd, port, log)
+        base_url, pid = f'http://127.0.0.1:{port}', process.pid
+
+    recorder = Recorder()
+    stop = threading.Event()
+    sampler = None
+    if pid:
+        sampler = threading.Thread(target=sample_rss, args=(recorder, pid, SAMPLE_INTERVAL, stop), daemon=True)
+        sampler.start()
+    try:
+        if args.rate is None:
+            run_closed(recorder, base_url, requests, names, weights, args.concurrency, args.duration, args.seed)
+        else:
+            run_open(recorder, base_url, requests, names, weights, args.rate, args.duration, args.seed,
+                     args.max_in_flight)
+    finally:
+        elapsed = recorder.now()
+        stop.set()
+        if sampler:
+            sampler.join()
+        if process:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if log:
+            log.close()
+
+    # Requests still running at the deadline finish late; the window covers them
+    duration = max(args.duration, elapsed)
+    summary = summarize(recorder.results, args.warmup, duration)
+    lines = timeline(recorder.results, recorder.rss, duration)
+    print_report(summary, lines, recorder.rss, args)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'summary': summary, 'timeline': lines, 'rss': recorder.rss}, f, indent=2)
+    if not summary:
+        sys.exit('No requests completed')
+
+
+if __name__ == '__main__':
+    main()
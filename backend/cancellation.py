@@ -0,0 +1,228 @@
+import contextvars
+import os
+import re
+import select
+import socket
+import subprocess
+import threading
+import time
+from metrics import Counter, call_when_sent
+
+# Seconds a conversion may run, counted from the start of the request
+# (admission queueing included); 0 turns the deadline off
+CONVERSION_TIMEOUT = float(os.environ.get('CONVERSION_TIMEOUT', 300))
+
+# How often, at most, a running conversion looks at its client connection
+CANCEL_POLL_INTERVAL = float(os.environ.get('CANCEL_POLL_INTERVAL', 0.5))
+
+# Reasons a conversion is stopped, and the status the request ends with.
+# 499 is nginx's "client closed request"; nobody reads that response.
+DISCONNECTED = 'disconnected'
+DEADLINE = 'deadline'
+CANCELLED = 'cancelled'
+_STATUS = {DISCONNECTED: 499, DEADLINE: 504, CANCELLED: 409}
+
+# Client-chosen job ids (X-Job-Id); requests without one use their trace id
+_JOB_ID = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+CANCELLATIONS = Counter('conversions_cancelled_total', 'Conversions stopped before finishing', ['route', 'reason'])
+
+_current = contextvars.ContextVar('cancel_token', default=None)
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class Cancelled(Exception):
+    """The conversion was stopped; reason is DISCONNECTED, DEADLINE or CANCELLED"""
+
+    def __init__(self, reason, message=None):
+        super().__init__(reason, message)
+        self.reason = reason
+        self.message = message or {
+            DISCONNECTED: 'Client disconnected',
+            DEADLINE: f'Conversion took longer than {CONVERSION_TIMEOUT:g} seconds',
+            CANCELLED: 'Conversion was cancelled',
+        }[reason]
+        self.status = _STATUS[reason]
+
+    def __str__(self):
+        return self.message
+
+    def to_dict(self):
+        return {'error': self.message, 'code': self.reason}
+
+
+class CancelToken:
+    """
+    Tells a running conversion when to stop
+
+    Fires when cancel() is called, once the deadline (a time.perf_counter()
+    value) has passed, or when probe() reports the client gone; probe is
+    called at most every CANCEL_POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, deadline=None, probe=None):
+        self.deadline = deadline
+        self.reason = None
+        self._probe = probe
+        self._next_probe = 0.0
+        self._lock = threading.Lock()
+
+    def cancel(self, reason=CANCELLED):
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+
+    def cancelled(self):
+        if self.reason is None:
+            now = time.perf_counter()
+            if self.deadline is not None and now >= self.deadline:
+                self.cancel(DEADLINE)
+            elif self._probe is not None and now >= self._next_probe:
+                self._next_probe = now + CANCEL_POLL_INTERVAL
+                if self._probe():
+                    self.cancel(DISCONNECTED)
+        return self.reason is not None
+
+    def check(self):
+        """Raise Cancelled if the conversion should stop"""
+        if self.cancelled():
+            raise Cancelled(self.reason)
+
+
+def current_token():
+    """The cancel token of the request being handled, or None"""
+    return _current.get()
+
+
+def check():
+    """
+    Raise Cancelled if the current request's conversion should stop
+
+    Called at page (or batch) boundaries by the converters; does nothing
+    outside a request. Thread pool work sees the request's token when it is
+    submitted through tracing.bind.
+    """
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+def run_process(cmd, **kwargs):
+    """
+    subprocess.run(cmd, capture_output=True) that kills the process if the
+    current request is cancelled while it runs, then raises Cancelled
+    """
+    token = _current.get()
+    if token is None:
+        return subprocess.run(cmd, capture_output=True, **kwargs)
+    token.check()
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs) as proc:
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=CANCEL_POLL_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                if token.cancelled():
+                    # Don't drain the pipes: a child the process left
+                    # behind could keep them open
+                    proc.kill()
+                    proc.wait()
+                    raise Cancelled(token.reason)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def cancel_job(job_id):
+    """Cancel the running request with this job id; False if there is none"""
+    with _jobs_lock:
+        token = _jobs.get(job_id)
+    if token is None:
+        return False
+    token.cancel(CANCELLED)
+    return True
+
+
+def _disconnect_probe(environ):
+    # The client socket, where the server exposes it (the Werkzeug dev
+    # server and gunicorn do). Once the request body has been read, a
+    # readable socket that returns no data means the client hung up.
+    sock = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+    if sock is None:
+        return None
+
+    def probe():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+        except ValueError:
+            # TLS sockets can't peek; treat the client as still there
+            return False
+        except OSError:
+            return True
+    return probe
+
+
+def install(app):
+    """
+    Give every request a cancel token, and answer cancelled conversions with their reason
+
+    Install after instrument_app, whose trace id is the default job id, and
+    before admission, so requests waiting in its queue can be cancelled too.
+    Hooks installed later (admission) no longer see a response this swaps;
+    they must release what they hold in teardown.
+    """
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _start_token():
+        job_id = request.headers.get('X-Job-Id')
+        if job_id is not None and not _JOB_ID.match(job_id):
+            return jsonify({'error': 'X-Job-Id must be 1-64 letters, digits, ".", "_" or "-"'}), 400
+        trace = g.get('trace')
+        job_id = job_id or (trace.id if trace is not None else None)
+        # Counted from when the request came in (instrument_app), so time
+        # spent waiting for admission counts against the deadline
+        started = g.get('metrics_start') or time.perf_counter()
+        deadline = started + CONVERSION_TIMEOUT if CONVERSION_TIMEOUT > 0 else None
+        token = CancelToken(deadline, _disconnect_probe(request.environ))
+        if job_id is not None:
+            with _jobs_lock:
+                if job_id in _jobs:
+                    return jsonify({'error': f'Job {job_id} is already running'}), 409
+                _jobs[job_id] = token
+        g.cancel_token, g.job_id = token, job_id
+        _current.set(token)
+
+    @app.after_request
+    def _answer_cancelled(response):
+        token = g.get('cancel_token')
+        if token is None:
+            return response
+        if token.reason is not None and response.status_code >= 500:
+            # Converters wrap whatever they raise; report why the work stopped
+            error = Cancelled(token.reason)
+            response = jsonify(error.to_dict())
+            response.status_code = error.status
+        if token.reason is not None and response.status_code == _STATUS[token.reason]:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            CANCELLATIONS.inc(route=route, reason=token.reason)
+        if g.job_id is not None:
+            response.headers['X-Job-Id'] = g.job_id
+            # Streamed bodies can still be cancelled until they are sent
+            call_when_sent(response, lambda sent, job_id=g.job_id: _finish_job(job_id, token))
+            g.job_id = None
+        return response
+
+    @app.teardown_request
+    def _clear_token(error):
+        token = g.pop('cancel_token', None)
+        if g.get('job_id') is not None:
+            _finish_job(g.job_id, token)
+        if token is not None and _current.get() is token:
+            _current.set(None)
+
+
+def _finish_job(job_id, token):
+    with _jobs_lock:
+        if _jobs.get(job_id) is token:
+            del _jobs[job_id]
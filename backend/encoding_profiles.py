@@ -0,0 +1,71 @@
+from PIL import Image, ImageChops
+
+# Named encoder settings. Output quality is the same across profiles; they
+# trade encode time for output size (see PERFORMANCE.md for measurements).
+ENCODING_PROFILES = ['fast', 'balanced', 'smallest']
+DEFAULT_PROFILE = 'balanced'
+
+# Lossy quality used for JPEG and WebP output
+DEFAULT_QUALITY = 95
+
+_SAVE_OPTIONS = {
+    'fast': {
+        'JPEG': {'optimize': False},
+        'PNG': {'compress_level': 1},
+        'WEBP': {'method': 0},
+        'TIFF': {'compression': 'raw'},
+        'GIF': {'optimize': False},
+    },
+    'balanced': {
+        'JPEG': {'optimize': True},
+        'PNG': {'compress_level': 6},
+        'WEBP': {'method': 4},
+        'TIFF': {'compression': 'tiff_lzw'},
+        'GIF': {'optimize': False},
+    },
+    'smallest': {
+        'JPEG': {'optimize': True, 'progressive': True},
+        'PNG': {'compress_level': 9, 'optimize': True},
+        'WEBP': {'method': 6},
+        'TIFF': {'compression': 'tiff_adobe_deflate'},
+        'GIF': {'optimize': True},
+    },
+}
+
+
+def save_options(save_format, profile=DEFAULT_PROFILE, quality=DEFAULT_QUALITY):
+    """Keyword arguments for Image.save for a format under a profile"""
+    options = dict(_SAVE_OPTIONS.get(profile, _SAVE_OPTIONS[DEFAULT_PROFILE]).get(save_format, {}))
+    if save_format in ('JPEG', 'WEBP'):
+        options['quality'] = quality
+    return options
+
+
+def png_compress_level(profile=DEFAULT_PROFILE):
+    """zlib level used for PNG output under a profile"""
+    return save_options('PNG', profile)['compress_level']
+
+
+def prepare_for_profile(img, save_format, profile=DEFAULT_PROFILE):
+    """Apply pixel-level size optimizations that do not change the image
+
+    For the smallest profile, PNG images with at most 256 distinct colours
+    are stored as palette images, but only if the palette reproduces every
+    pixel exactly.
+    """
+    if profile != 'smallest' or save_format != 'PNG' or img.mode not in ('RGB', 'RGBA'):
+        return img
+    colors = img.getcolors(256)
+    if colors is None:
+        return img
+    method = Image.Quantize.FASTOCTREE if img.mode == 'RGBA' else Image.Quantize.MEDIANCUT
+    paletted = img.quantize(len(colors), method=method, dither=Image.Dither.NONE)
+    if ImageChops.difference(paletted.convert(img.mode), img).getbbox() is not None:
+        return img
+    return paletted
+
+
+def encode(img, output, save_format, profile=DEFAULT_PROFILE, quality=DEFAULT_QUALITY, **extra):
+    """Save img to output in save_format using a named profile"""
+    img = prepare_for_profile(img, save_format, profile)
+    img.save(output, format=save_format, **save_options(save_format, profile, quality), **extra)
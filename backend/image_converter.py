@@ -0,0 +1,349 @@
+from PIL import Image, ImageOps, ImageSequence, GifImagePlugin
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from werkzeug.utils import secure_filename
+from large_image import TILED_MODES, is_large_image, fit_size, convert_large_image
+from lossless_ops import METADATA_STRIPPERS
+from encoding_profiles import DEFAULT_PROFILE, save_options, encode
+from resource_guard import check_image, check_raster, open_image
+import cancellation
+import tracing
+
+# Supported formats
+SUPPORTED_FORMATS = ['PNG', 'JPEG', 'JPG', 'WEBP', 'BMP', 'GIF', 'TIFF', 'ICO']
+
+# Hard ceiling on decoded image size. Images above LARGE_IMAGE_PIXELS are
+# processed in strips, so this can sit well above Pillow's default.
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 1_000_000_000))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Targets that can hold every frame of an animated or multi-page input.
+# APNG is left out on purpose: Pillow buffers all APNG frames before writing.
+MULTIFRAME_FORMATS = ['GIF', 'WEBP', 'TIFF']
+
+# Frame handling modes for multi-frame inputs
+FRAME_MODES = ['all', 'first', 'zip']
+
+# Conversion paths reported by plan_conversion, cheapest first
+PATH_PASSTHROUGH = 'passthrough'
+PATH_LOSSLESS = 'lossless'
+PATH_TRANSCODE = 'transcode'
+
+# Batch conversion settings. Pillow releases the GIL inside its codecs, so a
+# thread pool scales decode/encode across cores without pickling pixel data.
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', os.cpu_count() or 4))
+BATCH_MEMORY_BUDGET = int(os.environ.get('BATCH_MEMORY_BUDGET_MB', 512)) * 1024 * 1024
+
+
+def get_extension(target_format):
+    """File extension used for a target format"""
+    extension = target_format.lower()
+    if extension == 'jpeg':
+        extension = 'jpg'
+    return extension
+
+
+def output_filename(filename, target_format):
+    """Build the download name for a converted upload"""
+    original_name = os.path.splitext(secure_filename(filename))[0]
+    return f"{original_name}.{get_extension(target_format)}"
+
+
+def _save_format(target_format):
+    return 'JPEG' if target_format == 'JPG' else target_format
+
+
+def _flatten_for_format(img, target_format):
+    # Convert RGBA to RGB if saving as JPEG
+    if target_format in ['JPEG', 'JPG'] and img.mode in ('RGBA', 'LA', 'P'):
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        img = rgb_img
+    return img
+
+
+def is_multiframe(img):
+    """True for animated GIF/WebP/PNG and multi-page TIFF inputs"""
+    return getattr(img, 'n_frames', 1) > 1
+
+
+def plan_conversion(image_data, target_format, frames='all', max_size=None, strip_metadata=False, profile=DEFAULT_PROFILE):
+    """Pick the cheapest way to produce target_format, reading only the header
+
+    Returns a dict with the chosen ``path`` and a short ``reason``:
+    passthrough returns the upload unchanged, lossless rewrites container
+    metadata without touching the compressed pixels, and transcode decodes
+    and re-encodes.
+    """
+    with open_image(image_data) as img:
+        source_format = img.format
+        size = img.size
+        multiframe = is_multiframe(img)
+        orientation = img.getexif().get(0x0112, 1) if strip_metadata else 1
+
+    if source_format != _save_format(target_format):
+        return {'path': PATH_TRANSCODE, 'reason': f'{source_format} to {_save_format(target_format)}'}
+    if max_size and fit_size(size, max_size) != size:
+        return {'path': PATH_TRANSCODE, 'reason': 'resize requested'}
+    if multiframe and frames == 'first':
+        return {'path': PATH_TRANSCODE, 'reason': 'dropping extra frames'}
+    if profile == 'smallest' and source_format == 'PNG' and not strip_metadata:
+        # PNG re-encoding is lossless, so it is worth it for the smaller output
+        return {'path': PATH_TRANSCODE, 'reason': 'recompressing PNG for size'}
+    if strip_metadata:
+        if source_format not in METADATA_STRIPPERS:
+            return {'path': PATH_TRANSCODE, 'reason': f'no lossless metadata strip for {source_format}'}
+        if orientation != 1:
+            # Dropping EXIF would also drop the rotation viewers apply
+            return {'path': PATH_TRANSCODE, 'reason': 'EXIF orientation must be applied'}
+        return {'path': PATH_LOSSLESS, 'reason': 'metadata stripped without re-encoding'}
+    return {'path': PATH_PASSTHROUGH, 'reason': f'already {source_format}'}
+
+
+def run_conversion(image_data, target_format, frames='all', max_size=None, strip_metadata=False, profile=DEFAULT_PROFILE):
+    """Plan and execute a conversion, returning (encoded bytes, plan)"""
+    plan = plan_conversion(image_data, target_format, frames, max_size, strip_metadata, profile)
+    if plan['path'] == PATH_PASSTHROUGH:
+        return image_data, plan
+    if plan['path'] == PATH_LOSSLESS:
+        with Image.open(io.BytesIO(image_data)) as img:
+            source_format = img.format
+        return METADATA_STRIPPERS[source_format](image_data), plan
+    return _transcode(image_data, target_format, frames, max_size, strip_metadata, profile), plan
+
+
+def convert_image_data(image_data, target_format, frames='all', max_size=None, profile=DEFAULT_PROFILE):
+    """Convert raw image bytes to target_format and return the encoded bytes
+
+    frames: 'all' keeps every frame of an animated or multi-page input when
+    the target format can hold them, 'first' keeps only the first frame.
+    max_size: optional (max_width, max_height) to downscale into. Resizing
+    and very large images go through the strip pipeline in large_image.
+    profile: encoding profile name from encoding_profiles.
+    Inputs that already match the request are returned without decoding.
+    """
+    return run_conversion(image_data, target_format, frames, max_size, profile=profile)[0]
+
+
+def _transcode(image_data, target_format, frames, max_size, strip_metadata, profile):
+    img = open_image(image_data)
+    save_format = _save_format(target_format)
+    multiframe = frames == 'all' and is_multiframe(img) and save_format in MULTIFRAME_FORMATS
+    # Frames are decoded whole, one at a time; single images may go through
+    # the strip pipeline
+    check_image(image_data, max_size, streamed=not multiframe)
+
+    # Create output buffer
+    output = io.BytesIO()
+
+    if multiframe:
+        save_multiframe(img, output, save_format, profile, max_size)
+        return output.getvalue()
+
+    if (max_size or is_large_image(img)) and img.mode in TILED_MODES:
+        return convert_large_image(image_data, target_format, max_size, profile=profile)
+
+    if strip_metadata:
+        img = ImageOps.exif_transpose(img)
+
+    img = _flatten_for_format(img, target_format)
+    if max_size:
+        img.thumbnail((max_size[0] or img.width, max_size[1] or img.height), Image.LANCZOS)
+
+    # Save image in target format
+    encode(img, output, save_format, profile)
+    return output.getvalue()
+
+
+def save_multiframe(img, output, save_format, profile=DEFAULT_PROFILE, max_size=None):
+    """Write every frame of img to output, decoding one frame at a time
+
+    max_size: optional (max_width, max_height) each frame is downscaled into
+    """
+    if save_format == 'GIF':
+        _save_gif_incremental(img, output, max_size)
+        return
+    options = dict(save_options(save_format, profile), duration=img.info.get('duration', 100),
+                   loop=img.info.get('loop', 0))
+    if not max_size or fit_size(img.size, max_size) == img.size:
+        # The TIFF and WebP writers seek through the source image themselves
+        # and encode each frame as it is loaded, so passing the source
+        # directly keeps only the current (and, for GIF sources, the
+        # previous) frame decoded. Handing them a list of converted frames
+        # would hold all of them at once.
+        img.save(output, format=save_format, save_all=True, **options)
+        return
+    # Resized frames can only be handed over as a list, so all of them are
+    # held at the target size; that has to fit the decode budget too
+    width, height = fit_size(img.size, max_size)
+    check_raster(width, height * img.n_frames, 4)
+    frames = [_fit_frame(frame, max_size) for frame in ImageSequence.Iterator(img)]
+    frames[0].save(output, format=save_format, save_all=True, append_images=frames[1:], **options)
+
+
+def _fit_frame(frame, max_size):
+    # A resized copy of the current frame; the frame iterator reuses its image
+    check_raster(frame.width, frame.height, len(frame.getbands()))
+    if frame.mode in ('P', '1'):
+        # Palette images can only be resized with nearest-neighbour sampling
+        frame = frame.convert('RGBA')
+    size = fit_size(frame.size, max_size)
+    return frame.resize(size, Image.LANCZOS) if size != frame.size else frame.copy()
+
+
+def _gif_frame(frame):
+    # GIF frames must be palette images; keep hard transparency if present
+    if frame.mode == 'P':
+        return frame.copy(), frame.info.get('transparency')
+    if frame.mode in ('RGBA', 'LA', 'PA') or 'transparency' in frame.info:
+        rgba = frame.convert('RGBA')
+        alpha = rgba.getchannel('A')
+        paletted = rgba.convert('RGB').quantize(255)
+        paletted.paste(255, mask=alpha.point(lambda a: 255 if a < 128 else 0))
+        return paletted, 255
+    return frame.convert('RGB').quantize(256), None
+
+
+def _save_gif_incremental(img, output, max_size=None):
+    # Pillow's GIF save_all keeps every frame in a list to compute deltas, so
+    # frames are written one by one with the GIF plugin's frame helpers
+    loop = img.info.get('loop', 0)
+    for index, frame in enumerate(ImageSequence.Iterator(img)):
+        if max_size:
+            frame = _fit_frame(frame, max_size)
+        paletted, transparency = _gif_frame(frame)
+        params = {
+            'duration': frame.info.get('duration', img.info.get('duration', 100)),
+            # Frames are whole composited images: a transparent one has to
+            # clear its area, or the previous frame shows through it
+            'disposal': 2 if transparency is not None else 1,
+            'include_color_table': True,
+        }
+        if transparency is not None:
+            params['transparency'] = transparency
+        if index == 0:
+            header, _ = GifImagePlugin.getheader(paletted.copy(), info={'loop': loop, 'duration': params['duration']})
+            for chunk in header:
+                output.write(chunk)
+        for chunk in GifImagePlugin.getdata(paletted, **params):
+            output.write(chunk)
+    output.write(b';')
+
+
+def iter_frames(image_data, target_format, filename, profile=DEFAULT_PROFILE):
+    """Return an iterator of (filename, bytes) for each frame of an image
+
+    The image is opened up front so unreadable uploads fail before any
+    response is streamed; frames are then decoded and encoded one at a time.
+    """
+    check_image(image_data)
+    img = Image.open(io.BytesIO(image_data))
+    original_name = os.path.splitext(secure_filename(filename))[0]
+    return _encode_frames(img, target_format, original_name, profile)
+
+
+def _encode_frames(img, target_format, original_name, profile):
+    save_format = _save_format(target_format)
+    extension = get_extension(target_format)
+    for index, frame in enumerate(ImageSequence.Iterator(img)):
+        output = io.BytesIO()
+        encode(_flatten_for_format(frame, target_format), output, save_format, profile)
+        yield f"{original_name}_frame_{index + 1:04d}.{extension}", output.getvalue()
+
+
+def estimate_conversion_memory(image_data, input_bytes=None):
+    """Estimate peak bytes needed to convert an image, from its header only
+
+    image_data may be just the start of the file when input_bytes gives its
+    full size.
+    """
+    with open_image(image_data) as img:
+        width, height = img.size
+        bands = len(img.getbands())
+    # Decoded raster, one converted copy (e.g. alpha flattening) and the
+    # encoded output, plus the upload bytes themselves
+    return width * height * max(bands, 3) * 2 + (input_bytes or len(image_data)) * 2
+
+
+class MemoryBudget:
+    """Blocking byte budget shared by the workers of one batch request"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self, amount):
+        if amount > self.limit:
+            raise Exception(f"Image needs ~{amount // (1024 * 1024)} MB, above the {self.limit // (1024 * 1024)} MB request budget")
+        with self._cond:
+            while self.used + amount > self.limit and not self.closed:
+                self._cond.wait()
+            if self.closed:
+                raise Exception("Batch was cancelled")
+            self.used += amount
+
+    def release(self, amount):
+        with self._cond:
+            self.used -= amount
+            self._cond.notify_all()
+
+    def close(self):
+        # Wake any worker still waiting so the pool can shut down
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+def _convert_batch_item(file, target_format, budget, profile):
+    cancellation.check()
+    image_data = file.read()
+    reserved = estimate_conversion_memory(image_data)
+    budget.acquire(reserved)
+    try:
+        data = convert_image_data(image_data, target_format, profile=profile)
+    except Exception:
+        budget.release(reserved)
+        raise
+    # The reservation is held until the result has been written to the ZIP
+    return output_filename(file.filename, target_format), data, reserved
+
+
+def batch_convert_images(files, target_format, max_workers=None, memory_budget=None, profile=DEFAULT_PROFILE):
+    """Convert many uploads concurrently, yielding (filename, bytes) as each finishes
+
+    Work is spread over a thread pool and admitted against a per-request
+    memory budget estimated from image headers. Files that fail to convert
+    are reported together in an ``errors.txt`` entry at the end.
+    """
+    budget = MemoryBudget(memory_budget or BATCH_MEMORY_BUDGET)
+    errors = []
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or BATCH_MAX_WORKERS)
+    try:
+        futures = {
+            executor.submit(tracing.bind(_convert_batch_item), file, target_format, budget, profile): file.filename
+            for file in files
+        }
+        for future in as_completed(futures):
+            try:
+                filename, data, reserved = future.result()
+            except Exception as e:
+                errors.append(f"{futures[future]}: {str(e)}")
+                continue
+            try:
+                yield filename, data
+            finally:
+                budget.release(reserved)
+    finally:
+        # Drop queued work if the client went away mid-stream
+        budget.close()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    if errors:
+        yield 'errors.txt', "\n".join(errors).encode('utf-8')
@@ -0,0 +1,327 @@
+from PIL import Image, ImageFile
+import io
+import math
+import os
+import struct
+import zlib
+from encoding_profiles import DEFAULT_PROFILE, encode, png_compress_level
+
+# Images above this many pixels are converted strip by strip
+LARGE_IMAGE_PIXELS = int(os.environ.get('LARGE_IMAGE_PIXELS', 40_000_000))
+
+# Upper bound on the pixel data held per strip, across the decoded strip,
+# its converted copy and the resampled output rows
+TILE_BUDGET = int(os.environ.get('TILE_BUDGET_MB', 64)) * 1024 * 1024
+
+# Source modes the strip pipeline knows how to normalize
+TILED_MODES = ['1', 'L', 'LA', 'P', 'PA', 'RGB', 'RGBA', 'CMYK', 'YCbCr']
+
+# Bits per pixel of raw layouts whose stride Pillow leaves implicit
+_RAW_BITS = {
+    '1': 1, 'L': 8, 'P': 8, 'LA': 16, 'RGB': 24, 'BGR': 24,
+    'RGBA': 32, 'RGBX': 32, 'BGRA': 32, 'BGRX': 32, 'CMYK': 32,
+}
+
+# PNG colour types by mode
+_PNG_COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+
+def is_large_image(img):
+    """True if an opened image is big enough to need the strip pipeline"""
+    width, height = img.size
+    return width * height > LARGE_IMAGE_PIXELS
+
+
+def strip_decodable(img):
+    """True if iter_strips can decode img a strip at a time, without loading it whole"""
+    tiles = img.tile
+    if len(tiles) == 1:
+        return tiles[0][0] == 'raw' and _raw_layout(tiles[0], img.size) is not None
+    return len(tiles) > 1 and all(tile[0] != 'libtiff' for tile in tiles)
+
+
+def fit_size(size, max_size):
+    """Shrink size to fit inside max_size, keeping the aspect ratio"""
+    width, height = size
+    if not max_size:
+        return size
+    max_width, max_height = max_size
+    scale = max(width / (max_width or width), height / (max_height or height), 1)
+    return max(1, round(width / scale)), max(1, round(height / scale))
+
+
+def convert_large_image(image_data, target_format, max_size=None, tile_budget=None, profile=DEFAULT_PROFILE):
+    """Convert an image strip by strip, keeping peak memory near tile_budget
+
+    Strips are decoded straight from the file where the layout allows it
+    (uncompressed/striped TIFF, BMP and other raw rasters); other formats are
+    decoded once and then processed in strips. Downscaling uses an integer
+    ``reduce`` per strip followed by a streaming resample, and alpha is
+    flattened strip by strip for JPEG. PNG and BMP outputs are encoded
+    incrementally as strips arrive; other formats are assembled into a
+    single output-sized canvas before encoding.
+    """
+    budget = tile_budget or TILE_BUDGET
+    save_format = 'JPEG' if target_format == 'JPG' else target_format
+
+    img = Image.open(io.BytesIO(image_data))
+    target_size = fit_size(img.size, max_size)
+
+    # JPEG can scale by 1/2, 1/4 or 1/8 while decoding, which is far cheaper
+    # than decoding at full size and reducing afterwards
+    if img.format == 'JPEG' and target_size != img.size:
+        img.draft('RGB' if img.mode not in ('L', 'RGB') else img.mode, target_size)
+
+    work_mode = _working_mode(img)
+    out_mode = work_mode
+    if save_format == 'JPEG' and work_mode in ('LA', 'RGBA'):
+        out_mode = work_mode[:-1]
+
+    width, height = img.size
+    factor = max(1, min(width // target_size[0], height // target_size[1]))
+    reduced_size = (math.ceil(width / factor), math.ceil(height / factor))
+
+    row_bytes = width * len(work_mode) * 3
+    strip_rows = max(factor, (budget // max(row_bytes, 1)) // factor * factor)
+
+    strips = (_normalize(strip, work_mode) for strip in iter_strips(img, image_data, strip_rows))
+    if factor > 1:
+        strips = (strip.reduce(factor) for strip in strips)
+    if reduced_size != target_size:
+        out_rows = max(1, budget // (target_size[0] * len(work_mode) * 3))
+        strips = _StripResampler(reduced_size, target_size, out_rows).resample(strips)
+    if out_mode != work_mode:
+        strips = (_flatten_alpha(strip, out_mode) for strip in strips)
+
+    output = io.BytesIO()
+    if save_format == 'PNG':
+        writer = PngStripWriter(output, target_size, out_mode, png_compress_level(profile))
+    elif save_format == 'BMP' and out_mode == 'RGB':
+        writer = _BmpStripWriter(output, target_size)
+    else:
+        writer = _CanvasWriter(output, target_size, out_mode, save_format, profile)
+    for strip in strips:
+        writer.write(strip)
+    writer.close()
+    return output.getvalue()
+
+
+def iter_strips(img, image_data, strip_rows):
+    """Yield horizontal strips of img, top to bottom, as loaded images"""
+    tiles = img.tile
+    width, height = img.size
+
+    layout = _raw_layout(tiles[0], img.size) if len(tiles) == 1 and tiles[0][0] == 'raw' else None
+    if layout:
+        rawmode, stride, orientation = layout
+        offset = tiles[0][2]
+        for y0 in range(0, height, strip_rows):
+            y1 = min(height, y0 + strip_rows)
+            # Bottom-up rasters (BMP) store the last row first
+            first_row = y0 if orientation >= 0 else height - y1
+            tile = ImageFile._Tile('raw', (0, 0, width, y1 - y0), offset + first_row * stride, (rawmode, stride, orientation))
+            yield _load_region(image_data, (width, y1 - y0), [tile])
+        return
+
+    if len(tiles) > 1 and all(tile[0] != 'libtiff' for tile in tiles):
+        # Striped or tiled files with independently decodable tiles
+        for y0, y1, band in _tile_bands(tiles, strip_rows):
+            shifted = [
+                ImageFile._Tile(tile[0], (tile[1][0], tile[1][1] - y0, tile[1][2], tile[1][3] - y0), tile[2], tile[3])
+                for tile in band
+            ]
+            yield _load_region(image_data, (width, y1 - y0), shifted)
+        return
+
+    # The codec can only decode the whole raster; decode once, hand out strips
+    img.load()
+    for y0 in range(0, height, strip_rows):
+        yield img.crop((0, y0, width, min(height, y0 + strip_rows)))
+
+
+def _raw_layout(tile, size):
+    width, height = size
+    if tuple(tile[1]) != (0, 0, width, height):
+        return None
+    args = tile[3]
+    if isinstance(args, str):
+        args = (args,)
+    rawmode = args[0]
+    stride = args[1] if len(args) > 1 else 0
+    orientation = args[2] if len(args) > 2 else 1
+    if not stride:
+        bits = _RAW_BITS.get(rawmode)
+        if not bits:
+            return None
+        stride = (width * bits + 7) // 8
+    if stride < 0:
+        stride, orientation = -stride, -1
+    return rawmode, stride, orientation
+
+
+def _tile_bands(tiles, strip_rows):
+    # Group tiles into row bands at least strip_rows tall, never splitting a tile
+    ordered = sorted(tiles, key=lambda tile: (tile[1][1], tile[1][0]))
+    band, band_y0, band_y1 = [], None, None
+    for tile in ordered:
+        x0, y0, x1, y1 = tile[1]
+        if band and y0 >= band_y1 and band_y1 - band_y0 >= strip_rows:
+            yield band_y0, band_y1, band
+            band, band_y0, band_y1 = [], None, None
+        if band_y0 is None:
+            band_y0 = y0
+        band.append(tile)
+        band_y1 = max(band_y1 or y1, y1)
+    if band:
+        yield band_y0, band_y1, band
+
+
+def _load_region(image_data, size, tiles):
+    # Re-open the header and point the decoder at just these tiles
+    region = Image.open(io.BytesIO(image_data))
+    region._size = size
+    if hasattr(region, '_tile_size'):
+        # TIFF sizes its decode buffer from the tile size, not the image size
+        region._tile_size = size
+    region.tile = tiles
+    region.load()
+    return region
+
+
+def _working_mode(img):
+    if img.mode in ('1', 'L'):
+        return 'L'
+    if img.mode == 'LA':
+        return 'LA'
+    if img.mode in ('RGBA', 'PA') or 'transparency' in img.info:
+        return 'RGBA'
+    return 'RGB'
+
+
+def _normalize(strip, mode):
+    if strip.mode == mode:
+        return strip
+    if strip.mode == 'P' and mode == 'RGBA':
+        # Palette transparency is only honoured through an RGBA conversion
+        return strip.convert('RGBA')
+    return strip.convert(mode)
+
+
+def _flatten_alpha(strip, mode):
+    flat = Image.new(mode, strip.size, 255 if mode == 'L' else (255, 255, 255))
+    flat.paste(strip, mask=strip.getchannel('A'))
+    return flat
+
+
+class _StripResampler:
+    """Lanczos-resample a stream of strips without holding the whole image
+
+    Keeps a rolling window of source rows wide enough for the filter support
+    and emits output rows once every source row they depend on has arrived.
+    """
+
+    def __init__(self, src_size, dst_size, out_rows):
+        self.src_width, self.src_height = src_size
+        self.dst_width, self.dst_height = dst_size
+        self.scale = self.src_height / self.dst_height
+        self.margin = math.ceil(3 * max(self.scale, 1)) + 2
+        self.out_rows = out_rows
+
+    def resample(self, strips):
+        window, window_y0, next_row = None, 0, 0
+        for strip in strips:
+            window = strip if window is None else _stack(window, strip)
+            window_y1 = window_y0 + window.height
+            while next_row < self.dst_height:
+                end_row = min(self.dst_height, next_row + self.out_rows)
+                needed = min(self.src_height, math.ceil(end_row * self.scale) + self.margin)
+                if needed > window_y1:
+                    break
+                yield self._rows(window, window_y0, next_row, end_row)
+                next_row = end_row
+            keep_from = max(window_y0, math.floor(next_row * self.scale) - self.margin)
+            if keep_from > window_y0:
+                window = window.crop((0, keep_from - window_y0, self.src_width, window.height))
+                window_y0 = keep_from
+        while window is not None and next_row < self.dst_height:
+            end_row = min(self.dst_height, next_row + self.out_rows)
+            yield self._rows(window, window_y0, next_row, end_row)
+            next_row = end_row
+
+    def _rows(self, window, window_y0, start_row, end_row):
+        # Pillow samples outside the box (within the window) for filter
+        # support, so neighbouring output strips join without seams
+        box = (0, start_row * self.scale - window_y0, self.src_width, end_row * self.scale - window_y0)
+        return window.resize((self.dst_width, end_row - start_row), Image.LANCZOS, box=box)
+
+
+def _stack(top, bottom):
+    stacked = Image.new(top.mode, (top.width, top.height + bottom.height))
+    stacked.paste(top, (0, 0))
+    stacked.paste(bottom, (0, top.height))
+    return stacked
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+class PngStripWriter:
+    """Incremental PNG encoder: one zlib stream fed a strip at a time"""
+
+    def __init__(self, output, size, mode, compress_level=6):
+        self.output = output
+        self.row_bytes = size[0] * len(mode)
+        self.compressor = zlib.compressobj(compress_level)
+        output.write(b'\x89PNG\r\n\x1a\n')
+        output.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, _PNG_COLOR_TYPES[mode], 0, 0, 0)))
+
+    def write(self, strip):
+        raw = strip.tobytes()
+        # Filter type 0 on every scanline
+        rows = b''.join(b'\x00' + raw[i:i + self.row_bytes] for i in range(0, len(raw), self.row_bytes))
+        data = self.compressor.compress(rows)
+        if data:
+            self.output.write(_png_chunk(b'IDAT', data))
+
+    def close(self):
+        self.output.write(_png_chunk(b'IDAT', self.compressor.flush()))
+        self.output.write(_png_chunk(b'IEND', b''))
+
+
+class _BmpStripWriter:
+    """Incremental top-down 24-bit BMP encoder"""
+
+    def __init__(self, output, size):
+        self.output = output
+        width, height = size
+        self.stride = (width * 3 + 3) & ~3
+        image_size = self.stride * height
+        output.write(b'BM' + struct.pack('<IHHI', 14 + 40 + image_size, 0, 0, 14 + 40))
+        # A negative height marks the rows as stored top to bottom
+        output.write(struct.pack('<IiiHHIIiiII', 40, width, -height, 1, 24, 0, image_size, 2835, 2835, 0, 0))
+
+    def write(self, strip):
+        self.output.write(strip.tobytes('raw', ('BGR', self.stride)))
+
+    def close(self):
+        pass
+
+
+class _CanvasWriter:
+    """Paste strips into one output-sized image and encode it at the end"""
+
+    def __init__(self, output, size, mode, save_format, profile):
+        self.output = output
+        self.canvas = Image.new(mode, size)
+        self.save_format = save_format
+        self.profile = profile
+        self.y = 0
+
+    def write(self, strip):
+        self.canvas.paste(strip, (0, self.y))
+        self.y += strip.height
+
+    def close(self):
+        encode(self.canvas, self.output, self.save_format, self.profile)
+        self.canvas = None
@@ -0,0 +1,65 @@
+import struct
+
+# JPEG APPn segments that change how pixels are rendered and must survive a
+# metadata strip: APP0 (JFIF), APP2 (ICC profile) and APP14 (Adobe transform)
+_JPEG_KEEP_APP = {0xE0, 0xE2, 0xEE}
+
+# PNG ancillary chunks that carry only metadata
+_PNG_METADATA_CHUNKS = {b'tEXt', b'zTXt', b'iTXt', b'eXIf', b'tIME'}
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def strip_jpeg_metadata(data):
+    """Drop EXIF/XMP/IPTC/comment segments from a JPEG without decoding it
+
+    Everything from the start-of-scan marker onwards, i.e. the entropy-coded
+    image data, is copied byte for byte.
+    """
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("Not a JPEG stream")
+    out = [b'\xff\xd8']
+    pos = 2
+    while pos < len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("Corrupt JPEG marker stream")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            pos += 1
+            continue
+        if marker == 0xDA:
+            out.append(data[pos:])
+            break
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        segment = data[pos:pos + 2 + length]
+        is_app = 0xE0 <= marker <= 0xEF
+        if not (marker == 0xFE or (is_app and marker not in _JPEG_KEEP_APP)):
+            out.append(segment)
+        pos += 2 + length
+    return b''.join(out)
+
+
+def strip_png_metadata(data):
+    """Drop text, EXIF and timestamp chunks from a PNG without decoding it"""
+    if data[:8] != _PNG_SIGNATURE:
+        raise ValueError("Not a PNG stream")
+    out = [_PNG_SIGNATURE]
+    pos = 8
+    while pos < len(data):
+        length = struct.unpack('>I', data[pos:pos + 4])[0]
+        chunk_type = data[pos + 4:pos + 8]
+        end = pos + 12 + length
+        if chunk_type not in _PNG_METADATA_CHUNKS:
+            out.append(data[pos:end])
+        pos = end
+        if chunk_type == b'IEND':
+            break
+    return b''.join(out)
+
+
+# Lossless metadata strippers by source format
+METADATA_STRIPPERS = {
+    'JPEG': strip_jpeg_metadata,
+    'PNG': strip_png_metadata,
+}
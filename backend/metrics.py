@@ -0,0 +1,227 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+import tracing
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Stages recorded by the converters: upload read, PDF parse, page render,
+# image preprocessing for OCR, tesseract, image/document encode and ZIP
+# packaging
+STAGES = ['read', 'parse', 'render', 'preprocess', 'ocr', 'encode', 'zip']
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic total, per label set"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, per label set"""
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets, per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, [("le", le)])} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency until the last byte of the response was sent',
+    ['route', 'method', 'status'])
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests being handled or streamed', ['route'])
+REQUEST_BYTES = Counter('http_request_bytes_total', 'Request body bytes received', ['route'])
+RESPONSE_BYTES = Counter('http_response_bytes_total', 'Response body bytes sent', ['route'])
+PAGES_PROCESSED = Counter('pages_processed_total', 'PDF pages and images processed', ['operation'])
+STAGE_DURATION = Histogram('stage_duration_seconds', 'Time spent in each conversion stage', ['route', 'stage'])
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one occurrence of a conversion stage of the current route"""
+    trace = tracing.current_trace()
+    route = trace.route if trace else 'none'
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_DURATION.observe(seconds, route=route, stage=name)
+        tracing.record_span(name, seconds)
+
+
+def count_pages(operation, count=1):
+    """Add to the pages processed by an operation"""
+    PAGES_PROCESSED.inc(count, operation=operation)
+    tracing.record_pages(count)
+
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class _SentBody:
+    """Response body wrapper that calls done(bytes_sent) when the server closes it
+
+    That happens after the last byte of a streamed body, when the client
+    goes away, and for bodies never sent (HEAD); file responses skip Flask's
+    own close callbacks.
+    """
+
+    def __init__(self, body, done):
+        self._body = body
+        self._done = done
+        self._sent = 0
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._sent += len(chunk)
+            yield chunk
+
+    def __len__(self):
+        # Keeps Response.is_streamed false for buffered bodies
+        return len(self._body)
+
+    def close(self):
+        done, self._done = self._done, None
+        if done is None:
+            return
+        try:
+            close = getattr(self._body, 'close', None)
+            if close:
+                close()
+        finally:
+            done(self._sent)
+
+
+def call_when_sent(response, done):
+    """Arrange for done(bytes_sent) to run once the server has finished with response"""
+    response.response = _SentBody(response.response, done)
+
+
+def instrument_app(app):
+    """Record latency, in-flight requests and body sizes for every route of app
+
+    Each request is also traced: responses carry Server-Timing and
+    X-Trace-Id headers, and a JSON line is exported once the body is sent.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_metrics():
+        g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+        g.metrics_start = time.perf_counter()
+        g.trace = tracing.start_trace(g.metrics_route, request.method)
+        REQUESTS_IN_FLIGHT.inc(route=g.metrics_route)
+        if request.content_length:
+            REQUEST_BYTES.inc(request.content_length, route=g.metrics_route)
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        route = g.get('metrics_route')
+        if route is None:
+            return response
+        start, method, status = g.metrics_start, request.method, str(response.status_code)
+        trace, request_bytes = g.trace, request.content_length
+
+        # Streamed bodies are produced after the headers go out, so their
+        # header only covers the work done before the first byte
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['X-Trace-Id'] = trace.id
+
+        def done(sent):
+            REQUEST_LATENCY.observe(time.perf_counter() - start, route=route, method=method, status=status)
+            RESPONSE_BYTES.inc(sent, route=route)
+            REQUESTS_IN_FLIGHT.dec(route=route)
+            tracing.finish_trace(trace, response.status_code, request_bytes, sent)
+
+        call_when_sent(response, done)
+        return response
@@ -2,7 +2,17 @@ import pytesseract
 from PIL import Image
 import io
 import os
+import shlex
+import subprocess
 import sys
+import tempfile
+import threading
+from ocr_preprocess import BINARIZE_METHODS, map_box_to_source, preprocess_with_transform
+from ocr_results import map_page, page_text, parse_tsv
+from metrics import count_pages, stage
+import cancellation
+from resource_guard import ResourceLimitError, check_image
+import tracing
 
 # Try to set Tesseract path for Windows if needed
 # Common Windows installation paths
@@ -67,57 +77,315 @@ LANGUAGE_MAP = {
     'urdu': 'urd',
 }
 
-def extract_text_from_image(image_file, language='english'):
+# Tesseract settings used for uploaded images
+DEFAULT_CONFIG = r'--oem 3 --psm 6'
+
+# Images handed to a single tesseract process. Tesseract loads its model once
+# per process, so larger batches amortize start-up; the batch size bounds the
+# temporary files kept on disk.
+OCR_BATCH_SIZE = int(os.environ.get('OCR_BATCH_SIZE', 32))
+
+# Clean up and rescale uploads before OCR (see ocr_preprocess.py)
+OCR_PREPROCESS = os.environ.get('OCR_PREPROCESS', '1') != '0'
+OCR_BINARIZE = os.environ.get('OCR_BINARIZE', 'otsu')
+if OCR_BINARIZE not in BINARIZE_METHODS:
+    OCR_BINARIZE = 'otsu'
+
+# Tesseract's default separator between pages in list mode text output
+_PAGE_SEPARATOR = '\f'
+
+class LanguageError(ValueError):
+    """The requested OCR language is unknown or its pack is not installed"""
+
+
+class TesseractNotInstalledError(Exception):
+    """The tesseract binary could not be run"""
+
+
+# Installed traineddata, discovered once per tesseract binary
+_language_cache = {}
+_language_lock = threading.Lock()
+
+
+def discover_languages(refresh=False):
     """
-    Extract text from image using OCR
-    
+    Ask tesseract which language packs are installed
+
+    The result is cached per tesseract binary and rediscovered when refresh
+    is set (e.g. after installing a pack or upgrading without a restart). A
+    missing binary is not cached, so installing tesseract takes effect on
+    the next call.
+
+    Returns:
+        Dict with 'version' (None if tesseract is missing) and 'codes',
+        the set of installed language codes
+    """
+    cmd = pytesseract.pytesseract.tesseract_cmd
+    with _language_lock:
+        cached = _language_cache.get(cmd)
+        if cached is not None and not refresh:
+            return cached
+
+        try:
+            version_proc = subprocess.run([cmd, '--version'], capture_output=True, stdin=subprocess.DEVNULL)
+        except OSError:
+            _language_cache.pop(cmd, None)
+            return {'version': None, 'codes': set()}
+        output = (version_proc.stdout or version_proc.stderr).decode('utf-8', 'replace')
+        version = output.split('\n', 1)[0].replace('tesseract', '').strip() or 'unknown'
+
+        langs_proc = subprocess.run([cmd, '--list-langs'], capture_output=True, stdin=subprocess.DEVNULL)
+        # Tesseract 3.x prints the list to stderr
+        listing = (langs_proc.stdout + langs_proc.stderr).decode('utf-8', 'replace')
+        codes = set()
+        for line in listing.splitlines()[1:]:
+            code = line.strip()
+            # osd only detects orientation and script, it cannot recognize text
+            if code and ' ' not in code and code != 'osd':
+                codes.add(code)
+
+        result = {'version': version, 'codes': codes}
+        _language_cache[cmd] = result
+        return result
+
+
+def resolve_language(language):
+    """
+    Translate a language selection into a tesseract code and check it is installed
+
+    Accepts names ('hindi'), codes ('hin') and '+'-separated combinations of
+    either ('english+hindi', 'eng+hin'). Runs before any OCR so a missing
+    pack fails fast instead of costing a wasted tesseract run.
+
+    Raises:
+        LanguageError: unknown language or language pack not installed
+        TesseractNotInstalledError: tesseract could not be run
+    """
+    installed = discover_languages()
+    if installed['version'] is None:
+        raise TesseractNotInstalledError("Tesseract OCR is not installed. Please install Tesseract OCR from https://github.com/tesseract-ocr/tesseract")
+
+    codes = []
+    for part in (language or 'english').lower().split('+'):
+        part = part.strip()
+        code = LANGUAGE_MAP.get(part, part)
+        if code not in installed['codes']:
+            if code in LANGUAGE_MAP.values():
+                raise LanguageError(f"Language pack not installed: {part}. Installed languages: {', '.join(get_supported_languages())}")
+            raise LanguageError(f"Unsupported language: {part}. Supported languages: {', '.join(get_supported_languages())}")
+        if code not in codes:
+            codes.append(code)
+    return '+'.join(codes)
+
+
+def image_to_string_batch(images, lang='eng', config='', batch_size=None, threads=None):
+    """
+    OCR many images with one tesseract invocation per batch
+
+    Tesseract's list mode reads a text file of image paths and recognizes
+    them all in one process, so the traineddata model is loaded once per
+    batch instead of once per image. Images are written to temporary files
+    as they are consumed, so a generator of rendered pages is never held in
+    memory at once.
+
     Args:
-        image_file: File object containing the image
-        language: Language name (e.g., 'english', 'hindi')
-    
+        images: iterable of PIL images
+        lang: Tesseract language code (e.g., 'eng', 'eng+hin')
+        config: extra tesseract command-line options
+        threads: cap on tesseract's own worker threads, for callers that
+            already run several tesseract processes side by side
+
     Returns:
-        Extracted text string
+        List of extracted text strings, in input order
+    """
+    return _run_batches(images, lang, config, batch_size, 'txt', threads)
+
+
+def image_to_data_batch(images, lang='eng', config='', batch_size=None, threads=None):
     """
+    Like image_to_string_batch, but returns word boxes and confidences
+
+    A single tesseract pass in TSV mode yields everything text, hOCR,
+    layout and searchable PDF output need (see ocr_results.py).
+
+    Returns:
+        List of page dicts ('size' and 'words'), in input order
+    """
+    return _run_batches(images, lang, config, batch_size, 'tsv', threads)
+
+
+def _run_batches(images, lang, config, batch_size, output, threads=None):
+    batch_size = batch_size or OCR_BATCH_SIZE
+    results = []
+    with tempfile.TemporaryDirectory(prefix='ocr_batch_') as tmp_dir:
+        paths = []
+        for img in images:
+            cancellation.check()
+            path = os.path.join(tmp_dir, f'{len(paths):05d}.png')
+            # Fast PNG: tesseract only needs lossless pixels, not a small file
+            with stage('encode'):
+                img.save(path, format='PNG', compress_level=1)
+            paths.append(path)
+            if len(paths) == batch_size:
+                results.extend(_run_tesseract_list(paths, lang, config, tmp_dir, output, threads))
+                paths = []
+        if paths:
+            results.extend(_run_tesseract_list(paths, lang, config, tmp_dir, output, threads))
+    return results
+
+
+def _run_tesseract_list(paths, lang, config, tmp_dir, output='txt', threads=None):
+    list_path = os.path.join(tmp_dir, 'pages.txt')
+    with open(list_path, 'w', encoding='utf-8') as list_file:
+        list_file.write('\n'.join(paths) + '\n')
+
+    cmd = [pytesseract.pytesseract.tesseract_cmd, list_path, 'stdout', '-l', lang] + shlex.split(config)
+    if output == 'tsv':
+        cmd.append('tsv')
+    env = None
+    if threads:
+        env = dict(os.environ, OMP_THREAD_LIMIT=str(threads))
+    tracing.observe('ocr_batch_images', len(paths))
+    try:
+        with stage('ocr'):
+            # Killed if the request is cancelled while tesseract runs
+            proc = cancellation.run_process(cmd, env=env)
+    except FileNotFoundError:
+        raise pytesseract.TesseractNotFoundError()
+    if proc.returncode != 0:
+        raise pytesseract.TesseractError(proc.returncode, proc.stderr.decode('utf-8', 'replace'))
+
+    stdout = proc.stdout.decode('utf-8', 'replace')
+    if output == 'tsv':
+        # page_num counts images within the list
+        pages = parse_tsv(stdout)
+    else:
+        # One separator follows every page
+        pages = stdout.split(_PAGE_SEPARATOR)[:-1]
+    if len(pages) == len(paths):
+        for path in paths:
+            os.remove(path)
+        return pages
+
+    # Older tesseract builds without page separators: fall back to one
+    # process per image rather than guessing where pages end
+    results = []
+    for path in paths:
+        cancellation.check()
+        with stage('ocr'):
+            if output == 'tsv':
+                results.extend(parse_tsv(pytesseract.image_to_data(path, lang=lang, config=config)))
+            else:
+                results.append(pytesseract.image_to_string(path, lang=lang, config=config))
+        os.remove(path)
+    return results
+
+
+def extract_layout_from_images(image_files, language='english', preprocess=None):
+    """
+    OCR several images once, keeping word boxes and confidences
+
+    Boxes are mapped back from the preprocessed images onto the uploaded
+    ones, so the result can be laid over the originals (searchable PDF).
+
+    Args:
+        image_files: File objects containing the images
+        language: Language name or code, or a '+' combination (e.g., 'english', 'eng+hin')
+        preprocess: binarize, deskew, crop and rescale before OCR
+            (defaults to OCR_PREPROCESS)
+
+    Returns:
+        Dict with 'language' (tesseract code) and 'pages', one per image
+        (see ocr_results.parse_tsv for the page format)
+    """
+    if preprocess is None:
+        preprocess = OCR_PREPROCESS
+    # Validated up front: raises ValueError before any image is decoded
+    lang_code = resolve_language(language)
+    geometry = []
     try:
-        # Read image
-        image_data = image_file.read()
-        image_file.seek(0)  # Reset file pointer
-        
-        # Open image with PIL
-        img = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if necessary
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Get Tesseract language code
-        lang_code = LANGUAGE_MAP.get(language.lower(), 'eng')
-        
-        # Try to extract text with error handling
         try:
-            # Use config for better accuracy
-            custom_config = r'--oem 3 --psm 6'
-            text = pytesseract.image_to_string(img, lang=lang_code, config=custom_config)
+            pages = image_to_data_batch(_prepare_images(image_files, preprocess, geometry), lang=lang_code, config=DEFAULT_CONFIG)
         except pytesseract.TesseractNotFoundError:
             raise Exception("Tesseract OCR is not installed. Please install Tesseract OCR from https://github.com/tesseract-ocr/tesseract")
         except pytesseract.TesseractError as e:
-            # If language pack not found, try with English
-            if 'Error' in str(e) or 'not found' in str(e).lower():
-                if lang_code != 'eng':
-                    text = pytesseract.image_to_string(img, lang='eng', config=custom_config)
-                else:
-                    raise Exception(f"OCR error: {str(e)}")
+            raise Exception(f"OCR processing error: {str(e)}")
+
+        mapped = []
+        for page, (size, transform) in zip(pages, geometry):
+            if transform is None:
+                mapped.append(map_page(page, size, tuple))
             else:
-                raise Exception(f"OCR processing error: {str(e)}")
-        
-        return text.strip() if text else ""
-    
+                mapped.append(map_page(page, size, lambda box, t=transform: map_box_to_source(box, t)))
+        return {'language': lang_code, 'pages': mapped}
+
+    except ResourceLimitError:
+        raise
     except Exception as e:
         error_msg = str(e)
         if 'Tesseract' in error_msg or 'tesseract' in error_msg.lower():
             raise Exception(f"Tesseract OCR error: {error_msg}. Please ensure Tesseract OCR is installed and in your system PATH.")
         raise Exception(f"OCR extraction failed: {error_msg}")
 
+
+def extract_text_from_images(image_files, language='english', preprocess=None):
+    """
+    Extract text from several images using one OCR process per batch
+
+    Args:
+        image_files: File objects containing the images
+        language: Language name or code, or a '+' combination (e.g., 'english', 'eng+hin')
+        preprocess: binarize, deskew, crop and rescale before OCR
+            (defaults to OCR_PREPROCESS)
+
+    Returns:
+        List of extracted text strings, in input order
+    """
+    result = extract_layout_from_images(image_files, language, preprocess)
+    return [page_text(page) for page in result['pages']]
+
+
+def _prepare_images(image_files, preprocess, geometry):
+    # Appends (source size, transform) per image so boxes can be mapped back
+    for image_file in image_files:
+        # Read image
+        with stage('read'):
+            image_data = image_file.read()
+        image_file.seek(0)  # Reset file pointer
+        count_pages('ocr_image')
+
+        # Open image with PIL, once its header shows it fits the decode budget
+        check_image(image_data)
+        img = Image.open(io.BytesIO(image_data))
+
+        if preprocess:
+            # Binarized, deskewed and sized for tesseract
+            with stage('preprocess'):
+                prepared, transform = preprocess_with_transform(img, method=OCR_BINARIZE)
+            geometry.append((img.size, transform))
+            yield prepared
+            continue
+
+        # Convert to RGB if necessary
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        geometry.append((img.size, None))
+        yield img
+
+
+def extract_text_from_image(image_file, language='english'):
+    """
+    Extract text from image using OCR
+    
+    Args:
+        image_file: File object containing the image
+        language: Language name (e.g., 'english', 'hindi')
+    
+    Returns:
+        Extracted text string
+    """
+    return extract_text_from_images([image_file], language)[0]
+
 def create_text_file(text, filename='extracted_text.txt'):
     """Create a text file from extracted text"""
     text_buffer = io.BytesIO()
@@ -154,6 +422,20 @@ def create_word_file(text, filename='extracted_text.docx'):
     return doc_buffer
 
 def get_supported_languages():
-    """Get list of supported languages"""
-    return list(LANGUAGE_MAP.keys())
+    """Get list of languages whose packs are installed"""
+    installed = discover_languages()['codes']
+    return [name for name, code in LANGUAGE_MAP.items() if code in installed]
+
+
+def get_language_report(refresh=False):
+    """Installed, unavailable and extra language packs plus the tesseract version"""
+    installed = discover_languages(refresh)
+    known = set(LANGUAGE_MAP.values())
+    return {
+        'languages': [name for name, code in LANGUAGE_MAP.items() if code in installed['codes']],
+        'unavailable': [name for name, code in LANGUAGE_MAP.items() if code not in installed['codes']],
+        'codes': sorted(installed['codes']),
+        'other_codes': sorted(installed['codes'] - known),
+        'tesseract_version': installed['version'],
+    }
 
@@ -0,0 +1,281 @@
+import numpy as np
+from PIL import Image
+
+# Height in pixels of a line's ink that tesseract reads most reliably. Its
+# accuracy peaks with capital letters around 30 px tall (10 pt text at
+# 300 dpi); larger text only costs time, smaller text costs accuracy.
+TARGET_LINE_HEIGHT = 32
+
+# Never rescale by more than this, in either direction
+MAX_SCALE = 4.0
+
+# Render resolution bounds for adaptive PDF rendering
+MIN_DPI = 100
+MAX_DPI = 400
+PROBE_DPI = 72
+
+# Skew angles searched by estimate_skew, in degrees
+MAX_SKEW = 5.0
+SKEW_STEP = 0.25
+
+BINARIZE_METHODS = ['otsu', 'sauvola', 'none']
+
+
+def to_grayscale(img):
+    """Return an 8-bit grayscale array for any PIL image"""
+    if img.mode != 'L':
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # Transparent areas are paper, not ink
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            rgba = img.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            img = background
+        img = img.convert('L')
+    return np.asarray(img, dtype=np.uint8)
+
+
+def otsu_threshold(gray):
+    """Global threshold maximizing between-class variance of the histogram"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256, dtype=np.float64)
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    cum_mean = np.cumsum(hist * levels)
+    mean_bg = cum_mean / np.maximum(weight_bg, 1)
+    mean_fg = (cum_mean[-1] - cum_mean) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between))
+
+
+def binarize_otsu(gray):
+    """True where a pixel is ink, using a single Otsu threshold"""
+    return gray <= otsu_threshold(gray)
+
+
+def binarize_sauvola(gray, window=25, k=0.2, dynamic_range=128.0):
+    """True where a pixel is ink, using Sauvola's local threshold
+
+    Local means and deviations come from integral images, so the cost is a
+    handful of array passes regardless of the window size. Handles uneven
+    lighting and shadows that defeat a global threshold.
+    """
+    img = gray.astype(np.float64)
+    half = window // 2
+    padded = np.pad(img, half + 1, mode='edge')
+    integral = padded.cumsum(0).cumsum(1)
+    integral_sq = (padded ** 2).cumsum(0).cumsum(1)
+
+    height, width = gray.shape
+    y0, x0 = np.arange(height), np.arange(width)
+    y1, x1 = y0 + window, x0 + window
+
+    def window_sum(table):
+        return (table[np.ix_(y1, x1)] - table[np.ix_(y0, x1)]
+                - table[np.ix_(y1, x0)] + table[np.ix_(y0, x0)])
+
+    area = float(window * window)
+    mean = window_sum(integral) / area
+    variance = np.maximum(window_sum(integral_sq) / area - mean ** 2, 0)
+    threshold = mean * (1 + k * (np.sqrt(variance) / dynamic_range - 1))
+    return img <= threshold
+
+
+def binarize(gray, method='otsu'):
+    """Ink mask for a grayscale array using one of BINARIZE_METHODS"""
+    if method == 'sauvola':
+        return binarize_sauvola(gray)
+    return binarize_otsu(gray)
+
+
+def estimate_skew(ink, max_angle=MAX_SKEW, step=SKEW_STEP, max_points=200_000):
+    """Estimate page skew in degrees from the ink mask
+
+    Projects a sample of ink pixels onto the vertical axis at each candidate
+    angle; text lines line up, and the row histogram is sharpest, at the
+    true skew.
+    """
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > max_points:
+        pick = np.random.default_rng(0).choice(len(ys), max_points, replace=False)
+        ys, xs = ys[pick], xs[pick]
+    ys = ys.astype(np.float64)
+    xs = xs.astype(np.float64)
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        theta = np.deg2rad(angle)
+        rows = np.round(ys * np.cos(theta) - xs * np.sin(theta)).astype(np.int64)
+        hist = np.bincount(rows - rows.min())
+        score = float(np.sum(np.diff(hist.astype(np.float64)) ** 2))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def content_bbox(ink, margin=10, border_fill=0.8):
+    """Bounding box (left, top, right, bottom) of the text area
+
+    Rows and columns that are almost entirely ink are scanner borders or
+    book gutters, not text, and are ignored.
+    """
+    height, width = ink.shape
+    row_fill = ink.mean(axis=1)
+    col_fill = ink.mean(axis=0)
+    rows = np.nonzero((row_fill > 0) & (row_fill < border_fill))[0]
+    cols = np.nonzero((col_fill > 0) & (col_fill < border_fill))[0]
+    if len(rows) == 0 or len(cols) == 0:
+        return 0, 0, width, height
+    # Ignore the dark border band itself when it touches the edge
+    inner = ink[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1].copy()
+    inner[:, col_fill[cols[0]:cols[-1] + 1] >= border_fill] = False
+    inner[row_fill[rows[0]:rows[-1] + 1] >= border_fill, :] = False
+    ys, xs = np.nonzero(inner)
+    if len(ys) == 0:
+        return 0, 0, width, height
+    top, bottom = rows[0] + ys.min(), rows[0] + ys.max() + 1
+    left, right = cols[0] + xs.min(), cols[0] + xs.max() + 1
+    return (max(0, left - margin), max(0, top - margin),
+            min(width, right + margin), min(height, bottom + margin))
+
+
+def _longest_runs(ink):
+    # Longest run of consecutive ink pixels in each row of ink
+    edges = np.diff(np.pad(ink, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    start_rows, start_cols = np.nonzero(edges == 1)
+    _, end_cols = np.nonzero(edges == -1)
+    longest = np.zeros(ink.shape[0], dtype=np.int64)
+    np.maximum.at(longest, start_rows, end_cols - start_cols)
+    return longest
+
+
+def remove_rules(ink, rule_length=0.5):
+    """Copy of ink without rules and frames
+
+    Columns with an unbroken ink run over rule_length of the height
+    (vertical rules, frame sides) and rows with one over rule_length of the
+    width (horizontal rules) are cleared; text never runs that far.
+    """
+    height, width = ink.shape
+    if not height or not width:
+        return ink
+    ink = ink.copy()
+    ink[:, _longest_runs(ink.T) > rule_length * height] = False
+    ink[_longest_runs(ink) > rule_length * width, :] = False
+    return ink
+
+
+def estimate_line_height(ink):
+    """Median height in pixels of text lines, or None if no lines are found
+
+    Rules and frames are ignored; a vertical one would otherwise join every
+    row into a single line.
+    """
+    rows = remove_rules(ink).any(axis=1).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], rows, [0])))
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0]
+    heights = ends - starts
+    # Ignore specks and rules a couple of pixels tall
+    heights = heights[heights >= 4]
+    if len(heights) == 0:
+        return None
+    return float(np.median(heights))
+
+
+def choose_scale(line_height):
+    """Resize factor that brings text lines to TARGET_LINE_HEIGHT"""
+    if not line_height:
+        return 1.0
+    return float(np.clip(TARGET_LINE_HEIGHT / line_height, 1 / MAX_SCALE, MAX_SCALE))
+
+
+def choose_dpi(page, clip=None):
+    """Pick a render DPI for a PDF page from the text size seen at PROBE_DPI"""
+    pix = page.get_pixmap(dpi=PROBE_DPI, clip=clip, colorspace='gray')
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+    ink = binarize_otsu(gray)
+    # Lines are measured inside the text area, as preprocessing crops it
+    left, top, right, bottom = content_bbox(ink)
+    line_height = estimate_line_height(ink[top:bottom, left:right])
+    if not line_height:
+        return MAX_DPI
+    dpi = PROBE_DPI * TARGET_LINE_HEIGHT / line_height
+    return int(np.clip(dpi, MIN_DPI, MAX_DPI))
+
+
+def preprocess_for_ocr(img, method='otsu', deskew=True, crop=True, rescale=True):
+    """Turn a page image into the smallest clean image tesseract reads well
+
+    Converts to grayscale, binarizes, removes skew, crops to the text area
+    and scales so text lines are about TARGET_LINE_HEIGHT pixels tall.
+    Returns a mode 'L' image with black text on white.
+    """
+    return preprocess_with_transform(img, method, deskew, crop, rescale)[0]
+
+
+def preprocess_with_transform(img, method='otsu', deskew=True, crop=True, rescale=True):
+    """preprocess_for_ocr that also returns the geometry it applied
+
+    The transform dict lets map_box_to_source place word boxes found in the
+    preprocessed image back on the original.
+    """
+    gray = to_grayscale(img)
+    if method == 'none':
+        ink = binarize_otsu(gray)
+        cleaned = gray
+    else:
+        ink = binarize(gray, method)
+        cleaned = np.where(ink, 0, 255).astype(np.uint8)
+
+    left, top = 0, 0
+    if crop:
+        left, top, right, bottom = content_bbox(ink)
+        ink = ink[top:bottom, left:right]
+        cleaned = cleaned[top:bottom, left:right]
+
+    result = Image.fromarray(cleaned, mode='L')
+    transform = {'offset': (int(left), int(top)), 'cropped_size': result.size,
+                 'angle': 0.0, 'rotated_size': result.size, 'scale': (1.0, 1.0)}
+
+    if deskew:
+        angle = estimate_skew(ink)
+        if angle:
+            # estimate_skew measures the slope in image coordinates (y down);
+            # PIL rotates counter-clockwise, which levels a positive slope
+            result = result.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=255)
+            ink = np.asarray(result) < 128
+            transform['angle'] = angle
+            transform['rotated_size'] = result.size
+
+    if rescale:
+        scale = choose_scale(estimate_line_height(ink))
+        if abs(scale - 1.0) > 0.1:
+            size = (max(1, round(result.width * scale)), max(1, round(result.height * scale)))
+            transform['scale'] = (size[0] / result.width, size[1] / result.height)
+            result = result.resize(size, Image.LANCZOS if scale < 1 else Image.BICUBIC)
+
+    return result, transform
+
+
+def map_box_to_source(box, transform):
+    """Map a (left, top, width, height) box from a preprocessed image to the original"""
+    left, top, width, height = box
+    scale_x, scale_y = transform['scale']
+    xs = np.array([left, left + width, left + width, left]) / scale_x
+    ys = np.array([top, top, top + height, top + height]) / scale_y
+
+    if transform['angle']:
+        # Undo the counter-clockwise rotation about the image centre
+        theta = np.deg2rad(transform['angle'])
+        rotated_w, rotated_h = transform['rotated_size']
+        cropped_w, cropped_h = transform['cropped_size']
+        dx, dy = xs - rotated_w / 2, ys - rotated_h / 2
+        xs = dx * np.cos(theta) - dy * np.sin(theta) + cropped_w / 2
+        ys = dx * np.sin(theta) + dy * np.cos(theta) + cropped_h / 2
+
+    offset_x, offset_y = transform['offset']
+    x0, y0 = xs.min() + offset_x, ys.min() + offset_y
+    return (int(round(x0)), int(round(y0)),
+            int(round(xs.max() - xs.min())), int(round(ys.max() - ys.min())))
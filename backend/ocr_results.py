@@ -0,0 +1,295 @@
+import gzip
+import html
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+import fitz  # PyMuPDF
+from PIL import Image
+from resource_guard import check_image
+
+# Structured OCR results are kept on disk so text, DOCX, hOCR, layout and
+# searchable PDF downloads can all be produced without running tesseract again
+OCR_RESULT_DIR = os.environ.get('OCR_RESULT_DIR', os.path.join(tempfile.gettempdir(), 'ocr_results'))
+OCR_RESULT_TTL = int(os.environ.get('OCR_RESULT_TTL', 3600))
+
+OCR_OUTPUT_FORMATS = ['txt', 'docx', 'pdf', 'hocr', 'json']
+
+# Each word is stored as a flat list in this field order
+WORD_FIELDS = ['left', 'top', 'width', 'height', 'conf', 'block', 'par', 'line', 'text']
+
+# Resolution assumed for images that do not record one
+DEFAULT_IMAGE_DPI = 300
+
+_RESULT_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def parse_tsv(tsv):
+    """
+    Parse tesseract TSV output into one page dict per page
+
+    Each page holds 'size' ([width, height] in pixels) and 'words', a list
+    of [left, top, width, height, conf, block, par, line, text] lists.
+    Pages are returned in page_num order.
+    """
+    pages = {}
+    for row in tsv.splitlines()[1:]:
+        cols = row.split('\t', 11)
+        if len(cols) < 11:
+            continue
+        level, page_num = int(cols[0]), int(cols[1])
+        page = pages.setdefault(page_num, {'size': [0, 0], 'words': []})
+        if level == 1:
+            page['size'] = [int(cols[8]), int(cols[9])]
+            continue
+        text = cols[11].strip() if len(cols) > 11 else ''
+        if level != 5 or not text:
+            continue
+        page['words'].append([
+            int(cols[6]), int(cols[7]), int(cols[8]), int(cols[9]),
+            round(float(cols[10])), int(cols[2]), int(cols[3]), int(cols[4]), text,
+        ])
+    return [pages[num] for num in sorted(pages)]
+
+
+def map_page(page, size, map_box):
+    """Copy of a page with every word box passed through map_box, sized to size"""
+    words = [list(map_box(word[:4])) + word[4:] for word in page['words']]
+    return {'size': list(size), 'words': words}
+
+
+def iter_lines(page):
+    """Yield (block, words) for each text line of a page, in reading order"""
+    current_key, current = None, []
+    for word in page['words']:
+        key = (word[5], word[6], word[7])
+        if key != current_key and current:
+            yield current_key[0], current
+            current = []
+        current_key = key
+        current.append(word)
+    if current:
+        yield current_key[0], current
+
+
+def page_text(page):
+    """Plain text of a page: one line per text line, blank line between blocks"""
+    lines, last_block = [], None
+    for block, words in iter_lines(page):
+        if last_block is not None and block != last_block:
+            lines.append('')
+        lines.append(' '.join(word[8] for word in words))
+        last_block = block
+    return '\n'.join(lines)
+
+
+def result_text(result):
+    """Plain text of every page, pages separated by a blank line"""
+    return '\n\n'.join(page_text(page) for page in result['pages']).strip()
+
+
+def mean_confidence(result):
+    """Average word confidence (0-100), or None when no words were found"""
+    confs = [word[4] for page in result['pages'] for word in page['words'] if word[4] >= 0]
+    return round(sum(confs) / len(confs), 1) if confs else None
+
+
+def _bbox(words):
+    left = min(word[0] for word in words)
+    top = min(word[1] for word in words)
+    right = max(word[0] + word[2] for word in words)
+    bottom = max(word[1] + word[3] for word in words)
+    return [left, top, right - left, bottom - top]
+
+
+def to_layout(result):
+    """JSON-friendly layout: pages with their lines, line boxes and word boxes"""
+    pages = []
+    for number, page in enumerate(result['pages'], start=1):
+        lines = []
+        for block, words in iter_lines(page):
+            lines.append({
+                'block': block,
+                'bbox': _bbox(words),
+                'text': ' '.join(word[8] for word in words),
+                'words': [{'text': word[8], 'bbox': word[:4], 'conf': word[4]} for word in words],
+            })
+        pages.append({'page': number, 'width': page['size'][0], 'height': page['size'][1], 'lines': lines})
+    return {'language': result.get('language'), 'confidence': mean_confidence(result), 'pages': pages}
+
+
+def to_hocr(result):
+    """hOCR document with page, line and word boxes and word confidences"""
+
+    def bbox(box):
+        left, top, width, height = box
+        return f'bbox {left} {top} {left + width} {top + height}'
+
+    out = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" '
+        '"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">',
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head><title></title>',
+        '<meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>',
+        '<meta name="ocr-system" content="tesseract"/>',
+        '<meta name="ocr-capabilities" content="ocr_page ocr_line ocrx_word"/>',
+        '</head><body>',
+    ]
+    for page_num, page in enumerate(result['pages'], start=1):
+        width, height = page['size']
+        out.append(f'<div class="ocr_page" id="page_{page_num}" title="{bbox([0, 0, width, height])}; ppageno {page_num - 1}">')
+        for line_num, (_, words) in enumerate(iter_lines(page), start=1):
+            out.append(f'<span class="ocr_line" id="line_{page_num}_{line_num}" title="{bbox(_bbox(words))}">')
+            for word_num, word in enumerate(words, start=1):
+                out.append(
+                    f'<span class="ocrx_word" id="word_{page_num}_{line_num}_{word_num}" '
+                    f'title="{bbox(word[:4])}; x_wconf {word[4]}">{html.escape(word[8])}</span>'
+                )
+            out.append('</span>')
+        out.append('</div>')
+    out.append('</body></html>')
+    return '\n'.join(out)
+
+
+_fonts = {}
+
+
+def _font_for(text):
+    # Glyph shapes never show; the font only has to carry the Unicode mapping
+    try:
+        text.encode('latin-1')
+        name = 'helv'
+    except UnicodeEncodeError:
+        name = 'cjk'
+    if name not in _fonts:
+        _fonts[name] = fitz.Font(name)
+    return name, _fonts[name]
+
+
+def insert_text_layer(page, words, scale, origin=(0, 0)):
+    """
+    Write words as invisible (render mode 3) text over a PDF page
+
+    scale converts word box pixels to PDF points and origin is where pixel
+    (0, 0) sits on the page as displayed. Each word is sized to the width of
+    its box so selections and search hits line up with the image.
+    """
+    writers = {}
+    for word in words:
+        left, top, width, height, text = word[0], word[1], word[2], word[3], word[8]
+        name, font = _font_for(text)
+        length = font.text_length(text, fontsize=1)
+        if length <= 0:
+            continue
+        fontsize = max(1.0, min(width * scale / length, height * scale * 1.5))
+        point = fitz.Point(origin[0] + left * scale, origin[1] + (top + height) * scale)
+        if page.rotation:
+            # Boxes come from the page as displayed; PDF text is written in
+            # unrotated space, so turn each word to read upright on screen
+            point = point * page.derotation_matrix
+            writer = fitz.TextWriter(page.rect)
+            writer.append(point, text, font=font, fontsize=fontsize)
+            writer.write_text(page, render_mode=3, morph=(point, fitz.Matrix(page.rotation)))
+            continue
+        if name not in writers:
+            writers[name] = fitz.TextWriter(page.rect)
+        writers[name].append(point, text, font=font, fontsize=fontsize)
+    for writer in writers.values():
+        writer.write_text(page, render_mode=3)
+
+
+def to_searchable_pdf(result, images):
+    """
+    Build a PDF with one page per source image and an invisible text layer
+
+    Args:
+        result: structured OCR result (boxes in source image pixels)
+        images: source image bytes, one per result page
+
+    Returns:
+        BytesIO with the PDF
+    """
+    doc = fitz.open()
+    for page_data, image_data in zip(result['pages'], images):
+        check_image(image_data)
+        img = Image.open(io.BytesIO(image_data))
+        dpi = img.info.get('dpi', (DEFAULT_IMAGE_DPI, DEFAULT_IMAGE_DPI))[0] or DEFAULT_IMAGE_DPI
+        scale = 72.0 / dpi
+        page = doc.new_page(width=img.width * scale, height=img.height * scale)
+        if img.format not in ('JPEG', 'PNG'):
+            buffer = io.BytesIO()
+            img.convert('RGBA' if 'A' in img.getbands() else 'RGB').save(buffer, format='PNG')
+            image_data = buffer.getvalue()
+        page.insert_image(page.rect, stream=image_data)
+        insert_text_layer(page, page_data['words'], scale)
+    # Embedded fallback fonts are large; keep only the glyphs used
+    doc.subset_fonts()
+    output = io.BytesIO()
+    doc.save(output, garbage=3, deflate=True)
+    doc.close()
+    output.seek(0)
+    return output
+
+
+def _result_path(result_id):
+    if not _RESULT_ID.match(result_id or ''):
+        raise KeyError(result_id)
+    return os.path.join(OCR_RESULT_DIR, result_id)
+
+
+def prune_results(now=None):
+    """Delete stored results older than OCR_RESULT_TTL"""
+    now = now or time.time()
+    try:
+        entries = os.listdir(OCR_RESULT_DIR)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        path = os.path.join(OCR_RESULT_DIR, entry)
+        try:
+            if now - os.path.getmtime(path) > OCR_RESULT_TTL:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def save_result(result, images=()):
+    """Store a result (gzipped compact JSON) and its source images; returns its id"""
+    prune_results()
+    result_id = uuid.uuid4().hex
+    path = _result_path(result_id)
+    os.makedirs(path)
+    with gzip.open(os.path.join(path, 'result.json.gz'), 'wt', encoding='utf-8') as f:
+        json.dump(result, f, separators=(',', ':'), ensure_ascii=False)
+    for index, image_data in enumerate(images):
+        with open(os.path.join(path, f'page-{index}'), 'wb') as f:
+            f.write(image_data)
+    return result_id
+
+
+def load_result(result_id):
+    """Load a stored result; raises KeyError if it is unknown or expired"""
+    path = _result_path(result_id)
+    result_file = os.path.join(path, 'result.json.gz')
+    try:
+        if time.time() - os.path.getmtime(result_file) > OCR_RESULT_TTL:
+            shutil.rmtree(path, ignore_errors=True)
+            raise KeyError(result_id)
+        with gzip.open(result_file, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise KeyError(result_id)
+
+
+def load_images(result_id):
+    """Source images stored with a result, in page order"""
+    path = _result_path(result_id)
+    images = []
+    while os.path.exists(os.path.join(path, f'page-{len(images)}')):
+        with open(os.path.join(path, f'page-{len(images)}'), 'rb') as f:
+            images.append(f.read())
+    return images
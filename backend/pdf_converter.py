@@ -7,86 +7,186 @@ from werkzeug.utils import secure_filename
 from PyPDF2 import PdfReader, PdfWriter, PdfMerger
 import fitz  # PyMuPDF
 from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4, legal
+from reportlab.lib.pagesizes import letter, A4, legal, landscape
+from reportlab.lib import colors
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Table, TableStyle
 from reportlab.lib.utils import ImageReader
 import tempfile
+import datetime
+import functools
+import itertools
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from docx import Document
 from docx.shared import Inches, Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-import pandas as pd
-from openpyxl import load_workbook
-import pytesseract
-
-def _add_image_to_docx(doc, image_bytes, width=None, height=None):
-    # Helper to add images to docx, resizing if necessary
-    try:
-        image_stream = io.BytesIO(image_bytes)
-        # Attempt to open as PIL Image to get dimensions
-        pil_img = Image.open(image_stream)
-        img_width, img_height = pil_img.size
-        image_stream.seek(0) # Reset stream for docx
-        
-        # Calculate aspect ratio
-        aspect_ratio = img_width / img_height
-
-        if width and not height:
-            height = width / aspect_ratio
-        elif height and not width:
-            width = height * aspect_ratio
-        elif not width and not height:
-            # Default size if neither width nor height is specified
-            width = Inches(6)
-            height = width / aspect_ratio
-        
-        doc.add_picture(image_stream, width=width, height=height)
-    except Exception as e:
-        print(f"Error adding image to docx: {e}")
+from docx.oxml.shape import CT_Inline
+import numpy as np
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from encoding_profiles import DEFAULT_PROFILE, encode, png_compress_level
+from image_converter import BATCH_MAX_WORKERS, convert_image_data, get_extension
+from large_image import TILE_BUDGET, PngStripWriter
+from ocr_converter import (OCR_BATCH_SIZE, LanguageError, TesseractNotInstalledError, image_to_data_batch,
+                           image_to_string_batch, resolve_language)
+from ocr_preprocess import choose_dpi, map_box_to_source, preprocess_with_transform
+from ocr_results import insert_text_layer
+from metrics import count_pages, stage
+import cancellation
+from resource_guard import (
+    GUARD_MAX_PAGE_PIXELS, ResourceLimitError, check_image, check_raster, clamp_dpi, page_pixels, render_dpi
+)
+import tracing
+from slide_render import PPT_IMAGE_FORMATS, PPT_JPEG_QUALITY, PPT_MODES, PPT_SLIDE_DPI, page_layout, render_slide_image
+from text_extraction import iter_page_results, iter_page_texts, page_tables, page_text_and_images
+
+# Image types python-docx can embed as they are; others become PNG
+_DOCX_IMAGE_EXTS = {'png', 'jpeg', 'jpg', 'gif', 'bmp', 'tiff', 'tif'}
+
+class _DocxImageCache:
+    """Adds PDF images to a Word document, extracting and embedding each xref once
+
+    Logos and letterheads repeated on every page share one xref; each is
+    extracted once, stored as a single image part, and every later use only
+    adds a picture element pointing at that part.
+    """
 
-def pdf_to_images(pdf_file, output_format='PNG', dpi=200):
-    """Convert PDF to images using PyMuPDF"""
+    def __init__(self, doc, pdf_document, width):
+        self.doc = doc
+        self.pdf_document = pdf_document
+        self.width = width
+        self.parts = {}
+        # python-docx finds the next shape id by scanning the whole body
+        # on every picture; count from here instead
+        self.next_id = doc.part.next_id
+
+    def _embed(self, xref):
+        base_image = self.pdf_document.extract_image(xref)
+        image_bytes = base_image["image"]
+        if base_image["ext"] not in _DOCX_IMAGE_EXTS:
+            pix = fitz.Pixmap(self.pdf_document, xref)
+            if pix.n - pix.alpha >= 4:
+                pix = fitz.Pixmap(fitz.csRGB, pix)
+            image_bytes = pix.tobytes("png")
+        rId, image = self.doc.part.get_or_add_image(io.BytesIO(image_bytes))
+        cx, cy = image.scaled_dimensions(self.width, None)
+        return rId, image.filename, cx, cy
+
+    def add(self, xref):
+        if xref not in self.parts:
+            try:
+                self.parts[xref] = self._embed(xref)
+            except Exception as e:
+                print(f"Error adding image to docx: {e}")
+                self.parts[xref] = None
+        part = self.parts[xref]
+        if part is None:
+            return
+        rId, filename, cx, cy = part
+        inline = CT_Inline.new_pic_inline(self.next_id, rId, filename, cx, cy)
+        self.next_id += 1
+        self.doc.add_paragraph().add_run()._r.add_drawing(inline)
+
+def pdf_to_images(pdf_file, output_format='PNG', dpi=200, profile=DEFAULT_PROFILE):
+    """Convert PDF to images using PyMuPDF
+    profile: encoding profile name ('fast', 'balanced' or 'smallest')
+    The DPI is lowered if the request would render more than the
+    resource_guard budgets. PNG pages too big to render in one piece are
+    rendered and encoded in strips; other formats render them at a lower DPI.
+    Each page's DPI is recorded as page_dpi in the request trace.
+    """
     try:
-        pdf_bytes = pdf_file.read()
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-
-        output_files = []
-
-        # Calculate zoom factor based on DPI
-        zoom = dpi / 72  # 72 is the default DPI
-        mat = fitz.Matrix(zoom, zoom)
-
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            pix = page.get_pixmap(matrix=mat)
-
-            # Convert pixmap to PIL Image
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-            output = io.BytesIO()
-
-            # Convert RGBA to RGB if saving as JPEG
-            if output_format.upper() in ['JPEG', 'JPG'] and img.mode in ('RGBA', 'LA', 'P'):
-                rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                if img.mode in ('RGBA', 'LA'):
-                    rgb_img.paste(img, mask=img.split()[-1])
+        with stage('read'):
+            pdf_bytes = pdf_file.read()
+        with stage('parse'):
+            pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+        try:
+            output_files = []
+            save_format = 'JPEG' if output_format.upper() == 'JPG' else output_format.upper()
+            tiled = save_format == 'PNG'
+            tracing.annotate(dpi=dpi, format=output_format.upper(), profile=profile)
+            dpi = render_dpi([pdf_document.page_cropbox(i) for i in range(pdf_document.page_count)], dpi, tiled)
+
+            # Calculate zoom factor based on DPI
+            zoom = dpi / 72  # 72 is the default DPI
+
+            for page_num in range(pdf_document.page_count):
+                cancellation.check()
+                page = pdf_document[page_num]
+                output = io.BytesIO()
+                if tiled and page_pixels(page.rect, dpi) > GUARD_MAX_PAGE_PIXELS:
+                    page_dpi = dpi
+                    _render_png_strips(page, zoom, output, profile)
                 else:
-                    rgb_img.paste(img)
-                img = rgb_img
-
-            img.save(output, format=output_format, quality=95)
-            output.seek(0)
-            output_files.append({
-                'data': output.getvalue(),
-                'filename': f'page_{page_num + 1}.{output_format.lower()}'
-            })
+                    page_dpi = clamp_dpi(page.rect, dpi)
+                    _render_page_image(page, page_dpi, output, save_format, profile)
+                tracing.observe('page_dpi', round(page_dpi, 1))
+                tracing.observe('image_bytes', output.tell())
+                output.seek(0)
+                output_files.append({
+                    'data': output.getvalue(),
+                    'filename': f'page_{page_num + 1}.{output_format.lower()}'
+                })
 
-        pdf_document.close()
+            count_pages('pdf_to_images', pdf_document.page_count)
+        finally:
+            pdf_document.close()
         return output_files
+    except ResourceLimitError:
+        raise
     except Exception as e:
         raise Exception(f"Error converting PDF to images: {str(e)}")
 
+
+def _render_page_image(page, dpi, output, save_format, profile):
+    with stage('render'):
+        zoom = dpi / 72
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+
+        # Convert pixmap to PIL Image
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+    # Convert RGBA to RGB if saving as JPEG
+    if save_format == 'JPEG' and img.mode in ('RGBA', 'LA', 'P'):
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        if img.mode in ('RGBA', 'LA'):
+            rgb_img.paste(img, mask=img.split()[-1])
+        else:
+            rgb_img.paste(img)
+        img = rgb_img
+
+    with stage('encode'):
+        encode(img, output, save_format, profile)
+
+
+def _render_png_strips(page, zoom, output, profile):
+    # Render the page in horizontal bands and feed them to one PNG stream,
+    # so the full raster is never held. A band exists as the pixmap, its
+    # samples, the strip image and the PNG scanlines, all within TILE_BUDGET.
+    mat = fitz.Matrix(zoom, zoom)
+    irect = (page.rect * mat).irect
+    width, height = irect.width, irect.height
+    rows = max(1, TILE_BUDGET // (width * 3 * 4))
+    writer = PngStripWriter(output, (width, height), 'RGB', png_compress_level(profile))
+    for y0 in range(0, height, rows):
+        cancellation.check()
+        y1 = min(height, y0 + rows)
+        with stage('render'):
+            clip = fitz.Rect(page.rect.x0, page.rect.y0 + y0 / zoom, page.rect.x1, page.rect.y0 + y1 / zoom)
+            pix = page.get_pixmap(matrix=mat, clip=clip, alpha=False)
+            strip = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            if strip.size != (width, y1 - y0):
+                # Guard against rounding at band edges; the PNG rows must add up
+                strip = strip.crop((0, 0, width, y1 - y0))
+        with stage('encode'):
+            writer.write(strip)
+    writer.close()
+
 def images_to_pdf(image_files, page_size='A4'):
     """Convert multiple images to a single PDF"""
     try:
@@ -106,8 +206,11 @@ def images_to_pdf(image_files, page_size='A4'):
         page_width, page_height = size
 
         for image_file in image_files:
+            cancellation.check()
             try:
-                img = Image.open(io.BytesIO(image_file.read()))
+                image_data = image_file.read()
+                check_image(image_data)
+                img = Image.open(io.BytesIO(image_data))
 
                 # Calculate scaling to fit page while maintaining aspect ratio
                 img_width, img_height = img.size
@@ -131,6 +234,8 @@ def images_to_pdf(image_files, page_size='A4'):
                 c.drawImage(ImageReader(img_buffer), x, y, new_width, new_height)
                 c.showPage()
 
+            except ResourceLimitError:
+                raise
             except Exception as e:
                 print(f"Error processing image: {str(e)}")
                 continue
@@ -138,6 +243,8 @@ def images_to_pdf(image_files, page_size='A4'):
         c.save()
         output.seek(0)
         return output
+    except ResourceLimitError:
+        raise
     except Exception as e:
         raise Exception(f"Error converting images to PDF: {str(e)}")
 
@@ -147,6 +254,7 @@ def merge_pdfs(pdf_files):
         merger = PdfMerger()
 
         for pdf_file in pdf_files:
+            cancellation.check()
             pdf_bytes = io.BytesIO(pdf_file.read())
             merger.append(pdf_bytes)
 
@@ -171,6 +279,7 @@ def split_pdf(pdf_file, split_type='all', page_range=None):
         if split_type == 'all':
             # Split into individual pages
             for i in range(total_pages):
+                cancellation.check()
                 writer = PdfWriter()
                 writer.add_page(reader.pages[i])
 
@@ -187,6 +296,7 @@ def split_pdf(pdf_file, split_type='all', page_range=None):
             # Split by page range (e.g., "1-3,5,7-9")
             ranges = page_range.split(',')
             for idx, r in enumerate(ranges):
+                cancellation.check()
                 writer = PdfWriter()
 
                 if '-' in r:
@@ -213,78 +323,174 @@ def split_pdf(pdf_file, split_type='all', page_range=None):
 
 def compress_pdf(pdf_file, quality=60, dpi=150):
     try:
-        src_bytes = pdf_file.read()
-        doc = fitz.open(stream=src_bytes, filetype="pdf")
-        has_images = False
-        for i in range(doc.page_count):
-            if doc.get_page_images(i):
-                has_images = True
-                break
-
-        if not has_images:
+        with stage('read'):
+            src_bytes = pdf_file.read()
+        with stage('parse'):
+            doc = fitz.open(stream=src_bytes, filetype="pdf")
+        try:
+            count_pages('compress_pdf', doc.page_count)
+            tracing.annotate(dpi=dpi, quality=quality)
+            has_images = False
+            for i in range(doc.page_count):
+                if doc.get_page_images(i):
+                    has_images = True
+                    break
+
             out = io.BytesIO()
-            doc.save(out, garbage=4, deflate=True)
+            if not has_images:
+                with stage('encode'):
+                    doc.save(out, garbage=4, deflate=True)
+                out.seek(0)
+                return out
+
+            dpi = render_dpi([doc.page_cropbox(i) for i in range(doc.page_count)], dpi)
+            out_doc = fitz.open()
+            try:
+                for i in range(doc.page_count):
+                    cancellation.check()
+                    page = doc[i]
+                    page_dpi = clamp_dpi(page.rect, dpi)
+                    tracing.observe('page_dpi', round(page_dpi, 1))
+                    with stage('render'):
+                        zoom = page_dpi / 72.0
+                        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+                        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+                    buf = io.BytesIO()
+                    with stage('encode'):
+                        img.save(buf, format="JPEG", quality=int(quality), optimize=True)
+                    tracing.observe('image_bytes', buf.tell())
+                    buf.seek(0)
+                    new_page = out_doc.new_page(width=page.rect.width, height=page.rect.height)
+                    new_page.insert_image(new_page.rect, stream=buf.getvalue())
+                with stage('encode'):
+                    out_doc.save(out, garbage=4, deflate=True)
+            finally:
+                out_doc.close()
+        finally:
             doc.close()
-            out.seek(0)
-            return out
-
-        out_doc = fitz.open()
-        zoom = dpi / 72.0
-        mat = fitz.Matrix(zoom, zoom)
-        for i in range(doc.page_count):
-            page = doc[i]
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            buf = io.BytesIO()
-            img.save(buf, format="JPEG", quality=int(quality), optimize=True)
-            buf.seek(0)
-            new_page = out_doc.new_page(width=page.rect.width, height=page.rect.height)
-            new_page.insert_image(new_page.rect, stream=buf.getvalue())
-        out = io.BytesIO()
-        out_doc.save(out, garbage=4, deflate=True)
-        out_doc.close()
-        doc.close()
         out.seek(0)
         return out
+    except ResourceLimitError:
+        raise
     except Exception as e:
         raise Exception(f"Error compressing PDF: {str(e)}")
 
+# Embedded images narrower or shorter than this many pixels (bullets, rules,
+# spacer images) are left out of image extraction
+EXTRACT_MIN_IMAGE_SIZE = int(os.environ.get('EXTRACT_MIN_IMAGE_SIZE', 16))
+
+# PDF image types Pillow can decode directly; the rest (JBIG2, JPX, raw
+# samples) are decoded by PyMuPDF first
+_PILLOW_IMAGE_EXTS = {'png', 'jpg', 'gif', 'bmp', 'tiff', 'tif'}
+
+
 def extract_images(pdf_file, output_format='PNG'):
     """Extract embedded images from a PDF and return as list of bytes"""
+    return [{'data': data, 'filename': filename}
+            for filename, data in iter_extracted_images(pdf_file, output_format, min_size=0)]
+
+
+def iter_extracted_images(pdf_file, output_format='PNG', min_size=None, profile=DEFAULT_PROFILE, max_workers=None):
+    """
+    Yield (filename, bytes) for each distinct image embedded in a PDF
+
+    Images are read once per xref even when repeated on many pages, and
+    named after the first page they appear on. Images already in
+    output_format (or any image, with output_format 'NATIVE') are passed
+    through as stored in the PDF; the rest are re-encoded on a thread pool
+    and yielded in page order. Images that fail to convert are listed in an
+    errors.txt entry at the end.
+
+    Args:
+        pdf_file: File object containing PDF
+        output_format: image_converter format name, or 'NATIVE'
+        min_size: skip images smaller than this on either side (defaults to
+            EXTRACT_MIN_IMAGE_SIZE)
+        profile: encoding profile for re-encoded images
+        max_workers: parallel encodes (defaults to BATCH_MAX_WORKERS)
+    """
     try:
-        pdf_bytes = pdf_file.read()
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        images = []
+        with stage('read'):
+            pdf_bytes = pdf_file.read()
+        with stage('parse'):
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    except Exception as e:
+        raise Exception(f"Error extracting images: {str(e)}")
+    if min_size is None:
+        min_size = EXTRACT_MIN_IMAGE_SIZE
+    tracing.annotate(format=output_format.upper(), min_size=min_size)
+    return _iter_unique_images(doc, output_format.upper(), min_size, profile, max_workers or BATCH_MAX_WORKERS)
+
+
+def _encode_extracted_image(image_bytes, output_format, profile):
+    with stage('encode'):
+        return convert_image_data(image_bytes, output_format, 'first', None, profile)
+
+
+def _iter_unique_images(doc, output_format, min_size, profile, workers):
+    native = output_format == 'NATIVE'
+    target_ext = None if native else get_extension(output_format)
+    seen = set()
+    pending = deque()
+    errors = []
+
+    def drain(limit):
+        while len(pending) > limit:
+            filename, result = pending.popleft()
+            if isinstance(result, bytes):
+                yield filename, result
+                continue
+            try:
+                yield filename, result.result()
+            except Exception as e:
+                errors.append(f"{filename}: {str(e)}")
 
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
         for page_num in range(doc.page_count):
+            cancellation.check()
+            count_pages('extract_images')
             for img in doc.get_page_images(page_num):
-                xref = img[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                img_ext = base_image.get("ext", output_format.lower())
-
-                # Convert to desired format if needed
-                pil_img = Image.open(io.BytesIO(image_bytes))
-                out_buf = io.BytesIO()
-                save_format = output_format.upper()
-                if save_format in ["JPEG", "JPG"] and pil_img.mode in ("RGBA", "LA", "P"):
-                    rgb_img = Image.new('RGB', pil_img.size, (255, 255, 255))
-                    if pil_img.mode == 'P':
-                        pil_img = pil_img.convert('RGBA')
-                    rgb_img.paste(pil_img, mask=pil_img.split()[-1] if pil_img.mode in ('RGBA', 'LA') else None)
-                    pil_img = rgb_img
-                pil_img.save(out_buf, format='JPEG' if save_format == 'JPG' else save_format)
-                out_buf.seek(0)
-
-                images.append({
-                    'data': out_buf.getvalue(),
-                    'filename': f'page_{page_num + 1}_img_{xref}.{("jpg" if save_format in ["JPEG", "JPG"] else save_format.lower())}'
-                })
-
+                xref, width, height = img[0], img[2], img[3]
+                if xref in seen:
+                    continue
+                seen.add(xref)
+                if width < min_size or height < min_size:
+                    continue
+
+                name = f'page_{page_num + 1}_img_{xref}'
+                try:
+                    base_image = doc.extract_image(xref)
+                    ext = get_extension(base_image['ext'])
+                    image_bytes = base_image['image']
+                    if native or ext == target_ext:
+                        entry = (f'{name}.{ext}', image_bytes)
+                    else:
+                        if ext not in _PILLOW_IMAGE_EXTS:
+                            # PyMuPDF is not thread-safe, so decode here and
+                            # leave only the Pillow encode to the pool
+                            check_raster(width, height, 4)
+                            pix = fitz.Pixmap(doc, xref)
+                            if pix.colorspace and pix.colorspace.n > 3:
+                                pix = fitz.Pixmap(fitz.csRGB, pix)
+                            image_bytes = pix.tobytes('png')
+                        entry = (f'{name}.{target_ext}',
+                                 executor.submit(tracing.bind(_encode_extracted_image), image_bytes, output_format, profile))
+                except Exception as e:
+                    errors.append(f"{name}: {str(e)}")
+                    continue
+                pending.append(entry)
+                # Keep a bounded number of images, passed through or being
+                # encoded, waiting to be sent
+                yield from drain(workers * 2)
+        yield from drain(0)
+    finally:
+        # Drop queued work if the client went away mid-stream
+        executor.shutdown(wait=True, cancel_futures=True)
         doc.close()
-        return images
-    except Exception as e:
-        raise Exception(f"Error extracting images: {str(e)}")
+
+    if errors:
+        yield 'errors.txt', "\n".join(errors).encode('utf-8')
 
 def get_pdf_info(pdf_file):
     """Get PDF metadata and information"""
@@ -292,33 +498,34 @@ def get_pdf_info(pdf_file):
         pdf_bytes = io.BytesIO(pdf_file.read())
         pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
 
-        info = {
-            'pages': pdf_document.page_count,
-            'metadata': {}
-        }
-
-        metadata = pdf_document.metadata
-        if metadata:
-            info['metadata'] = {
-                'title': metadata.get('title', 'N/A'),
-                'author': metadata.get('author', 'N/A'),
-                'subject': metadata.get('subject', 'N/A'),
-                'creator': metadata.get('creator', 'N/A'),
-                'producer': metadata.get('producer', 'N/A'),
+        try:
+            info = {
+                'pages': pdf_document.page_count,
+                'metadata': {}
             }
 
-        # Get page sizes
-        page_sizes = []
-        for page_num in range(min(5, pdf_document.page_count)):
-            page = pdf_document[page_num]
-            rect = page.rect
-            page_sizes.append({
-                'width': float(rect.width),
-                'height': float(rect.height)
-            })
-        info['page_sizes'] = page_sizes
-
-        pdf_document.close()
+            metadata = pdf_document.metadata
+            if metadata:
+                info['metadata'] = {
+                    'title': metadata.get('title', 'N/A'),
+                    'author': metadata.get('author', 'N/A'),
+                    'subject': metadata.get('subject', 'N/A'),
+                    'creator': metadata.get('creator', 'N/A'),
+                    'producer': metadata.get('producer', 'N/A'),
+                }
+
+            # Get page sizes
+            page_sizes = []
+            for page_num in range(min(5, pdf_document.page_count)):
+                page = pdf_document[page_num]
+                rect = page.rect
+                page_sizes.append({
+                    'width': float(rect.width),
+                    'height': float(rect.height)
+                })
+            info['page_sizes'] = page_sizes
+        finally:
+            pdf_document.close()
         return info
     except Exception as e:
         raise Exception(f"Error getting PDF info: {str(e)}")
@@ -330,31 +537,33 @@ def delete_pdf_pages(pdf_file, pages_to_delete):
     try:
         pdf_bytes = io.BytesIO(pdf_file.read())
         pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        total_pages = pdf_document.page_count
-
-        # Parse pages to delete
-        pages_set = set()
-        if isinstance(pages_to_delete, str):
-            ranges = pages_to_delete.split(',')
-            for r in ranges:
-                r = r.strip()
-                if '-' in r:
-                    start, end = map(int, r.split('-'))
-                    pages_set.update(range(start, end + 1))
-                else:
-                    pages_set.add(int(r))
-        elif isinstance(pages_to_delete, list):
-            pages_set = set(pages_to_delete)
+        try:
+            total_pages = pdf_document.page_count
+
+            # Parse pages to delete
+            pages_set = set()
+            if isinstance(pages_to_delete, str):
+                ranges = pages_to_delete.split(',')
+                for r in ranges:
+                    r = r.strip()
+                    if '-' in r:
+                        start, end = map(int, r.split('-'))
+                        pages_set.update(range(start, end + 1))
+                    else:
+                        pages_set.add(int(r))
+            elif isinstance(pages_to_delete, list):
+                pages_set = set(pages_to_delete)
+
+            # Delete pages in reverse order to avoid index shifting
+            pages_to_delete_list = sorted(pages_set, reverse=True)
+            for page_num in pages_to_delete_list:
+                if 1 <= page_num <= total_pages:
+                    pdf_document.delete_page(page_num - 1)  # Convert to 0-indexed
 
-        # Delete pages in reverse order to avoid index shifting
-        pages_to_delete_list = sorted(pages_set, reverse=True)
-        for page_num in pages_to_delete_list:
-            if 1 <= page_num <= total_pages:
-                pdf_document.delete_page(page_num - 1)  # Convert to 0-indexed
-
-        output = io.BytesIO()
-        pdf_document.save(output)
-        pdf_document.close()
+            output = io.BytesIO()
+            pdf_document.save(output)
+        finally:
+            pdf_document.close()
         output.seek(0)
 
         return output
@@ -362,33 +571,34 @@ def delete_pdf_pages(pdf_file, pages_to_delete):
         raise Exception(f"Error deleting PDF pages: {str(e)}")
 
 def pdf_to_word(pdf_file):
-    """Convert PDF to Word (DOCX) using PyMuPDF and python-docx"""
+    """Convert PDF to Word (DOCX) using PyMuPDF and python-docx
+
+    Page text and image references are read in worker processes for long
+    documents and assembled in page order; images shared between pages are
+    embedded once.
+    """
     try:
         doc = Document()
-        pdf_bytes = pdf_file.read()
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-
-            # Extract text
-            text = page.get_text()
-            if text:
-                doc.add_paragraph(text)
-            
-            # Extract images (basic approach)
-            for img_index, img in enumerate(pdf_document.get_page_images(page_num)):
-                xref = img[0] # xref of the image
-                base_image = pdf_document.extract_image(xref)
-                image_bytes = base_image["image"]
-
-                # Try to add image to document
-                _add_image_to_docx(doc, image_bytes, width=Inches(6))
-
-        pdf_document.close()
+        with stage('read'):
+            pdf_bytes = pdf_file.read()
+        with stage('parse'):
+            pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            count_pages('pdf_to_word', pdf_document.page_count)
+            images = _DocxImageCache(doc, pdf_document, Inches(6))
+
+            for page in iter_page_results(pdf_bytes, page_text_and_images):
+                cancellation.check()
+                if page['text']:
+                    doc.add_paragraph(page['text'])
+                for xref in page['images']:
+                    images.add(xref)
+        finally:
+            pdf_document.close()
 
         output = io.BytesIO()
-        doc.save(output)
+        with stage('encode'):
+            doc.save(output)
         output.seek(0)
         return output
     except Exception as e:
@@ -397,50 +607,227 @@ def pdf_to_word(pdf_file):
 def pdf_to_text(pdf_file):
     """Extract all text from a PDF file"""
     try:
-        pdf_bytes = pdf_file.read()
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        text_content = []
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            text_content.append(page.get_text())
-            
-        pdf_document.close()
-        return "\n".join(text_content)
+        return "".join(iter_pdf_text(pdf_file))
     except Exception as e:
         raise Exception(f"Error extracting text from PDF: {str(e)}")
 
-def pdf_to_excel(pdf_file):
-    """Convert PDF text content to an Excel (XLSX) file"""
-    try:
-        pdf_bytes = pdf_file.read()
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+def iter_pdf_text(pdf_file):
+    """Extract the text of a PDF as chunks, one per page, as pages finish
 
-        all_text = []
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            all_text.append(page.get_text())
-
-        pdf_document.close()
+    The document is opened before this returns, so a broken file raises
+    here rather than part way through a streamed response. Joining the
+    chunks gives the same text as pdf_to_text.
+    """
+    try:
+        with stage('read'):
+            pdf_bytes = pdf_file.read()
+        with stage('parse'):
+            page_texts = iter_page_texts(pdf_bytes)
+    except Exception as e:
+        raise Exception(f"Error extracting text from PDF: {str(e)}")
+    return _join_pages(page_texts)
+
+def _join_pages(page_texts):
+    # Same separators as "\n".join, without holding every page
+    for index, text in enumerate(page_texts):
+        cancellation.check()
+        count_pages('pdf_to_text')
+        yield text if index == 0 else "\n" + text
+
+# Rows per worksheet before pdf_to_excel continues on a new sheet (Excel's
+# hard limit is 1,048,576)
+XLSX_MAX_ROWS = int(os.environ.get('XLSX_MAX_ROWS', 1000000))
+
+# Longest text Excel accepts in one cell
+XLSX_MAX_CELL_CHARS = 32767
+
+class _RollingSheet:
+    """Write-only worksheet that continues on a new sheet when it is full"""
+
+    def __init__(self, workbook, title, header, max_rows=None):
+        self.workbook = workbook
+        self.title = title
+        self.header = header
+        self.max_rows = max_rows or XLSX_MAX_ROWS
+        self.sheets = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        self.sheets += 1
+        name = self.title if self.sheets == 1 else f'{self.title} {self.sheets}'
+        self.sheet = self.workbook.create_sheet(name)
+        self.sheet.append(self.header)
+        self.rows = 1
+
+    def append(self, row):
+        if self.rows >= self.max_rows:
+            self._new_sheet()
+        self.sheet.append(row)
+        self.rows += 1
+
+def _xlsx_cell(value):
+    # openpyxl rejects control characters in strings
+    if value is None:
+        return None
+    return ILLEGAL_CHARACTERS_RE.sub('', value)[:XLSX_MAX_CELL_CHARS]
 
-        # Create a DataFrame from the extracted text
-        df = pd.DataFrame(all_text, columns=['Extracted Text'])
+def pdf_to_excel(pdf_file):
+    """Convert PDF tables and text to an Excel (XLSX) file
+
+    Tables detected by PyMuPDF are written to the 'Tables' sheet, one
+    spreadsheet row per table row (the sheet holds only its header when no
+    tables are found), and every line of page text to the 'Text' sheet.
+    Rows go through a write-only workbook as pages are read, so memory
+    does not grow with the row count; sheets that reach XLSX_MAX_ROWS
+    continue as 'Tables 2', 'Text 2' and so on.
+    """
+    try:
+        with stage('read'):
+            pdf_bytes = pdf_file.read()
+
+        workbook = Workbook(write_only=True)
+        table_sheet = _RollingSheet(workbook, 'Tables', ['Page', 'Table'])
+        text_sheet = _RollingSheet(workbook, 'Text', ['Page', 'Extracted Text'])
+
+        # Table detection runs in worker processes for long documents
+        for page_num, page in enumerate(iter_page_results(pdf_bytes, page_tables), start=1):
+            cancellation.check()
+            count_pages('pdf_to_excel')
+            for table_num, rows in enumerate(page['tables'], start=1):
+                for row in rows:
+                    table_sheet.append([page_num, table_num] + [_xlsx_cell(value) for value in row])
+            for line in page['text'].splitlines():
+                if line.strip():
+                    text_sheet.append([page_num, _xlsx_cell(line)])
 
         output = io.BytesIO()
-        # Save to Excel, without index
-        df.to_excel(output, index=False, engine='openpyxl')
+        with stage('encode'):
+            workbook.save(output)
         output.seek(0)
         return output
     except Exception as e:
         raise Exception(f"Error converting PDF to Excel: {str(e)}")
 
+# Rows read before rendering a sheet, used to size its columns; kept below
+# one page of rows so memory stays bounded by a page
+EXCEL_WIDTH_SAMPLE_ROWS = int(os.environ.get('EXCEL_WIDTH_SAMPLE_ROWS', 40))
+
+# Table layout for excel_to_pdf, in points
+EXCEL_FONT_SIZE = 8
+EXCEL_ROW_HEIGHT = 12
+EXCEL_MARGIN = 30
+EXCEL_MIN_COL_WIDTH = 30
+EXCEL_MAX_COL_WIDTH = 200
+EXCEL_CELL_PADDING = 6
+
+_EXCEL_TABLE_STYLE = TableStyle([
+    ('FONT', (0, 0), (-1, -1), 'Helvetica', EXCEL_FONT_SIZE),
+    ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold', EXCEL_FONT_SIZE),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e8eaf0')),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('TOPPADDING', (0, 0), (-1, -1), 1),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 1),
+    ('LEFTPADDING', (0, 0), (-1, -1), EXCEL_CELL_PADDING / 2),
+    ('RIGHTPADDING', (0, 0), (-1, -1), EXCEL_CELL_PADDING / 2),
+])
+
+def _excel_cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f'{value:g}'
+    if isinstance(value, datetime.datetime):
+        # openpyxl reads date-only cells as midnight datetimes
+        return value.date().isoformat() if value.time() == datetime.time() else value.isoformat(sep=' ')
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value).replace('\n', ' ')
+
+def _sample_column_widths(rows, ncols):
+    # 90th percentile of the sampled text lengths per column, computed over
+    # the whole sample at once; the header row always fits
+    texts = np.array([row + [''] * (ncols - len(row)) for row in rows], dtype=str)
+    lengths = np.char.str_len(texts)
+    typical = np.percentile(lengths[1:], 90, axis=0) if len(rows) > 1 else np.zeros(ncols)
+    # Average Helvetica glyph is a little over half the font size wide
+    widths = typical * EXCEL_FONT_SIZE * 0.55
+    header = np.array([stringWidth(text, 'Helvetica-Bold', EXCEL_FONT_SIZE) for text in texts[0]])
+    widths = np.maximum(widths, header) + EXCEL_CELL_PADDING + 1
+    return np.clip(widths, EXCEL_MIN_COL_WIDTH, EXCEL_MAX_COL_WIDTH)
+
+def _fit_text(text, width):
+    # Truncate a cell so it stays on one line within its column
+    limit = width - EXCEL_CELL_PADDING
+    text_width = stringWidth(text, 'Helvetica', EXCEL_FONT_SIZE)
+    if text_width <= limit:
+        return text
+    # Cut proportionally, then trim until the ellipsis fits too
+    text = text[:int(len(text) * limit / text_width)]
+    while text and stringWidth(text + '...', 'Helvetica', EXCEL_FONT_SIZE) > limit:
+        text = text[:-1]
+    return text + '...' if text else ''
+
+def _render_sheet(c, title, rows, page_size):
+    """Draw one sheet as a paginated table; rows is consumed as it is drawn"""
+    rows = (
+        [_excel_cell_text(value) for value in row]
+        for row in rows
+        if any(value is not None for value in row)
+    )
+    sample = [row for _, row in zip(range(EXCEL_WIDTH_SAMPLE_ROWS), rows)]
+    if not sample:
+        return 0
+    ncols = max(len(row) for row in sample)
+    header = sample[0] + [''] * (ncols - len(sample[0]))
+    widths = _sample_column_widths(sample, ncols)
+
+    # Wide sheets go landscape, then columns shrink to fit the page width
+    width, height = page_size
+    if widths.sum() > width - 2 * EXCEL_MARGIN and width < height:
+        width, height = landscape(page_size)
+    available = width - 2 * EXCEL_MARGIN
+    if widths.sum() > available:
+        widths = widths * (available / widths.sum())
+    col_widths = [float(w) for w in widths]
+
+    # One line for the sheet name, one row for the repeated header
+    rows_per_page = max(1, int((height - 2 * EXCEL_MARGIN - 18) // EXCEL_ROW_HEIGHT) - 1)
+    pages = 0
+
+    def draw(page_rows):
+        cancellation.check()
+        c.setPageSize((width, height))
+        c.setFont('Helvetica-Bold', 10)
+        c.drawString(EXCEL_MARGIN, height - EXCEL_MARGIN - 10, title)
+        data = [[_fit_text(text, w) for text, w in zip(row, col_widths)] for row in [header] + page_rows]
+        table = Table(data, colWidths=col_widths, rowHeights=EXCEL_ROW_HEIGHT)
+        table.setStyle(_EXCEL_TABLE_STYLE)
+        _, table_height = table.wrapOn(c, available, height)
+        table.drawOn(c, EXCEL_MARGIN, height - EXCEL_MARGIN - 18 - table_height)
+        c.showPage()
+
+    page_rows = []
+    for row in itertools.chain(sample[1:], rows):
+        page_rows.append((row + [''] * (ncols - len(row)))[:ncols])
+        if len(page_rows) == rows_per_page:
+            draw(page_rows)
+            pages += 1
+            page_rows = []
+    if page_rows or pages == 0:
+        draw(page_rows)
+        pages += 1
+    return pages
+
 def excel_to_pdf(excel_file, page_size='A4'):
-    """Convert an Excel (XLSX) file to PDF"""
-    try:
-        df = pd.read_excel(excel_file)
+    """Convert every sheet of an Excel (XLSX) file to a paginated PDF table
 
-        output = io.BytesIO()
-        
+    Rows are read through openpyxl's read-only mode and drawn a page at a
+    time, so memory is bounded by one page of rows however long the sheet
+    is. Column widths come from the first EXCEL_WIDTH_SAMPLE_ROWS rows of
+    each sheet, whose first row is repeated as the header on every page.
+    """
+    try:
         # Set page size
         if page_size.upper() == 'A4':
             size = A4
@@ -451,62 +838,226 @@ def excel_to_pdf(excel_file, page_size='A4'):
         else:
             size = A4
 
-        c = canvas.Canvas(output, pagesize=size)
-        width, height = size
-
-        # Convert DataFrame to a string representation for PDF
-        # This is a basic conversion; for complex layouts, more advanced rendering is needed.
-        text_content = df.to_string(index=False)
-
-        # Add text to PDF
-        textobject = c.beginText()
-        textobject.setTextOrigin(10, height - 20)
-        textobject.setFont("Helvetica", 10)
-        
-        # Split text into lines to fit page width
-        lines = text_content.split('\n')
-        y_position = height - 20
-        for line in lines:
-            if y_position < 40:  # Check if close to bottom margin
-                c.drawText(textobject) # Draw current text
-                c.showPage() # Start new page
-                textobject = c.beginText()
-                textobject.setTextOrigin(10, height - 20)
-                textobject.setFont("Helvetica", 10)
-                y_position = height - 20
-            textobject.textLine(line)
-            y_position -= 12 # Line spacing
-
-        c.drawText(textobject)
-        c.save()
+        workbook = load_workbook(excel_file, read_only=True, data_only=True)
+        output = io.BytesIO()
+        # Finished pages are kept compressed until the PDF is saved
+        c = canvas.Canvas(output, pagesize=size, pageCompression=1)
+
+        pages = 0
+        try:
+            for sheet in workbook.worksheets:
+                rows = (list(row) for row in sheet.iter_rows(values_only=True))
+                pages += _render_sheet(c, sheet.title, rows, size)
+        finally:
+            workbook.close()
+        count_pages('excel_to_pdf', pages)
+
+        if pages == 0:
+            # A PDF needs at least one page
+            c.setFont('Helvetica', 10)
+            c.drawString(EXCEL_MARGIN, size[1] - EXCEL_MARGIN - 10, 'The workbook has no data.')
+            c.showPage()
+
+        with stage('encode'):
+            c.save()
         output.seek(0)
         return output
     except Exception as e:
         raise Exception(f"Error converting Excel to PDF: {str(e)}")
 
-def ocr_pdf(pdf_file):
+# Hybrid OCR thresholds. A page with at least OCR_MIN_TEXT_CHARS characters of
+# native text is digital; embedded images covering at least
+# OCR_MIN_REGION_COVERAGE of such a page are OCRed on their own.
+OCR_MIN_TEXT_CHARS = 50
+OCR_MIN_REGION_COVERAGE = 0.05
+
+# Page handling recorded per page by ocr_pdf_pages
+OCR_METHOD_TEXT = 'text'
+OCR_METHOD_REGIONS = 'text+ocr-regions'
+OCR_METHOD_FULL = 'ocr'
+
+OCR_MODES = ['hybrid', 'full']
+
+# /pdf/ocr results: extracted text as JSON, or the PDF with a text layer
+OCR_OUTPUTS = ['json', 'pdf']
+
+# Tesseract processes run side by side when building a searchable PDF
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1))
+
+
+def _image_regions(page):
+    # Bounding boxes of embedded images, clipped to the page
+    regions = []
+    for info in page.get_image_info():
+        rect = fitz.Rect(info['bbox']) & page.rect
+        if not rect.is_empty:
+            regions.append(rect)
+    return regions
+
+
+def _coverage(regions, page_rect):
+    area = sum(rect.width * rect.height for rect in regions)
+    return min(1.0, area / (page_rect.width * page_rect.height))
+
+
+def _render_for_ocr(page, clip=None):
+    # Render page (or one region of it) in grayscale at the lowest DPI that
+    # keeps its text at tesseract's preferred size, then clean it up.
+    # Also returns the preprocessing transform and DPI, which place OCR
+    # word boxes back on the page.
+    cancellation.check()
+    with stage('render'):
+        # Very large pages (posters, drawings) would need a huge raster at
+        # text DPI; render them within the page pixel budget instead
+        dpi = clamp_dpi(clip if clip is not None else page.rect, choose_dpi(page, clip))
+        tracing.observe('ocr_dpi', dpi)
+        pix = page.get_pixmap(dpi=dpi, clip=clip, colorspace='gray')
+        img = Image.frombytes("L", [pix.width, pix.height], pix.samples)
+    with stage('preprocess'):
+        prepared, transform = preprocess_with_transform(img, rescale=False)
+    return prepared, transform, dpi
+
+
+def classify_page(page):
+    """Decide how a page should be read: native text, OCR of image regions, or full OCR"""
+    text = page.get_text()
+    if len(text.strip()) < OCR_MIN_TEXT_CHARS:
+        return OCR_METHOD_FULL, text, []
+    regions = [
+        rect for rect in _image_regions(page)
+        if _coverage([rect], page.rect) >= OCR_MIN_REGION_COVERAGE
+    ]
+    # A page-sized image under a text layer is an already-OCRed scan
+    if not regions or _coverage(regions, page.rect) >= 0.9:
+        return OCR_METHOD_TEXT, text, []
+    return OCR_METHOD_REGIONS, text, regions
+
+
+def _plan_ocr_jobs(pdf_document, mode):
+    # One (page_num, clip) job per page or image region that needs OCR;
+    # clip None means the whole page
+    pages = []
+    ocr_jobs = []
+    for page_num in range(pdf_document.page_count):
+        cancellation.check()
+        page = pdf_document[page_num]
+
+        if mode == 'full':
+            method, text, regions = OCR_METHOD_FULL, '', []
+        else:
+            method, text, regions = classify_page(page)
+
+        if method == OCR_METHOD_FULL:
+            ocr_jobs.append((page_num, None))
+        elif method == OCR_METHOD_REGIONS:
+            ocr_jobs.extend((page_num, rect) for rect in regions)
+
+        pages.append({'page': page_num + 1, 'method': method, 'text': text})
+    return pages, ocr_jobs
+
+
+def ocr_pdf_pages(pdf_file, mode='hybrid', lang='eng'):
+    """OCR a PDF page by page, returning one dict per page
+
+    mode 'hybrid' uses the native text layer of digital pages, OCRs only the
+    image regions of pages that mix text and pictures, and renders and OCRs
+    the whole page only for scans. mode 'full' OCRs every page.
+    lang is a language name or tesseract code, checked only if some page
+    needs OCR, so digital PDFs work without tesseract.
+    Each dict holds 'page' (1-based), 'method' and 'text'.
+    """
+    try:
+        with stage('read'):
+            pdf_bytes = pdf_file.read()
+        # Opening only reads the cross-reference table; parse covers the
+        # page classification
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+            with stage('parse'):
+                pages, ocr_jobs = _plan_ocr_jobs(pdf_document, mode)
+            if ocr_jobs:
+                lang = resolve_language(lang)
+            count_pages('ocr_pdf', pdf_document.page_count)
+            tracing.annotate(mode=mode, language=lang, ocr_jobs=len(ocr_jobs))
+
+            # Render lazily and OCR in batches so tesseract loads its model
+            # once per batch rather than once per page
+            images = (_render_for_ocr(pdf_document[page_num], clip)[0] for page_num, clip in ocr_jobs)
+            for (page_num, clip), ocr_text in zip(ocr_jobs, image_to_string_batch(images, lang=lang)):
+                page = pages[page_num]
+                page['text'] = ocr_text if clip is None else "\n".join([page['text'], ocr_text])
+        return pages
+    except (LanguageError, TesseractNotInstalledError):
+        raise
+    except Exception as e:
+        raise Exception(f"Error performing OCR on PDF: {str(e)}")
+
+
+def ocr_pdf(pdf_file, mode='hybrid', lang='eng'):
     """Perform OCR on a PDF file to extract searchable text"""
+    return "\n".join(page['text'] for page in ocr_pdf_pages(pdf_file, mode, lang))
+
+
+def ocr_pdf_searchable(pdf_file, mode='hybrid', lang='eng', max_workers=None):
+    """Add an invisible OCR text layer to the original PDF and return it
+
+    Pages (or image regions, in hybrid mode) that need OCR are rendered in
+    order and handed to a pool of tesseract processes in chunks. Finished
+    chunks are written into the document in page order as soon as all
+    earlier ones are done, so only the chunks in flight are held in memory.
+    Pages that already have a text layer are left untouched in hybrid mode.
+    lang is resolved as in ocr_pdf_pages.
+    """
     try:
-        pdf_bytes = pdf_file.read()
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+        with stage('read'):
+            pdf_bytes = pdf_file.read()
+        # Opening only reads the cross-reference table; parse covers the
+        # page classification
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+            with stage('parse'):
+                _, ocr_jobs = _plan_ocr_jobs(pdf_document, mode)
+            if ocr_jobs:
+                lang = resolve_language(lang)
+            count_pages('ocr_pdf', pdf_document.page_count)
+            tracing.annotate(mode=mode, language=lang, ocr_jobs=len(ocr_jobs))
+
+            workers = max(1, max_workers or OCR_WORKERS)
+            # Enough chunks to keep every worker busy, few enough that each
+            # tesseract process still amortizes its model load
+            chunk_size = max(1, min(OCR_BATCH_SIZE, -(-len(ocr_jobs) // workers)))
+            # Parallel processes each get one thread instead of competing for cores
+            threads = 1 if workers > 1 else None
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                for start in range(0, len(ocr_jobs), chunk_size):
+                    cancellation.check()
+                    chunk = ocr_jobs[start:start + chunk_size]
+                    rendered = [_render_for_ocr(pdf_document[page_num], clip) for page_num, clip in chunk]
+                    future = executor.submit(tracing.bind(image_to_data_batch), [item[0] for item in rendered], lang, '', None, threads)
+                    # Keep only geometry; the images are released once OCR finishes
+                    pending.append((chunk, [item[1:] for item in rendered], future))
+                    while len(pending) > workers:
+                        _apply_text_layer(pdf_document, *pending.popleft())
+                while pending:
+                    _apply_text_layer(pdf_document, *pending.popleft())
 
-        full_text = []
-
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            
-            # Render page to image
-            pix = page.get_pixmap(dpi=300)  # High DPI for better OCR accuracy
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            
-            # Perform OCR using Tesseract
-            text = pytesseract.image_to_string(img)
-            full_text.append(text)
-
-        pdf_document.close()
-        return "\n".join(full_text)
+            output = io.BytesIO()
+            with stage('encode'):
+                pdf_document.save(output, garbage=3, deflate=True)
+        output.seek(0)
+        return output
+    except (LanguageError, TesseractNotInstalledError):
+        raise
     except Exception as e:
-        raise Exception(f"Error performing OCR on PDF: {str(e)}")
+        raise Exception(f"Error creating searchable PDF: {str(e)}")
+
+
+def _apply_text_layer(pdf_document, chunk, geometry, future):
+    for (page_num, clip), (transform, dpi), ocr_page in zip(chunk, geometry, future.result()):
+        page = pdf_document[page_num]
+        words = [list(map_box_to_source(word[:4], transform)) + word[4:] for word in ocr_page['words']]
+        origin = (clip.x0, clip.y0) if clip is not None else (0, 0)
+        insert_text_layer(page, words, 72.0 / dpi, origin)
 
 def encrypt_pdf(pdf_file, password):
     try:
@@ -544,73 +1095,121 @@ def decrypt_pdf(pdf_file, password):
     except Exception as e:
         raise Exception(f"Error decrypting PDF: {str(e)}")
 
-def pdf_to_ppt(pdf_file, layout='blank'):
-    """Convert PDF to PowerPoint presentation using PyMuPDF"""
+# Slides are rendered in the text-extraction worker processes. A rendered
+# page costs far more than a page of text, so shorter documents and smaller
+# page ranges already pay off.
+PPT_CHUNK_PAGES = int(os.environ.get('PPT_CHUNK_PAGES', 4))
+PPT_PARALLEL_MIN_PAGES = int(os.environ.get('PPT_PARALLEL_MIN_PAGES', 8))
+
+
+def pdf_to_ppt(pdf_file, layout='blank', mode='raster', image_format='JPEG', dpi=None, quality=None, max_workers=None):
+    """
+    Convert PDF to PowerPoint presentation using PyMuPDF
+
+    Args:
+        pdf_file: File object containing PDF
+        mode: 'raster' places each page as one image; 'vector' places the
+            page's text lines as editable text boxes and its images as
+            pictures (vector drawings are not carried over)
+        image_format: 'JPEG' or 'PNG' for raster slides
+        dpi: pixels per inch of slide area (defaults to PPT_SLIDE_DPI); the
+            render resolution is derived from it and the page size
+        quality: JPEG quality (defaults to PPT_JPEG_QUALITY)
+        max_workers: parallel render processes (defaults to TEXT_WORKERS)
+    """
     try:
         from pptx import Presentation
         from pptx.util import Inches
 
-        pdf_bytes = pdf_file.read()
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-
         # Create PowerPoint presentation
         prs = Presentation()
 
-        # Set slide dimensions (16:9 aspect ratio)
+        # Set slide dimensions (4:3 aspect ratio)
         prs.slide_width = Inches(10)
         prs.slide_height = Inches(7.5)
 
-        # Convert PDF pages to images
-        zoom = 200 / 72  # High DPI for quality
-        mat = fitz.Matrix(zoom, zoom)
-
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            pix = page.get_pixmap(matrix=mat)
+        # Pages fill 95% of the slide to leave some padding
+        box_width = prs.slide_width * 0.95
+        box_height = prs.slide_height * 0.95
 
-            # Convert to PIL Image
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-            # Add blank slide
-            blank_slide_layout = prs.slide_layouts[6]  # Blank layout
+        if mode == 'vector':
+            extract = page_layout
+        else:
+            extract = functools.partial(
+                render_slide_image, box_width=box_width / Inches(1), box_height=box_height / Inches(1),
+                slide_dpi=dpi or PPT_SLIDE_DPI, image_format=image_format.upper(),
+                quality=quality or PPT_JPEG_QUALITY,
+            )
+
+        # Pages are rendered in parallel and come back in page order
+        with stage('read'):
+            pdf_bytes = pdf_file.read()
+        tracing.annotate(mode=mode, format=image_format.upper(), dpi=dpi or PPT_SLIDE_DPI)
+        pages = iter_page_results(pdf_bytes, extract, max_workers, PPT_CHUNK_PAGES, PPT_PARALLEL_MIN_PAGES)
+        blank_slide_layout = prs.slide_layouts[6]  # Blank layout
+        for page in pages:
+            cancellation.check()
+            count_pages('pdf_to_ppt')
             slide = prs.slides.add_slide(blank_slide_layout)
 
-            # Convert PIL image to bytes
-            img_buffer = io.BytesIO()
-            img.save(img_buffer, format='PNG')
-            img_buffer.seek(0)
-
-            # Calculate image size to fit slide while maintaining aspect ratio
-            img_width, img_height = img.size
-            slide_width = prs.slide_width
-            slide_height = prs.slide_height
-
-            # Calculate scaling
-            width_ratio = slide_width / img_width
-            height_ratio = slide_height / img_height
-            scale_ratio = min(width_ratio, height_ratio) * 0.95  # 95% to add some padding
-
-            new_width = int(img_width * scale_ratio)
-            new_height = int(img_height * scale_ratio)
-
-            # Center image
-            left = (slide_width - new_width) / 2
-            top = (slide_height - new_height) / 2
+            # EMU per PDF point, fitting the page to the slide and centering it
+            page_width, page_height = page['size']
+            scale = min(box_width / page_width, box_height / page_height)
+            left = (prs.slide_width - page_width * scale) / 2
+            top = (prs.slide_height - page_height * scale) / 2
 
-            # Add image to slide
-            slide.shapes.add_picture(img_buffer, left, top, new_width, new_height)
-
-        pdf_document.close()
+            if mode == 'vector':
+                _add_slide_layout(slide, page, scale, left, top)
+            else:
+                tracing.observe('page_dpi', round(page['dpi'], 1))
+                slide.shapes.add_picture(io.BytesIO(page['image']), int(left), int(top),
+                                         int(page_width * scale), int(page_height * scale))
 
         # Save presentation
         output = io.BytesIO()
-        prs.save(output)
+        with stage('encode'):
+            prs.save(output)
         output.seek(0)
 
         return output
     except Exception as e:
         raise Exception(f"Error converting PDF to PPT: {str(e)}")
 
+
+def _add_slide_layout(slide, page, scale, left, top):
+    from pptx.dml.color import RGBColor
+    from pptx.enum.text import MSO_AUTO_SIZE
+    from pptx.util import Pt
+
+    def place(bbox):
+        x0, y0, x1, y1 = bbox
+        return (int(left + x0 * scale), int(top + y0 * scale),
+                max(1, int((x1 - x0) * scale)), max(1, int((y1 - y0) * scale)))
+
+    # Images first so text stays on top; python-pptx stores repeated images once
+    for image in page['images']:
+        slide.shapes.add_picture(io.BytesIO(image['image']), *place(image['bbox']))
+
+    for line in page['lines']:
+        x, y, width, height = place(line['bbox'])
+        rotation = line['rotation']
+        if rotation % 180 == 90:
+            # The box is turned about its centre, so swap its sides around it
+            x, y, width, height = x + (width - height) // 2, y + (height - width) // 2, height, width
+        shape = slide.shapes.add_textbox(x, y, width, height)
+        if rotation:
+            shape.rotation = rotation
+        frame = shape.text_frame
+        frame.word_wrap = False
+        frame.auto_size = MSO_AUTO_SIZE.NONE
+        frame.margin_left = frame.margin_right = frame.margin_top = frame.margin_bottom = 0
+        run = frame.paragraphs[0].add_run()
+        run.text = line['text']
+        run.font.size = Pt(max(1.0, round(line['size'] * scale / Pt(1), 1)))
+        run.font.bold = line['bold']
+        run.font.italic = line['italic']
+        run.font.color.rgb = RGBColor.from_string(f"{line['color']:06X}")
+
 def rotate_pdf_pages(pdf_file, rotation=90, pages='all'):
     """Rotate PDF pages using PyMuPDF
     rotation: 90, 180, or 270 degrees clockwise
@@ -619,33 +1218,36 @@ def rotate_pdf_pages(pdf_file, rotation=90, pages='all'):
     try:
         pdf_bytes = io.BytesIO(pdf_file.read())
         pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        total_pages = pdf_document.page_count
-
-        # Parse pages to rotate
-        pages_set = set()
-        if pages == 'all':
-            pages_set = set(range(1, total_pages + 1))
-        elif isinstance(pages, str):
-            ranges = pages.split(',')
-            for r in ranges:
-                r = r.strip()
-                if '-' in r:
-                    start, end = map(int, r.split('-'))
-                    pages_set.update(range(start, end + 1))
-                else:
-                    pages_set.add(int(r))
-        elif isinstance(pages, list):
-            pages_set = set(pages)
-
-        # Rotate specified pages
-        for page_num in range(total_pages):
-            if (page_num + 1) in pages_set:
-                page = pdf_document[page_num]
-                page.set_rotation(rotation)
+        try:
+            total_pages = pdf_document.page_count
+
+            # Parse pages to rotate
+            pages_set = set()
+            if pages == 'all':
+                pages_set = set(range(1, total_pages + 1))
+            elif isinstance(pages, str):
+                ranges = pages.split(',')
+                for r in ranges:
+                    r = r.strip()
+                    if '-' in r:
+                        start, end = map(int, r.split('-'))
+                        pages_set.update(range(start, end + 1))
+                    else:
+                        pages_set.add(int(r))
+            elif isinstance(pages, list):
+                pages_set = set(pages)
+
+            # Rotate specified pages
+            for page_num in range(total_pages):
+                cancellation.check()
+                if (page_num + 1) in pages_set:
+                    page = pdf_document[page_num]
+                    page.set_rotation(rotation)
 
-        output = io.BytesIO()
-        pdf_document.save(output)
-        pdf_document.close()
+            output = io.BytesIO()
+            pdf_document.save(output)
+        finally:
+            pdf_document.close()
         output.seek(0)
 
         return output
@@ -656,43 +1258,46 @@ def add_watermark(pdf_file, text, opacity=0.2, font_size=36, pages='all'):
     try:
         pdf_stream = io.BytesIO(pdf_file.read())
         doc = fitz.open(stream=pdf_stream, filetype="pdf")
-        total = doc.page_count
-        sel = set()
-        if pages == 'all':
-            sel = set(range(1, total + 1))
-        elif isinstance(pages, str):
-            for r in pages.split(','):
-                r = r.strip()
-                if '-' in r:
-                    s, e = map(int, r.split('-'))
-                    sel.update(range(s, e + 1))
-                else:
-                    sel.add(int(r))
-        elif isinstance(pages, list):
-            sel = set(pages)
-        for idx in range(total):
-            if (idx + 1) in sel:
-                page = doc[idx]
-                rect = page.rect
-                w = int(rect.width)
-                h = int(rect.height)
-                overlay = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-                txt = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-                draw = ImageDraw.Draw(txt)
-                try:
-                    font = ImageFont.truetype("arial.ttf", font_size)
-                except Exception:
-                    font = ImageFont.load_default()
-                draw.text((w // 2, h // 2), text, font=font, fill=(0, 0, 0, int(max(0, min(1, opacity)) * 255)), anchor="mm")
-                txt = txt.rotate(45, resample=Image.BICUBIC)
-                overlay = Image.alpha_composite(overlay, txt)
-                buf = io.BytesIO()
-                overlay.save(buf, format="PNG")
-                buf.seek(0)
-                page.insert_image(rect, stream=buf.getvalue())
-        out = io.BytesIO()
-        doc.save(out)
-        doc.close()
+        try:
+            total = doc.page_count
+            sel = set()
+            if pages == 'all':
+                sel = set(range(1, total + 1))
+            elif isinstance(pages, str):
+                for r in pages.split(','):
+                    r = r.strip()
+                    if '-' in r:
+                        s, e = map(int, r.split('-'))
+                        sel.update(range(s, e + 1))
+                    else:
+                        sel.add(int(r))
+            elif isinstance(pages, list):
+                sel = set(pages)
+            for idx in range(total):
+                cancellation.check()
+                if (idx + 1) in sel:
+                    page = doc[idx]
+                    rect = page.rect
+                    w = int(rect.width)
+                    h = int(rect.height)
+                    overlay = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+                    txt = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+                    draw = ImageDraw.Draw(txt)
+                    try:
+                        font = ImageFont.truetype("arial.ttf", font_size)
+                    except Exception:
+                        font = ImageFont.load_default()
+                    draw.text((w // 2, h // 2), text, font=font, fill=(0, 0, 0, int(max(0, min(1, opacity)) * 255)), anchor="mm")
+                    txt = txt.rotate(45, resample=Image.BICUBIC)
+                    overlay = Image.alpha_composite(overlay, txt)
+                    buf = io.BytesIO()
+                    overlay.save(buf, format="PNG")
+                    buf.seek(0)
+                    page.insert_image(rect, stream=buf.getvalue())
+            out = io.BytesIO()
+            doc.save(out)
+        finally:
+            doc.close()
         out.seek(0)
         return out
     except Exception as e:
@@ -0,0 +1,319 @@
+import cProfile
+import collections
+import hmac
+import io
+import json
+import os
+import pstats
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from metrics import call_when_sent
+
+# Admin token for X-Profile requests and the profile endpoints; empty
+# disables both
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN', '')
+
+# Requests slower than this are saved with a sampling profile; 0 disables
+# automatic capture. Every request is sampled while it runs and the samples
+# are dropped if it finishes in time.
+PROFILE_SLOW_MS = int(os.environ.get('PROFILE_SLOW_MS', 0))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 10))
+
+# Keep tracemalloc running so slow-request captures include a memory
+# snapshot too (it slows allocation-heavy code down noticeably)
+PROFILE_TRACEMALLOC = os.environ.get('PROFILE_TRACEMALLOC', '0') == '1'
+
+# Captures are kept here, newest PROFILE_KEEP only
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'profiles'))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+
+PROFILE_MODES = ['cprofile', 'sample']
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN_HEADER = 'X-Profile-Token'
+
+_PROFILE_ID = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{16}$')
+
+# Python 3.12 allows one cProfile per process; later requests fall back to
+# sampling while one is active
+_cprofile_lock = threading.Lock()
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _stack_key(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class _Sampler:
+    """Background thread recording the stacks of registered threads"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, thread_id):
+        stacks = collections.Counter()
+        with self._lock:
+            self._targets[thread_id] = stacks
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._thread.start()
+        return stacks
+
+    def remove(self, thread_id):
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._targets:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_stack_key(frame)] += 1
+
+
+_sampler = _Sampler(PROFILE_SAMPLE_INTERVAL_MS / 1000)
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+        _tracemalloc_users += 1
+        tracemalloc.reset_peak()
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and not PROFILE_TRACEMALLOC:
+            tracemalloc.stop()
+
+
+class Capture:
+    """Profile of one request, from its first hook until its body is sent
+
+    mode 'cprofile' traces every call on the request thread; 'sample'
+    records the thread's stack every PROFILE_SAMPLE_INTERVAL_MS. Work done
+    on other threads or processes shows as waiting.
+    """
+
+    def __init__(self, mode, trigger, route, method, trace_id):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{trace_id}"
+        self.trigger = trigger
+        self.route = route
+        self.method = method
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._thread_id = threading.get_ident()
+
+        self.profiler = None
+        if mode == 'cprofile' and _cprofile_lock.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.mode = 'cprofile' if self.profiler else 'sample'
+        self.stacks = _sampler.add(self._thread_id) if self.mode == 'sample' else None
+
+        self.memory = trigger == 'header' or tracemalloc.is_tracing()
+        if self.memory:
+            _start_tracemalloc()
+
+    def finish(self, status):
+        """Stop profiling; save the capture if it was requested or the request was slow"""
+        duration = time.perf_counter() - self._start
+        if self.profiler:
+            self.profiler.disable()
+            _cprofile_lock.release()
+        if self.stacks is not None:
+            _sampler.remove(self._thread_id)
+
+        snapshot = peak = None
+        if self.memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            _stop_tracemalloc()
+
+        if self.trigger == 'slow' and duration * 1000 < PROFILE_SLOW_MS:
+            return None
+        return self._save(status, duration, snapshot, peak)
+
+    def _save(self, status, duration, snapshot, peak):
+        path = os.path.join(PROFILE_DIR, self.id)
+        os.makedirs(path, exist_ok=True)
+        meta = {
+            'id': self.id,
+            'route': self.route,
+            'method': self.method,
+            'status': status,
+            'trigger': self.trigger,
+            'mode': self.mode,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started)),
+            'duration_ms': round(duration * 1000, 2),
+            'peak_traced_bytes': peak,
+        }
+
+        if self.profiler:
+            self.profiler.dump_stats(os.path.join(path, 'profile.prof'))
+            summary = io.StringIO()
+            pstats.Stats(self.profiler, stream=summary).sort_stats('cumulative').print_stats(60)
+            _write_text(os.path.join(path, 'profile.txt'), summary.getvalue())
+        else:
+            meta['samples'] = sum(self.stacks.values())
+            # Collapsed stacks, one "frame;frame;frame count" line each, as
+            # read by flamegraph.pl and speedscope
+            lines = [f'{stack} {count}' for stack, count in self.stacks.most_common()]
+            _write_text(os.path.join(path, 'stacks.txt'), '\n'.join(lines) + '\n')
+            _write_text(os.path.join(path, 'profile.txt'), _sample_summary(self.stacks))
+
+        if snapshot is not None:
+            _write_text(os.path.join(path, 'memory.txt'), _memory_summary(snapshot, peak))
+
+        _write_text(os.path.join(path, 'meta.json'), json.dumps(meta, indent=2))
+        prune_profiles()
+        return self.id
+
+
+def _write_text(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def _sample_summary(stacks, limit=40):
+    total = sum(stacks.values()) or 1
+    leaf, inclusive = collections.Counter(), collections.Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        leaf[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+    lines = [f'{total} samples', '', 'Self (where the thread was):']
+    lines += [f'{count / total:7.1%}  {frame}' for frame, count in leaf.most_common(limit)]
+    lines += ['', 'Inclusive (on the stack):']
+    lines += [f'{count / total:7.1%}  {frame}' for frame, count in inclusive.most_common(limit)]
+    return '\n'.join(lines) + '\n'
+
+
+def _memory_summary(snapshot, peak, limit=30):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+    lines = [f'Peak traced memory during the request: {peak / 1024 / 1024:.1f} MB', '',
+             f'Largest live allocations at the end of the request (top {limit}):']
+    for stat in snapshot.statistics('traceback')[:limit]:
+        lines.append(f'{stat.size / 1024:10.1f} KiB in {stat.count} blocks')
+        lines.extend(f'    {line}' for line in stat.traceback.format(limit=6))
+    return '\n'.join(lines) + '\n'
+
+
+def is_admin(request):
+    """True when the request carries the configured admin token"""
+    token = request.headers.get(PROFILE_TOKEN_HEADER, '')
+    return bool(PROFILE_ADMIN_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode())
+
+
+def prune_profiles():
+    """Delete all but the newest PROFILE_KEEP captures"""
+    try:
+        entries = sorted(entry for entry in os.listdir(PROFILE_DIR) if _PROFILE_ID.match(entry))
+    except FileNotFoundError:
+        return
+    for entry in entries[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else entries:
+        shutil.rmtree(os.path.join(PROFILE_DIR, entry), ignore_errors=True)
+
+
+def list_profiles():
+    """Metadata of the stored captures, newest first"""
+    try:
+        entries = sorted((entry for entry in os.listdir(PROFILE_DIR) if _PROFILE_ID.match(entry)), reverse=True)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for entry in entries:
+        try:
+            with open(os.path.join(PROFILE_DIR, entry, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta['files'] = sorted(os.listdir(os.path.join(PROFILE_DIR, entry)))
+        profiles.append(meta)
+    return profiles
+
+
+def iter_profile_files(profile_id):
+    """(filename, bytes) for each file of a capture; raises KeyError if unknown"""
+    path = os.path.join(PROFILE_DIR, profile_id or '')
+    if not _PROFILE_ID.match(profile_id or '') or not os.path.isdir(path):
+        raise KeyError(profile_id)
+    files = []
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), 'rb') as f:
+            files.append((f'{profile_id}/{name}', f.read()))
+    return files
+
+
+def install(app):
+    """Profile requests that ask for it (X-Profile with the admin token) or run slow
+
+    Must be installed after metrics.instrument_app, whose trace id names
+    each capture.
+    """
+    from flask import g, request
+
+    if PROFILE_TRACEMALLOC and not tracemalloc.is_tracing():
+        tracemalloc.start(25)
+
+    @app.before_request
+    def _start_profile():
+        if request.path.startswith('/debug/profiles'):
+            return
+        mode = request.headers.get(PROFILE_HEADER, '').lower()
+        if mode and is_admin(request):
+            trigger = 'header'
+            if mode not in PROFILE_MODES:
+                mode = 'cprofile'
+        elif PROFILE_SLOW_MS > 0:
+            trigger, mode = 'slow', 'sample'
+        else:
+            return
+        trace = g.get('trace')
+        g.profile_capture = Capture(mode, trigger, g.get('metrics_route', request.path), request.method,
+                                    trace.id if trace else os.urandom(8).hex())
+
+    @app.after_request
+    def _finish_profile(response):
+        capture = g.pop('profile_capture', None)
+        if capture is None:
+            return response
+        if capture.trigger == 'header':
+            response.headers['X-Profile-Id'] = capture.id
+        status = response.status_code
+
+        def done(sent):
+            try:
+                capture.finish(status)
+            except Exception as e:
+                print(f"Warning: Could not save profile {capture.id}: {e}")
+
+        call_when_sent(response, done)
+        return response
@@ -0,0 +1,149 @@
+import io
+import math
+import os
+from PIL import Image
+from large_image import TILED_MODES, fit_size, is_large_image, strip_decodable
+import tracing
+
+# Decoded-size budgets, checked from image headers and page boxes before any
+# raster is allocated. The pixel count of a single image is capped by
+# MAX_IMAGE_PIXELS (image_converter), which is also Pillow's own
+# decompression-bomb limit. That limit is raised well above Pillow's default
+# for the strip pipeline, so every Image.open of an upload or stored image
+# goes through check_image first.
+
+# Largest raster one image may decode to in a single piece. Images the strip
+# pipeline decodes a strip at a time (raw, striped and tiled files) only
+# need to stay under MAX_IMAGE_PIXELS.
+GUARD_MAX_DECODED_MB = int(os.environ.get('GUARD_MAX_DECODED_MB', 1024))
+
+# Largest page raster rendered in one piece. Bigger pages are rendered at a
+# lower DPI, or in strips where the output can be encoded strip by strip.
+GUARD_MAX_PAGE_PIXELS = int(os.environ.get('GUARD_MAX_PAGE_PIXELS', 50_000_000))
+
+# Pixels one request may render over all of its pages. Larger requests are
+# rendered at the DPI that fits, but never below GUARD_MIN_DPI.
+GUARD_MAX_RENDER_PIXELS = int(os.environ.get('GUARD_MAX_RENDER_PIXELS', 1_000_000_000))
+GUARD_MIN_DPI = int(os.environ.get('GUARD_MIN_DPI', 36))
+
+
+class ResourceLimitError(Exception):
+    """
+    A request would decode or render more than the configured budgets
+
+    code names the budget that was exceeded ('image_pixels',
+    'decoded_bytes' or 'render_pixels', or 'invalid_dpi'); limit and
+    requested are in that budget's unit. status is the HTTP status to
+    answer with.
+    """
+
+    def __init__(self, message, code, limit=None, requested=None, status=413):
+        super().__init__(message, code, limit, requested, status)
+        self.message = message
+        self.code = code
+        self.limit = limit
+        self.requested = requested
+        self.status = status
+
+    def __str__(self):
+        return self.message
+
+    def to_dict(self):
+        return {'error': self.message, 'code': self.code, 'limit': self.limit, 'requested': self.requested}
+
+
+def check_raster(width, height, bands):
+    """Raise ResourceLimitError if a width x height raster would exceed GUARD_MAX_DECODED_MB"""
+    decoded = width * height * bands
+    budget = GUARD_MAX_DECODED_MB * 1024 * 1024
+    if decoded > budget:
+        raise ResourceLimitError(
+            f'Image is too large to decode: {width}x{height} pixels need {decoded // (1024 * 1024)} MB, '
+            f'the limit is {GUARD_MAX_DECODED_MB} MB',
+            'decoded_bytes', budget, decoded)
+
+
+def open_image(image_data):
+    """Image.open for encoded bytes, raising ResourceLimitError for decompression bombs"""
+    try:
+        return Image.open(io.BytesIO(image_data))
+    except Image.DecompressionBombError as e:
+        # More than twice MAX_IMAGE_PIXELS: Pillow refuses to open it at all
+        raise ResourceLimitError(str(e), 'image_pixels', Image.MAX_IMAGE_PIXELS)
+
+
+def check_image(image_data, max_size=None, streamed=False):
+    """
+    Check an encoded image against the decode budgets, from its header only
+
+    streamed: the image goes through large_image's strip pipeline (as
+    image_converter does when converting), which decodes raw, striped and
+    tiled files a strip at a time and shrinks JPEGs to max_size while
+    decoding. Otherwise the whole image is assumed decoded at full size.
+    Raises ResourceLimitError if the image has more than MAX_IMAGE_PIXELS
+    or would decode into more than GUARD_MAX_DECODED_MB at once. Returns
+    the image size.
+    """
+    with open_image(image_data) as img:
+        size = img.size
+        if size[0] * size[1] > Image.MAX_IMAGE_PIXELS:
+            raise ResourceLimitError(
+                f'Image is too large: {size[0]}x{size[1]} pixels, the limit is {Image.MAX_IMAGE_PIXELS:,} pixels',
+                'image_pixels', Image.MAX_IMAGE_PIXELS, size[0] * size[1])
+        if streamed and img.mode in TILED_MODES and (max_size or is_large_image(img)):
+            if strip_decodable(img):
+                return size
+            if img.format == 'JPEG' and max_size:
+                # The reduced decode convert_large_image asks for; draft only
+                # updates the header size here
+                img.draft('RGB' if img.mode not in ('L', 'RGB') else img.mode, fit_size(size, max_size))
+        check_raster(img.width, img.height, len(img.getbands()))
+        return size
+
+
+def page_pixels(rect, dpi):
+    """Pixels in a render of rect (in points) at dpi"""
+    return (rect.width * dpi / 72) * (rect.height * dpi / 72)
+
+
+def clamp_dpi(rect, dpi):
+    """Highest DPI, up to dpi, at which rect renders within GUARD_MAX_PAGE_PIXELS"""
+    pixels = page_pixels(rect, dpi)
+    if pixels <= GUARD_MAX_PAGE_PIXELS:
+        return dpi
+    return dpi * math.sqrt(GUARD_MAX_PAGE_PIXELS / pixels)
+
+
+def render_dpi(rects, dpi, tiled=False):
+    """
+    DPI to render pages of sizes rects at, within GUARD_MAX_RENDER_PIXELS
+
+    Pages count at their clamp_dpi size unless tiled (rendered in strips at
+    the full DPI). Requests over the budget get the highest DPI that fits;
+    raises ResourceLimitError if not even GUARD_MIN_DPI fits or dpi is not
+    positive.
+    """
+    if not dpi > 0:
+        raise ResourceLimitError('dpi must be a positive number', 'invalid_dpi', requested=dpi, status=400)
+
+    def total(value):
+        return sum(page_pixels(rect, value if tiled else clamp_dpi(rect, value)) for rect in rects)
+
+    requested = total(dpi)
+    if requested <= GUARD_MAX_RENDER_PIXELS:
+        return dpi
+    if total(GUARD_MIN_DPI) > GUARD_MAX_RENDER_PIXELS:
+        raise ResourceLimitError(
+            f'Rendering {len(rects)} pages at {dpi} dpi needs {int(requested):,} pixels, the limit is '
+            f'{GUARD_MAX_RENDER_PIXELS:,} pixels even at {GUARD_MIN_DPI} dpi',
+            'render_pixels', GUARD_MAX_RENDER_PIXELS, int(requested))
+    # Clamped pages stop growing with the DPI, so search rather than solve
+    low, high = GUARD_MIN_DPI, dpi
+    for _ in range(20):
+        middle = (low + high) / 2
+        if total(middle) <= GUARD_MAX_RENDER_PIXELS:
+            low = middle
+        else:
+            high = middle
+    tracing.annotate(render_dpi=round(low, 1))
+    return low
@@ -0,0 +1,93 @@
+import io
+import math
+import os
+import fitz  # PyMuPDF
+from PIL import Image
+from resource_guard import check_image, clamp_dpi
+
+# Pixels per inch of slide area used for rendered pages. 150 keeps text crisp
+# on a full-screen 1080p projection; the page's own size does not matter.
+PPT_SLIDE_DPI = int(os.environ.get('PPT_SLIDE_DPI', 150))
+
+# Quality for JPEG slide images
+PPT_JPEG_QUALITY = int(os.environ.get('PPT_JPEG_QUALITY', 85))
+
+PPT_MODES = ['raster', 'vector']
+PPT_IMAGE_FORMATS = ['JPEG', 'PNG']
+
+# Image types python-pptx can embed as they are; others become PNG
+_PPTX_IMAGE_EXTS = {'png', 'jpeg', 'jpg', 'gif', 'bmp', 'tiff', 'tif'}
+
+
+def render_dpi(page_rect, box_width, box_height, slide_dpi=PPT_SLIDE_DPI):
+    """Render DPI that gives slide_dpi once the page is fitted into the box (inches)"""
+    fit = min(box_width / (page_rect.width / 72), box_height / (page_rect.height / 72))
+    return max(1.0, slide_dpi * fit)
+
+
+def render_slide_image(page, box_width, box_height, slide_dpi=PPT_SLIDE_DPI,
+                       image_format='JPEG', quality=PPT_JPEG_QUALITY):
+    """
+    Render a page sized for a slide area of box_width x box_height inches
+
+    Returns a dict with the encoded image, the displayed page size in points
+    and the slide DPI the image has. The pixmap is encoded by PyMuPDF
+    directly, without a copy through Pillow, and kept within the
+    resource_guard page pixel budget, which can leave it below slide_dpi.
+    """
+    requested = render_dpi(page.rect, box_width, box_height, slide_dpi)
+    zoom = clamp_dpi(page.rect, requested) / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    if image_format == 'PNG':
+        data = pix.tobytes('png')
+    else:
+        data = pix.tobytes('jpeg', jpg_quality=quality)
+    return {'image': data, 'size': (page.rect.width, page.rect.height), 'dpi': slide_dpi * zoom * 72 / requested}
+
+
+def _pptx_image(block):
+    if block['ext'].lower() in _PPTX_IMAGE_EXTS:
+        return block['image']
+    try:
+        check_image(block['image'])
+        buffer = io.BytesIO()
+        with Image.open(io.BytesIO(block['image'])) as img:
+            img.convert('RGBA' if 'A' in img.getbands() else 'RGB').save(buffer, format='PNG')
+        return buffer.getvalue()
+    except Exception:
+        return None
+
+
+def page_layout(page):
+    """
+    Text lines and images of a page, positioned on the page as displayed
+
+    Returns a dict with 'size' (width, height in points), 'images' as
+    {'bbox', 'image'} and 'lines' as {'bbox', 'rotation', 'text', 'size',
+    'bold', 'italic', 'color'}, taking the style of each line's first span.
+    rotation is the clockwise angle of the text as displayed, in degrees.
+    """
+    matrix = page.rotation_matrix
+    lines, images = [], []
+    for block in page.get_text('dict')['blocks']:
+        if block['type'] == 1:
+            data = _pptx_image(block)
+            if data:
+                images.append({'bbox': tuple(fitz.Rect(block['bbox']) * matrix), 'image': data})
+            continue
+        for line in block['lines']:
+            spans = [span for span in line['spans'] if span['text'].strip()]
+            if not spans:
+                continue
+            first = spans[0]
+            angle = math.degrees(math.atan2(line['dir'][1], line['dir'][0])) + page.rotation
+            lines.append({
+                'bbox': tuple(fitz.Rect(line['bbox']) * matrix),
+                'rotation': round(angle) % 360,
+                'text': ''.join(span['text'] for span in line['spans']).strip(),
+                'size': first['size'],
+                'bold': bool(first['flags'] & 16),
+                'italic': bool(first['flags'] & 2),
+                'color': first['color'],
+            })
+    return {'size': (page.rect.width, page.rect.height), 'lines': lines, 'images': images}
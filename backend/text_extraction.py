@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
+
+# Worker processes used for text extraction. PyMuPDF holds the GIL while it
+# parses, so threads would not help; separate processes do.
+TEXT_WORKERS = int(os.environ.get('TEXT_WORKERS', os.cpu_count() or 1))
+
+# Pages handed to a worker per task. Larger ranges amortize task overhead,
+# smaller ones let the first pages reach the client sooner.
+TEXT_CHUNK_PAGES = int(os.environ.get('TEXT_CHUNK_PAGES', 16))
+
+# Documents shorter than this are read inline; starting work in other
+# processes costs more than it saves
+PARALLEL_MIN_PAGES = int(os.environ.get('PARALLEL_MIN_PAGES', 64))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    # Created on first use and shared by all requests. 'spawn' avoids forking
+    # a multi-threaded server process.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=TEXT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def page_text(page):
+    """Plain text of a page"""
+    return page.get_text()
+
+
+def page_tables(page):
+    """Rows of every table PyMuPDF finds on a page, plus the page text"""
+    tables = [table.extract() for table in page.find_tables().tables]
+    return {'tables': tables, 'text': page.get_text()}
+
+
+def page_text_and_images(page):
+    """Page text and the xrefs of the images it shows, in display order"""
+    return {'text': page.get_text(), 'images': [image[0] for image in page.get_images()]}
+
+
+def _extract_range(path, start, stop, extract):
+    # Runs in a worker process. Opening a PDF only reads its cross-reference
+    # table, which is cheap next to extracting a range of pages.
+    with fitz.open(path) as doc:
+        return [extract(doc[page_num]) for page_num in range(start, stop)]
+
+
+def iter_page_texts(pdf_bytes, max_workers=None, chunk_pages=None):
+    """Yield the text of every page of a PDF, in page order"""
+    return iter_page_results(pdf_bytes, page_text, max_workers, chunk_pages)
+
+
+def iter_page_results(pdf_bytes, extract, max_workers=None, chunk_pages=None, min_pages=None):
+    """
+    Yield extract(page) for every page of a PDF, in page order
+
+    Long documents are split into page ranges that worker processes read in
+    parallel; results are yielded in order as soon as each range and all
+    earlier ones are done, with a bounded number of ranges in flight.
+
+    Args:
+        pdf_bytes: the PDF file content
+        extract: module-level function of one page, or a functools.partial
+            of one (it is sent to workers by name), e.g. page_text or
+            page_tables
+        max_workers: parallel ranges in flight (defaults to TEXT_WORKERS)
+        chunk_pages: pages per range (defaults to TEXT_CHUNK_PAGES)
+        min_pages: shorter documents are read inline (defaults to
+            PARALLEL_MIN_PAGES)
+    """
+    pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    page_count = pdf_document.page_count
+    workers = max(1, max_workers or TEXT_WORKERS)
+    if min_pages is None:
+        min_pages = PARALLEL_MIN_PAGES
+    if workers == 1 or page_count < min_pages:
+        return _iter_inline(pdf_document, extract)
+    pdf_document.close()
+    return _iter_parallel(pdf_bytes, page_count, extract, workers, chunk_pages or TEXT_CHUNK_PAGES)
+
+
+def _iter_inline(pdf_document, extract):
+    try:
+        for page in pdf_document:
+            yield extract(page)
+    finally:
+        pdf_document.close()
+
+
+def _iter_parallel(pdf_bytes, page_count, extract, workers, chunk_pages):
+    # Workers open the document from a temporary file rather than receiving
+    # a copy of the bytes with every task
+    fd, path = tempfile.mkstemp(suffix='.pdf', prefix='text_extract_')
+    pending = deque()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf_bytes)
+
+        pool = _get_pool()
+        ranges = iter(range(0, page_count, chunk_pages))
+        for start in ranges:
+            pending.append(pool.submit(_extract_range, path, start, min(start + chunk_pages, page_count), extract))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            texts = pending.popleft().result()
+            start = next(ranges, None)
+            if start is not None:
+                pending.append(pool.submit(_extract_range, path, start, min(start + chunk_pages, page_count), extract))
+            yield from texts
+    finally:
+        for future in pending:
+            future.cancel()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
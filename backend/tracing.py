@@ -0,0 +1,172 @@
+import contextvars
+import datetime
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+import uuid
+
+# One JSON line per request on stderr; set TRACE_LOG=0 to turn it off
+TRACE_LOG = os.environ.get('TRACE_LOG', '1') != '0'
+
+# Also append the JSON lines to this file (rotated at TRACE_FILE_MAX_MB,
+# keeping TRACE_FILE_BACKUPS old files); empty disables the file exporter
+TRACE_FILE = os.environ.get('TRACE_FILE', '')
+TRACE_FILE_MAX_MB = int(os.environ.get('TRACE_FILE_MAX_MB', 20))
+TRACE_FILE_BACKUPS = int(os.environ.get('TRACE_FILE_BACKUPS', 3))
+
+_current = contextvars.ContextVar('trace', default=None)
+
+_logger = logging.getLogger('trace')
+_logger.setLevel(logging.INFO)
+_logger.propagate = False
+if TRACE_LOG:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    _logger.addHandler(_handler)
+if TRACE_FILE:
+    _handler = logging.handlers.RotatingFileHandler(
+        TRACE_FILE, maxBytes=TRACE_FILE_MAX_MB * 1024 * 1024, backupCount=TRACE_FILE_BACKUPS, encoding='utf-8')
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    _logger.addHandler(_handler)
+
+
+class Trace:
+    """Span durations and attributes collected while handling one request
+
+    Spans with the same name are summed; work done on several threads at
+    once can add up to more than the request's wall time.
+    """
+
+    def __init__(self, route, method):
+        self.id = uuid.uuid4().hex[:16]
+        self.route = route
+        self.method = method
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.spans = {}
+        self.values = {}
+        self.attrs = {}
+        self.pages = 0
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds):
+        with self._lock:
+            span = self.spans.setdefault(name, [0.0, 0, 0.0])
+            span[0] += seconds
+            span[1] += 1
+            span[2] = max(span[2], seconds)
+
+    def add_pages(self, count):
+        with self._lock:
+            self.pages += count
+
+    def set_attrs(self, attrs):
+        with self._lock:
+            self.attrs.update(attrs)
+
+    def add_value(self, name, value):
+        with self._lock:
+            stats = self.values.setdefault(name, [value, value, 0, 0])
+            stats[0] = min(stats[0], value)
+            stats[1] = max(stats[1], value)
+            stats[2] += value
+            stats[3] += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def server_timing(self):
+        """Server-Timing header value for the spans finished so far"""
+        with self._lock:
+            spans = sorted(self.spans.items())
+        entries = [f'{name};dur={total * 1000:.1f};desc="x{count}"' for name, (total, count, _) in spans]
+        entries.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(entries)
+
+    def to_dict(self, status=None, request_bytes=None, response_bytes=None):
+        with self._lock:
+            spans = {name: {'ms': round(total * 1000, 2), 'count': count, 'max_ms': round(longest * 1000, 2)}
+                     for name, (total, count, longest) in sorted(self.spans.items())}
+            values = {name: {'min': low, 'max': high, 'mean': round(total / count, 2), 'count': count}
+                      for name, (low, high, total, count) in sorted(self.values.items())}
+            attrs = dict(self.attrs)
+        return {
+            'trace_id': self.id,
+            'time': datetime.datetime.fromtimestamp(self.started, datetime.timezone.utc).isoformat(),
+            'route': self.route,
+            'method': self.method,
+            'status': status,
+            'duration_ms': round(self.elapsed() * 1000, 2),
+            'request_bytes': request_bytes,
+            'response_bytes': response_bytes,
+            'pages': self.pages,
+            'spans': spans,
+            'values': values,
+            'attrs': attrs,
+        }
+
+
+def start_trace(route, method):
+    """Begin a trace for the current request and make it current"""
+    trace = Trace(route, method)
+    _current.set(trace)
+    return trace
+
+
+def finish_trace(trace, status, request_bytes, response_bytes):
+    """Write the trace's JSON line to the enabled exporters"""
+    if _current.get() is trace:
+        _current.set(None)
+    if _logger.handlers:
+        _logger.info(json.dumps(trace.to_dict(status, request_bytes, response_bytes), separators=(',', ':')))
+
+
+def current_trace():
+    """The trace of the request being handled, or None outside a request"""
+    return _current.get()
+
+
+def record_span(name, seconds):
+    trace = _current.get()
+    if trace is not None:
+        trace.add_span(name, seconds)
+
+
+def record_pages(count):
+    trace = _current.get()
+    if trace is not None:
+        trace.add_pages(count)
+
+
+def annotate(**attrs):
+    """Attach fixed request attributes, e.g. dpi or output format, to the trace"""
+    trace = _current.get()
+    if trace is not None:
+        trace.set_attrs(attrs)
+
+
+def observe(name, value):
+    """Add a per-page value, e.g. render DPI or image bytes; traces keep min/max/mean"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add_value(name, value)
+
+
+def lowest(name):
+    """Smallest value observed under name in the current trace, or None"""
+    trace = _current.get()
+    if trace is None:
+        return None
+    with trace._lock:
+        stats = trace.values.get(name)
+    return stats[0] if stats else None
+
+
+def bind(fn):
+    """fn wrapped to run in the current context, for work handed to a thread pool"""
+    return functools.partial(contextvars.copy_context().run, fn)
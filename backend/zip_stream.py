@@ -0,0 +1,57 @@
+import zipfile
+from metrics import stage
+
+
+class _ChunkBuffer:
+    """Write-only sink that zipfile can write into without seeking"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """Yield a ZIP archive chunk by chunk
+
+    entries: iterable of (filename, bytes) pairs. Each entry is written and
+    flushed to the caller as soon as it is produced, so only one member is
+    buffered at a time.
+    """
+    sink = _ChunkBuffer()
+    used_names = set()
+    with zipfile.ZipFile(sink, 'w', compression) as zip_file:
+        for filename, data in entries:
+            name = _unique_name(filename, used_names)
+            with stage('zip'):
+                zip_file.writestr(name, data)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
+
+
+def _unique_name(filename, used_names):
+    # Two uploads called "scan.png" must not overwrite each other in the archive
+    name = filename
+    counter = 1
+    while name in used_names:
+        stem, dot, ext = filename.rpartition('.')
+        if not dot:
+            stem, ext = filename, ''
+        name = f"{stem}_{counter}.{ext}" if ext else f"{stem}_{counter}"
+        counter += 1
+    used_names.add(name)
+    return name